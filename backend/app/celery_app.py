@@ -1,10 +1,64 @@
+import os
+import time
+
 from celery import Celery
+from celery.signals import before_task_publish
+from kombu import Queue
+
 from app.core.config import settings
+from app.services.transcode_scheduler import TRANSCODE_PLAN
+
+# --- Очереди задач в порядке приоритета (от самой срочной) ---
+QUEUE_THUMBNAILS = "thumbnails"  # Миниатюры свежих загрузок — их ждет пользователь
+QUEUE_TRANSCODE_NEW = "transcode_new"  # Транскодирование новых загрузок
+QUEUE_TRANSCODE_REENCODE = "transcode_reencode"  # Перекодирование библиотеки
+QUEUE_BACKUPS = "backups"  # Бэкапы и восстановление (могут идти часами)
+QUEUE_MAINTENANCE = "maintenance"  # Короткие фоновые задачи (планирование перекодирования, отложенная очистка)
+QUEUES = (QUEUE_THUMBNAILS, QUEUE_TRANSCODE_NEW, QUEUE_TRANSCODE_REENCODE, QUEUE_BACKUPS, QUEUE_MAINTENANCE)
+
+# Число процессов воркера на очередь; переопределяется CELERY_<QUEUE>_CONCURRENCY.
+# Отдельные воркеры на очередь (см. app.workers) не дают бэкапу занять слоты миниатюр
+DEFAULT_QUEUE_CONCURRENCY = {
+    QUEUE_THUMBNAILS: 2,
+    QUEUE_TRANSCODE_NEW: TRANSCODE_PLAN.max_jobs,
+    QUEUE_TRANSCODE_REENCODE: 1,
+    QUEUE_BACKUPS: 1,
+    QUEUE_MAINTENANCE: 1,
+}
+QUEUE_CONCURRENCY = {
+    queue: int(os.getenv(f"CELERY_{queue.upper()}_CONCURRENCY", str(concurrency)))
+    for queue, concurrency in DEFAULT_QUEUE_CONCURRENCY.items()
+}
+ENQUEUED_AT_HEADER = "enqueued_at"
 
 # Создаем общий экземпляр Celery
 celery_app = Celery('myapp')
 celery_app.conf.broker_url = settings.CELERY_BROKER_URL
 celery_app.conf.result_backend = settings.CELERY_RESULT_BACKEND
 
+celery_app.conf.task_queues = [Queue(queue) for queue in QUEUES]
+celery_app.conf.task_default_queue = QUEUE_TRANSCODE_REENCODE
+celery_app.conf.task_routes = {
+    "app.tasks.generate_thumbnail.*": {"queue": QUEUE_THUMBNAILS},
+    "app.tasks.backup_tasks.*": {"queue": QUEUE_BACKUPS},
+    "app.tasks.backup_restore.*": {"queue": QUEUE_BACKUPS},
+    # Короткая задача (только БД): свой воркер, чтобы не ждать за длинными перекодированиями,
+    # которые она ставит, и не занимать слоты миниатюр
+    "app.tasks.transcode_tasks.transcode_backfill_batch_task": {"queue": QUEUE_MAINTENANCE},
+    "app.tasks.transcode_tasks.delete_transcoded_output_task": {"queue": QUEUE_MAINTENANCE},
+    # Транскодирование маршрутизируется явно при постановке (новая загрузка или перекодирование)
+}
+# Воркер, слушающий несколько очередей, опрашивает их строго в порядке QUEUES (Redis)
+celery_app.conf.broker_transport_options = {"queue_order_strategy": "priority"}
+# Не резервировать задачи впрок: длинная задача не должна держать за собой очередь миниатюр
+celery_app.conf.worker_prefetch_multiplier = 1
+
 # Автоматически искать задачи в пакете app.tasks
-celery_app.autodiscover_tasks(['app.tasks'])
\ No newline at end of file
+celery_app.autodiscover_tasks(['app.tasks'])
+
+
+@before_task_publish.connect
+def _stamp_enqueued_at(headers=None, **kwargs):
+    """Время постановки в очередь — по нему считается возраст ожидающих задач."""
+    if headers is not None:
+        headers.setdefault(ENQUEUED_AT_HEADER, time.time())
@@ -59,3 +59,12 @@ s3_client = boto3.client(
     aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
     aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
 )
+
+# Клиент для presigned URL, которые открывает браузер: подпись включает хост,
+# поэтому endpoint должен быть доступен снаружи (например, http://localhost:9000 вместо http://minio:9000)
+s3_public_client = boto3.client(
+    "s3",
+    endpoint_url=os.getenv("AWS_S3_PUBLIC_ENDPOINT_URL") or settings.AWS_S3_ENDPOINT_URL,
+    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+)
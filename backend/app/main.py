@@ -48,7 +48,9 @@ from app.routers import (
     backup_router,
     file_router,
     group_router,
+    queue_router,
     tag_router,
+    transcode_router,
     user_router
 )
 
@@ -58,19 +60,14 @@ api_app.include_router(group_router.router)
 api_app.include_router(tag_router.router)
 api_app.include_router(backup_router.router)
 api_app.include_router(user_router.router)
+api_app.include_router(queue_router.router)
+api_app.include_router(transcode_router.router)
 
 # Подключаем api_app к основному app с префиксом /api
 app.mount("/api", api_app)
 
-from celery import Celery
-from app.core.config import settings
-
-celery_app = Celery('myapp')
-celery_app.conf.broker_url = settings.CELERY_BROKER_URL
-celery_app.conf.result_backend = settings.CELERY_RESULT_BACKEND
-
-# Автоматически искать задачи в пакете app.tasks
-celery_app.autodiscover_tasks(['app.tasks'])
+# Единый экземпляр Celery с очередями и маршрутизацией задач
+from app.celery_app import celery_app
 
 
 if __name__ == "__main__":
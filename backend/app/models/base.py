@@ -2,7 +2,7 @@ import uuid
 
 from sqlalchemy import TIMESTAMP, Float
 from sqlalchemy import UUID as UUIDType
-from sqlalchemy import Boolean, Column, ForeignKey, BigInteger, String, Table, Text, func
+from sqlalchemy import Boolean, Column, ForeignKey, BigInteger, Integer, String, Table, Text, func
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 
@@ -51,6 +51,10 @@ class File(Base):
     hls_manifest_path = Column(Text) # Путь к основному .m3u8 файлу в S3
     # Можно добавить поле для хранения информации о рендициях, если нужно
     renditions_info = Column(JSONB) # [{"path": "...", "bitrate": 1000000, "resolution": "1280x720"}, ...]
+    # Прогресс транскодирования для UI: {"percent": 42.0, "segments_done": 12, "playable": true, ...}
+    transcoding_progress = Column(JSONB)
+    # SHA-256 содержимого оригинала: одинаковые загрузки используют общий результат транскодирования
+    content_hash = Column(String(64), index=True)
     # Добавляем поле для длительности видео (в секундах)
     duration = Column(Float) # NULLABLE по умолчанию, для не-видео файлов или если не определено
     owner_id = Column(UUIDType(as_uuid=True), ForeignKey("users.id"), nullable=False)
@@ -66,6 +70,58 @@ class File(Base):
     category = relationship("Category", back_populates="files")
 
 
+class Blob(Base):
+    """Оригинал в контентно-адресуемом хранилище (blobs/<sha256>), общий для одинаковых загрузок."""
+
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    key = Column(Text, unique=True, nullable=False) # blobs/<sha256>
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=1) # Количество файлов, ссылающихся на объект
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+
+
+class TranscodedAsset(Base):
+    """Результат транскодирования, общий для файлов с одинаковым содержимым."""
+
+    __tablename__ = "transcoded_assets"
+
+    content_hash = Column(String(64), primary_key=True)
+    base_path = Column(Text, unique=True, nullable=False) # transcoded/<id файла, который транскодировался>
+    hls_manifest_path = Column(Text)
+    dash_manifest_path = Column(Text)
+    duration = Column(Float)
+    ladder = Column(String(32)) # Версия лестницы рендитций, по которой получен результат
+    ref_count = Column(Integer, nullable=False, default=1) # Количество файлов, ссылающихся на результат
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+
+
+class TranscodeBackfill(Base):
+    """Пакетное перетранскодирование библиотеки: фильтры, курсор и счетчики прогресса."""
+
+    __tablename__ = "transcode_backfills"
+
+    id = Column(UUIDType(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    filters = Column(JSONB, nullable=False) # Критерии отбора файлов
+    status = Column(String(20), nullable=False, default="running") # "running", "paused", "completed"
+    cursor = Column(UUIDType(as_uuid=True)) # id последнего просмотренного файла (обход по возрастанию id)
+    rate_per_minute = Column(Integer, nullable=False) # Файлов в минуту; порция — на BACKFILL_BATCH_INTERVAL_SECONDS
+    max_queue_depth = Column(Integer, nullable=False)
+    # Поколение цепочки порций: растет при возобновлении, задачи прежней цепочки отбрасываются
+    generation = Column(Integer, nullable=False, default=0, server_default="0")
+    total = Column(Integer, nullable=False, default=0) # Кандидатов на момент запуска
+    enqueued = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0) # Уже в очереди или в работе
+    completed = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    created_by = Column(UUIDType(as_uuid=True), ForeignKey("users.id"))
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    updated_at = Column(
+        TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+
 class GroupMember(Base):
     __tablename__ = "group_members"
 
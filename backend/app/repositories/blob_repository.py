@@ -0,0 +1,53 @@
+from typing import Callable
+
+from sqlalchemy import literal_column, update
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.database import get_db_session
+from app.models.base import Blob
+
+
+def blob_exists(sha256: str) -> bool:
+    with get_db_session() as db:
+        return db.query(Blob.sha256).filter(Blob.sha256 == sha256).first() is not None
+
+
+def acquire_blob(sha256: str, key: str, size: int) -> bool:
+    """
+    Добавляет ссылку на blob (создает запись при первой ссылке).
+    Возвращает True, если запись была создана этим вызовом.
+    """
+    with get_db_session() as db:
+        return add_blob_reference(db, sha256, key, size)
+
+
+def add_blob_reference(db, sha256: str, key: str, size: int) -> bool:
+    """То же, что acquire_blob, в транзакции вызывающего: ссылка откатывается вместе с ней."""
+    statement = insert(Blob).values(sha256=sha256, key=key, size=size, ref_count=1)
+    inserted = db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[Blob.sha256],
+            set_={"ref_count": Blob.ref_count + 1},
+        ).returning(literal_column("xmax = 0"))
+    ).scalar_one()
+    return bool(inserted)
+
+
+def release_blob(key: str, delete_object: Callable[[str], None]) -> bool:
+    """
+    Снимает ссылку на blob. Для последней ссылки объект удаляется из S3 под блокировкой строки,
+    чтобы параллельная загрузка дубликата не сослалась на удаляемый объект.
+    Возвращает True, если объект удален (неотслеживаемый blob удаляется сразу).
+    """
+    with get_db_session() as db:
+        remaining = db.execute(
+            update(Blob).where(Blob.key == key).values(ref_count=Blob.ref_count - 1).returning(Blob.ref_count)
+        ).scalar_one_or_none()
+        if remaining is None:
+            delete_object(key)
+            return True
+        if remaining <= 0:
+            delete_object(key)
+            db.query(Blob).filter(Blob.key == key, Blob.ref_count <= 0).delete(synchronize_session=False)
+            return True
+        return False
@@ -0,0 +1,26 @@
+from typing import Any, Dict, Iterable, List, Set
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+
+def existing_values(db, column, values: Iterable[Any]) -> Set[str]:
+    """Какие из значений уже есть в колонке — одним запросом (значения возвращаются строками)."""
+    values = list(values)
+    if not values:
+        return set()
+    return {str(value) for value in db.execute(select(column).where(column.in_(values))).scalars()}
+
+
+def insert_missing(db, table, rows: List[Dict[str, Any]], returning=None) -> Set[str]:
+    """
+    Вставляет строки одним INSERT ... ON CONFLICT DO NOTHING: строки, конфликтующие
+    с любым уникальным ключом, пропускаются. Возвращает значения returning вставленных строк.
+    """
+    if not rows:
+        return set()
+    statement = insert(table).values(rows).on_conflict_do_nothing()
+    if returning is None:
+        db.execute(statement)
+        return set()
+    return {str(value) for value in db.execute(statement.returning(returning)).scalars()}
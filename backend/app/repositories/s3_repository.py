@@ -1,3 +1,5 @@
+import hashlib
+
 from botocore.exceptions import ClientError
 from fastapi import HTTPException, UploadFile
 
@@ -5,11 +7,32 @@ from app.core.config import settings
 from app.core.database import s3_client
 
 
-def upload_file_to_s3(file: UploadFile, key: str):
+class HashingReader:
+    """Обертка над файловым объектом: считает SHA-256 по мере чтения при загрузке в S3."""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self._fileobj.read(size)
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+        return chunk
+
+    def hexdigest(self) -> str:
+        return self.hasher.hexdigest()
+
+
+def upload_file_to_s3(file: UploadFile, key: str) -> str:
+    """Загружает файл в S3 и возвращает SHA-256 его содержимого (без повторного чтения)."""
     from app.main import logger
 
+    reader = HashingReader(file.file)
     try:
-        s3_client.upload_fileobj(file.file, settings.AWS_S3_BUCKET_NAME, key)
+        s3_client.upload_fileobj(reader, settings.AWS_S3_BUCKET_NAME, key)
     except ClientError as e:
         logger.info(e)
         raise HTTPException(status_code=500, detail=f"Failed to upload to S3: {e}")
+    return reader.hexdigest()
@@ -0,0 +1,193 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy import exists, func, literal, or_, update
+from sqlalchemy.dialects.postgresql import JSONB
+
+from app.core.database import get_db_session
+from app.models.base import File, TranscodeBackfill, TranscodedAsset
+
+# Файл, стоящий в очереди дольше, считается потерянным и может быть поставлен повторно
+BACKFILL_QUEUED_STALE_SECONDS = int(os.getenv("BACKFILL_QUEUED_STALE_SECONDS", "86400"))
+
+
+def _selection_conditions(filters: Dict[str, Any]) -> List[Any]:
+    """Критерии отбора файлов из фильтров пакетного запуска."""
+    conditions = [File.mime_type.like("video/%")]
+    if filters.get("statuses"):
+        conditions.append(File.transcoding_status.in_(filters["statuses"]))
+    if filters.get("mime_types"):
+        conditions.append(File.mime_type.in_(filters["mime_types"]))
+    if filters.get("created_from"):
+        conditions.append(File.created_at >= datetime.fromisoformat(filters["created_from"]))
+    if filters.get("created_to"):
+        conditions.append(File.created_at < datetime.fromisoformat(filters["created_to"]))
+    if filters.get("min_duration") is not None:
+        conditions.append(File.duration >= filters["min_duration"])
+    if filters.get("max_duration") is not None:
+        conditions.append(File.duration <= filters["max_duration"])
+    if filters.get("ladder"):
+        ladder = File.transcoding_progress["ladder"].astext
+        conditions.append(or_(ladder.is_(None), ladder != filters["ladder"]))
+        # Файлы, ссылающиеся на общий результат по текущей лестнице, перекодировать не нужно
+        conditions.append(
+            ~exists().where(
+                TranscodedAsset.hls_manifest_path == File.hls_manifest_path,
+                TranscodedAsset.ladder == filters["ladder"],
+            )
+        )
+    return conditions
+
+
+def _not_in_flight_conditions() -> List[Any]:
+    """Файл не транскодируется и не стоит в очереди (зависшие задания не в счет)."""
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=BACKFILL_QUEUED_STALE_SECONDS)
+    stage = File.transcoding_progress["stage"].astext
+    queued_at = File.transcoding_progress["queued_at"].astext
+    return [
+        or_(
+            File.transcoding_status.is_(None),
+            File.transcoding_status != "processing",
+            File.updated_at < stale_before,
+        ),
+        or_(stage.is_(None), stage != "queued", queued_at < stale_before.isoformat()),
+    ]
+
+
+def count_backfill_candidates(filters: Dict[str, Any]) -> int:
+    with get_db_session() as db:
+        return db.query(func.count(File.id)).filter(*_selection_conditions(filters)).scalar()
+
+
+def select_backfill_batch(filters: Dict[str, Any], after_id: Optional[UUID], limit: int) -> List[UUID]:
+    """Следующая порция подходящих файлов по возрастанию id (курсор — id последнего просмотренного)."""
+    with get_db_session() as db:
+        query = db.query(File.id).filter(*_selection_conditions(filters))
+        if after_id:
+            query = query.filter(File.id > after_id)
+        return [row.id for row in query.order_by(File.id).limit(limit)]
+
+
+def claim_backfill_files(file_ids: List[UUID], backfill_id: UUID) -> List[UUID]:
+    """
+    Атомарно помечает файлы как поставленные в очередь. Файлы, которые уже в очереди
+    или транскодируются, не помечаются: повторный запуск не ставит их второй раз.
+    """
+    marker = {
+        "stage": "queued",
+        "queued_at": datetime.now(timezone.utc).isoformat(),
+        "backfill": str(backfill_id),
+    }
+    with get_db_session() as db:
+        result = db.execute(
+            update(File)
+            .where(File.id.in_(file_ids), *_not_in_flight_conditions())
+            .values(
+                transcoding_progress=func.coalesce(File.transcoding_progress, literal({}, JSONB)).op("||")(
+                    literal(marker, JSONB)
+                )
+            )
+            .returning(File.id)
+            .execution_options(synchronize_session=False)
+        )
+        return [row.id for row in result]
+
+
+def create_backfill(
+    filters: Dict[str, Any], rate_per_minute: int, max_queue_depth: int, total: int, created_by: UUID
+) -> TranscodeBackfill:
+    with get_db_session() as db:
+        backfill = TranscodeBackfill(
+            filters=filters,
+            status="running",
+            generation=0,
+            rate_per_minute=rate_per_minute,
+            max_queue_depth=max_queue_depth,
+            total=total,
+            enqueued=0,
+            skipped=0,
+            completed=0,
+            failed=0,
+            created_by=created_by,
+        )
+        db.add(backfill)
+        db.flush()
+        db.refresh(backfill)
+        return backfill
+
+
+def get_backfill(backfill_id: str) -> Optional[TranscodeBackfill]:
+    with get_db_session() as db:
+        return db.query(TranscodeBackfill).filter(TranscodeBackfill.id == backfill_id).first()
+
+
+def list_backfills(limit: int) -> List[TranscodeBackfill]:
+    with get_db_session() as db:
+        return db.query(TranscodeBackfill).order_by(TranscodeBackfill.created_at.desc()).limit(limit).all()
+
+
+def set_backfill_status(backfill_id: str, status: str, from_status: str) -> bool:
+    """Меняет статус, только если текущий равен from_status (пауза)."""
+    with get_db_session() as db:
+        result = db.execute(
+            update(TranscodeBackfill)
+            .where(TranscodeBackfill.id == backfill_id, TranscodeBackfill.status == from_status)
+            .values(status=status)
+        )
+        return result.rowcount > 0
+
+
+def resume_backfill(backfill_id: str) -> Optional[int]:
+    """
+    Возобновляет приостановленный запуск и начинает новое поколение цепочки порций:
+    задача, запланированная до паузы, увидит чужое поколение и не продолжит старую цепочку.
+    Возвращает новое поколение или None, если запуск не на паузе.
+    """
+    with get_db_session() as db:
+        return db.execute(
+            update(TranscodeBackfill)
+            .where(TranscodeBackfill.id == backfill_id, TranscodeBackfill.status == "paused")
+            .values(status="running", generation=TranscodeBackfill.generation + 1)
+            .returning(TranscodeBackfill.generation)
+        ).scalar_one_or_none()
+
+
+def advance_backfill(
+    backfill_id: UUID, generation: int, cursor: Optional[UUID], enqueued: int, skipped: int, finished: bool
+) -> bool:
+    """
+    Сдвигает курсор и счетчики после обработки порции.
+    Возвращает False, если цепочка устарела (запуск возобновлен новой цепочкой) — курсор не трогается.
+    """
+    values = {
+        "cursor": cursor,
+        "enqueued": TranscodeBackfill.enqueued + enqueued,
+        "skipped": TranscodeBackfill.skipped + skipped,
+    }
+    if finished:
+        values["status"] = "completed"
+    with get_db_session() as db:
+        result = db.execute(
+            update(TranscodeBackfill)
+            .where(TranscodeBackfill.id == backfill_id, TranscodeBackfill.generation == generation)
+            .values(**values)
+        )
+        return result.rowcount > 0
+
+
+def record_backfill_result(backfill_id: str, file_id: str) -> None:
+    """Учитывает итог транскодирования файла в счетчиках пакетного запуска."""
+    with get_db_session() as db:
+        row = db.query(File.transcoding_status, File.transcoding_progress).filter(File.id == file_id).first()
+        # Неудачное перетранскодирование оставляет прежний статус и отмечает сбой в прогрессе
+        succeeded = row is not None and row.transcoding_status == "completed" and not (
+            (row.transcoding_progress or {}).get("last_run_failed_at")
+        )
+        counter = TranscodeBackfill.completed if succeeded else TranscodeBackfill.failed
+        db.execute(
+            update(TranscodeBackfill)
+            .where(TranscodeBackfill.id == backfill_id)
+            .values({counter: counter + 1})
+        )
@@ -0,0 +1,184 @@
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.database import get_db_session
+from app.models.base import File, TranscodedAsset
+
+
+def find_transcoded_assets(db, content_hashes: Iterable[str]) -> Dict[str, TranscodedAsset]:
+    """Готовые результаты для нескольких хэшей одним запросом: хэш -> результат (без ссылок на них)."""
+    content_hashes = list(content_hashes)
+    if not content_hashes:
+        return {}
+    assets = db.query(TranscodedAsset).filter(TranscodedAsset.content_hash.in_(content_hashes))
+    return {asset.content_hash: asset for asset in assets}
+
+
+def add_transcoded_asset_reference(db, content_hash: str, base_path: str) -> bool:
+    """
+    Добавляет ссылку на результат в транзакции вызывающего (ссылка откатывается вместе с ней).
+    Возвращает False, если результата с такой директорией для хэша уже нет.
+    """
+    row = db.execute(
+        update(TranscodedAsset)
+        .where(TranscodedAsset.content_hash == content_hash, TranscodedAsset.base_path == base_path)
+        .values(ref_count=TranscodedAsset.ref_count + 1)
+        .returning(TranscodedAsset.content_hash)
+    ).scalar_one_or_none()
+    return row is not None
+
+
+def attach_transcoded_asset(file_id: str, content_hash: str) -> Optional[TranscodedAsset]:
+    """
+    Если для содержимого уже есть готовый результат транскодирования, файл начинает
+    ссылаться на него (счетчик ссылок увеличивается в той же транзакции).
+    """
+    with get_db_session() as db:
+        asset = db.execute(
+            update(TranscodedAsset)
+            .where(TranscodedAsset.content_hash == content_hash)
+            .values(ref_count=TranscodedAsset.ref_count + 1)
+            .returning(TranscodedAsset)
+        ).scalar_one_or_none()
+        if not asset:
+            return None
+        file_record = db.query(File).filter(File.id == file_id).first()
+        if not file_record:
+            db.rollback()
+            return None
+        file_record.hls_manifest_path = asset.hls_manifest_path
+        file_record.dash_manifest_path = asset.dash_manifest_path
+        file_record.duration = asset.duration
+        file_record.transcoding_status = "completed"
+        file_record.transcoding_progress = {
+            "stage": "completed",
+            "percent": 100.0,
+            "playable": True,
+            "deduplicated": True,
+            "ladder": asset.ladder,
+        }
+        return asset
+
+
+def add_transcoded_asset(
+    db,
+    content_hash: str,
+    base_path: str,
+    hls_manifest_path: Optional[str],
+    dash_manifest_path: Optional[str],
+    duration: Optional[float],
+    ladder: Optional[str] = None,
+) -> bool:
+    """
+    Регистрирует результат транскодирования как общий для содержимого с этим хэшем
+    (в транзакции вызывающего: ссылка откатывается вместе с ней).
+    Повторная регистрация того же результата обновляет пути к манифестам.
+    ladder — версия лестницы рендитций результата (None, если неизвестна).
+    Возвращает False, если для хэша уже есть другой результат (параллельная загрузка дубликата).
+    """
+    values = dict(
+        hls_manifest_path=hls_manifest_path, dash_manifest_path=dash_manifest_path, duration=duration, ladder=ladder
+    )
+    statement = insert(TranscodedAsset).values(content_hash=content_hash, base_path=base_path, ref_count=1, **values)
+    result = db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[TranscodedAsset.content_hash],
+            set_=values,
+            where=TranscodedAsset.base_path == base_path,
+        )
+    )
+    return result.rowcount > 0
+
+
+def switch_transcoded_output(
+    db, file_record: File, previous_base: Optional[str], base_path: str, ladder: Optional[str]
+) -> List[str]:
+    """
+    Переводит файл на новый результат base_path (пути в file_record уже указывают на него)
+    в транзакции вызывающего: результат становится общим для содержимого, ссылка на прежний
+    результат previous_base снимается. Если для хэша уже зарегистрирован результат в другой директории:
+    - по той же лестнице — файл ссылается на него, новый результат не нужен;
+    - по устаревшей — общий результат переносится в base_path вместе со всеми файлами, ссылающимися на него.
+    Возвращает директории, объекты которых больше никому не нужны.
+    """
+    unused = []
+    current_base = base_path
+    moved_from = None
+    if file_record.content_hash:
+        asset = (
+            db.query(TranscodedAsset)
+            .filter(TranscodedAsset.content_hash == file_record.content_hash)
+            .with_for_update()
+            .first()
+        )
+        if asset is None or asset.base_path == base_path:
+            add_transcoded_asset(
+                db,
+                file_record.content_hash,
+                base_path,
+                file_record.hls_manifest_path,
+                file_record.dash_manifest_path,
+                file_record.duration,
+                ladder,
+            )
+        elif asset.ladder == ladder:
+            file_record.hls_manifest_path = asset.hls_manifest_path
+            file_record.dash_manifest_path = asset.dash_manifest_path
+            file_record.transcoding_progress = dict(file_record.transcoding_progress or {}, deduplicated=True)
+            if previous_base != asset.base_path:
+                asset.ref_count += 1
+            current_base = asset.base_path
+            unused.append(base_path)
+        else:
+            db.query(File).filter(
+                File.hls_manifest_path == asset.hls_manifest_path, File.id != file_record.id
+            ).update(
+                {
+                    "hls_manifest_path": file_record.hls_manifest_path,
+                    "dash_manifest_path": file_record.dash_manifest_path,
+                },
+                synchronize_session=False,
+            )
+            if previous_base != asset.base_path:
+                asset.ref_count += 1
+            moved_from = asset.base_path
+            unused.append(moved_from)
+            asset.base_path = base_path
+            asset.hls_manifest_path = file_record.hls_manifest_path
+            asset.dash_manifest_path = file_record.dash_manifest_path
+            asset.duration = file_record.duration
+            asset.ladder = ladder
+    if previous_base and previous_base not in (current_base, moved_from):
+        if remove_transcoded_asset_reference(db, previous_base):
+            unused.append(previous_base)
+    return unused
+
+
+def release_transcoded_asset(base_path: str) -> bool:
+    """
+    Снимает ссылку на результат транскодирования по его директории.
+    Возвращает True, если объекты в S3 можно удалять: ссылка была последней
+    или результат не общий (не зарегистрирован).
+    """
+    with get_db_session() as db:
+        return remove_transcoded_asset_reference(db, base_path)
+
+
+def remove_transcoded_asset_reference(db, base_path: str) -> bool:
+    """То же, что release_transcoded_asset, в транзакции вызывающего."""
+    remaining = db.execute(
+        update(TranscodedAsset)
+        .where(TranscodedAsset.base_path == base_path)
+        .values(ref_count=TranscodedAsset.ref_count - 1)
+        .returning(TranscodedAsset.ref_count)
+    ).scalar_one_or_none()
+    if remaining is None:
+        return True
+    if remaining <= 0:
+        db.query(TranscodedAsset).filter(
+            TranscodedAsset.base_path == base_path, TranscodedAsset.ref_count <= 0
+        ).delete(synchronize_session=False)
+        return True
+    return False
@@ -13,7 +13,8 @@ from app.models.base import User
 from app.schemas.backup_schemas import BackupUploadResponse, BackupStatusResponse
 from app.services.backup_service import BackupService
 from app.tasks.backup_tasks import celery_app # Импортируем приложение Celery для проверки статуса
-from app.tasks.backup_restore import restore_backup_task
+from app.tasks.backup_restore import restore_backup_task, restore_snapshot_task
+from app.tasks.backup_tasks import SNAPSHOT_METADATA_NAME
 import tempfile
 import os
 import shutil
@@ -29,27 +30,45 @@ router = APIRouter(prefix="/backup", tags=["Backup"])
 backup_service = BackupService()
 
 @router.get("/download")
-def initiate_user_backup(current_user: User = Depends(get_current_user)):
-    """Инициирует создание бэкапа всех файлов пользователя (асинхронно)"""
+def initiate_user_backup(mode: str = "full", current_user: User = Depends(get_current_user)):
+    """
+    Инициирует создание бэкапа всех файлов пользователя (асинхронно).
+    mode: full, incremental (изменения с последнего бэкапа) или differential (с последнего полного)
+    """
     try:
-        task_id = backup_service.create_backup(current_user)
+        task_id = backup_service.create_backup(current_user, mode)
         return {"task_id": task_id, "message": "Backup task initiated"}
     except Exception as e:
         print(f"Initiate backup error: {e}")
         raise e
 
 @router.get("/download-full")
-def initiate_full_backup(current_user: User = Depends(get_current_user)):
-    """Инициирует создание полного бэкапа всех данных (асинхронно, только для админов)"""
+def initiate_full_backup(mode: str = "full", current_user: User = Depends(get_current_user)):
+    """Инициирует создание полного бэкапа всех данных (асинхронно, только для админов); mode — как у /download"""
     try:
         if not current_user.is_admin:
             raise HTTPException(status_code=403, detail="Access denied. Admin rights required.")
-        task_id = backup_service.create_full_backup(current_user)
+        task_id = backup_service.create_full_backup(current_user, mode)
         return {"task_id": task_id, "message": "Full backup task initiated"}
     except Exception as e:
         print(f"Initiate full backup error: {e}")
         raise e
 
+@router.get("/snapshot")
+def initiate_snapshot_backup(full: bool = False, current_user: User = Depends(get_current_user)):
+    """
+    Инициирует бэкап без ZIP: объекты копируются на стороне S3 в backups/<snapshot-id>/,
+    метаданные лежат рядом (full=true — все данные, только для админов)
+    """
+    try:
+        if full and not current_user.is_admin:
+            raise HTTPException(status_code=403, detail="Access denied. Admin rights required.")
+        task_id = backup_service.create_snapshot(current_user, full)
+        return {"task_id": task_id, "message": "Snapshot backup task initiated"}
+    except Exception as e:
+        print(f"Initiate snapshot backup error: {e}")
+        raise e
+
 @router.get("/status/{task_id}")
 def get_backup_status(task_id: str, current_user: User = Depends(get_current_user)):
     """Проверяет статус задачи создания бэкапа"""
@@ -58,8 +77,13 @@ def get_backup_status(task_id: str, current_user: User = Depends(get_current_use
     if task_result.state == 'PENDING':
         return {"task_id": task_id, "status": "pending", "message": "Task is waiting to be processed"}
     elif task_result.state == 'PROGRESS':
-        # Если вы добавите обновление прогресса в задаче, здесь можно будет его вернуть
-        return {"task_id": task_id, "status": "in_progress", "message": "Task is currently running"}
+        # Задачи восстановления сообщают этап и счетчики файлов
+        return {
+            "task_id": task_id,
+            "status": "in_progress",
+            "message": "Task is currently running",
+            "progress": task_result.info if isinstance(task_result.info, dict) else None,
+        }
     elif task_result.state == 'SUCCESS':
         # Результат задачи - это словарь с 's3_key'
         s3_key = task_result.result.get('s3_key')
@@ -67,7 +91,8 @@ def get_backup_status(task_id: str, current_user: User = Depends(get_current_use
             "task_id": task_id,
             "status": "completed",
             "s3_key": s3_key,
-            "download_url": f"/backup/download-task/{task_id}" # Предлагаемый URL для скачивания
+            "download_url": f"/backup/download-task/{task_id}", # Предлагаемый URL для скачивания
+            "stats": task_result.result.get('stats'),  # Пропускная способность архивации
         }
     else: # FAILURE
         return {
@@ -97,6 +122,8 @@ def download_backup_by_task_id(
     s3_key = task_result.result.get('s3_key')
     if not s3_key:
         raise HTTPException(status_code=500, detail="Backup file location not found in task result")
+    if task_result.result.get('format') == 'snapshot':
+        raise HTTPException(status_code=400, detail="Snapshot backups are stored as objects and cannot be downloaded as a file")
 
     # Получаем объект из S3
     try:
@@ -145,11 +172,26 @@ def list_backups(current_user: User = Depends(get_current_user)):
         paginator = s3_client.get_paginator('list_objects_v2')
         pages = paginator.paginate(
             Bucket=settings.AWS_S3_BUCKET_NAME,
-            Prefix='backups/'  # Только файлы в этой папке
+            Prefix='backups/',  # Только файлы в этой папке
+            Delimiter='/'  # Снимки объектов — подпапки, их содержимое не перечисляем
         )
 
         backups = []
         for page in pages:
+            for snapshot in page.get('CommonPrefixes', []):
+                # Снимок завершен, только если рядом с объектами уже лежат метаданные
+                try:
+                    head = s3_client.head_object(
+                        Bucket=settings.AWS_S3_BUCKET_NAME, Key=f"{snapshot['Prefix']}{SNAPSHOT_METADATA_NAME}"
+                    )
+                except ClientError:
+                    continue
+                backups.append({
+                    "s3_key": snapshot['Prefix'],
+                    "filename": snapshot['Prefix'].rstrip('/').split('/')[-1],
+                    "size": int(head.get('Metadata', {}).get('snapshot-bytes', head['ContentLength'])),
+                    "last_modified": head['LastModified'].isoformat()
+                })
             if 'Contents' in page:
                 for obj in page['Contents']:
                     # Пропускаем папки (ключи, заканчивающиеся на /)
@@ -182,10 +224,14 @@ def restore_backup_by_s3_key(
     current_user: User = Depends(get_current_user),
 ):
     s3_key = request.s3_key
+    # Снимок объектов задается префиксом backups/<snapshot-id>/
+    is_snapshot = s3_key.endswith('/')
 
     # Проверяем, существует ли файл в S3 по этому ключу
     try:
-        s3_client.head_object(Bucket=settings.AWS_S3_BUCKET_NAME, Key=s3_key)
+        s3_client.head_object(
+            Bucket=settings.AWS_S3_BUCKET_NAME, Key=f"{s3_key}{SNAPSHOT_METADATA_NAME}" if is_snapshot else s3_key
+        )
     except ClientError as e:
         error_code = e.response.get('Error', {}).get('Code')
         if error_code == 'NoSuchKey' or error_code == '404':
@@ -195,7 +241,10 @@ def restore_backup_by_s3_key(
 
     # Отправляем задачу Celery, передавая S3 ключ
     # В данном случае, мы *не создаем* временный файл в S3, а используем существующий
-    task_id = restore_backup_task.delay(s3_key, str(current_user.id))
+    if is_snapshot:
+        task_id = restore_snapshot_task.delay(s3_key, str(current_user.id))
+    else:
+        task_id = restore_backup_task.delay(s3_key, str(current_user.id))
 
     return {"message": "Backup restore initiated", "task_id": str(task_id)}
 
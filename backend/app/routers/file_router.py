@@ -16,18 +16,24 @@ from fastapi import (
     Response,
     UploadFile,
 )
-from fastapi.responses import StreamingResponse
+from fastapi.responses import RedirectResponse, StreamingResponse
 
 from app.core.config import settings
 from app.core.database import s3_client
 from app.core.security import get_current_user
 from app.models.base import User
-from app.schemas.file_schemas import FileListResponse, FileResponse
+from app.schemas.file_schemas import (
+    FileListResponse,
+    FileResponse,
+    PlaybackSessionResponse,
+    TranscodeStatusResponse,
+)
 from app.services.file_service import (
     delete_file_service,
     download_file_service,
     get_file_service,
     get_files_list,
+    get_transcode_status_service,
     save_file_metadata,
     search_files_service,
     stream_file_service,
@@ -35,8 +41,18 @@ from app.services.file_service import (
     download_file_from_url_service,
 )
 from app.repositories.file_repository import get_file_by_id
-from app.repositories.group_repository import get_group_id_by_file_id, get_group_by_id_db
-from app.services.group_service import _check_user_can_read_group
+from app.services.media_cache import media_cache
+from app.services.playback_service import (
+    MASTER_MANIFESTS,
+    PLAYBACK_PRESIGN_SEGMENTS,
+    build_playback_session,
+    check_playback_access,
+    create_playback_session_service,
+    load_session_playlist,
+    resolve_playback_key,
+    session_expires_in,
+    verify_playback_token,
+)
 
 router = APIRouter(prefix="/files", tags=["Files"])
 
@@ -167,6 +183,131 @@ def stream_file(
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
 
+@router.get("/{file_id}/transcode-status", response_model=TranscodeStatusResponse)
+def get_transcode_status(
+    file_id: str,
+    current_user: User = Depends(get_current_user),
+):
+    """Прогресс транскодирования: этап, процент, скорость (x realtime), ETA и признак зависания."""
+    return get_transcode_status_service(file_id, current_user.id)
+
+
+def _stream_manifest_object(
+    s3_manifest_key: str,
+    manifest_name: str,
+    cache_control: str,
+    cacheable: bool = True,
+) -> Response:
+    """
+    Отдает манифест или сегмент из S3 с подходящим Content-Type.
+    Небольшие объекты готового (не дописываемого) видео берутся из кэша и кладутся в него.
+    """
+    headers = {
+        "Cache-Control": cache_control,
+         "Accept-Ranges": "bytes", # Полезно для Range-запросов к сегментам, если нужно
+    }
+
+    # Определяем Content-Type
+    content_type, _ = mimetypes.guess_type(manifest_name)
+    if not content_type:
+        if manifest_name.endswith('.m3u8'):
+            content_type = 'application/vnd.apple.mpegurl' # Или 'audio/mpegurl'
+        elif manifest_name.endswith('.mpd'):
+             content_type = 'application/dash+xml'
+        elif manifest_name.endswith('.m4s'):
+            content_type = 'video/iso.segment'
+        else:
+            content_type = 'application/octet-stream'
+
+    use_cache = cacheable and media_cache.enabled
+    if use_cache:
+        cached = media_cache.get(s3_manifest_key)
+        if cached is not None:
+            return Response(content=cached, media_type=content_type, headers=headers)
+
+    # Запрашиваем манифест из S3
+    try:
+        s3_response = s3_client.get_object(Bucket=settings.AWS_S3_BUCKET_NAME, Key=s3_manifest_key)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            raise HTTPException(status_code=404, detail="Manifest not found in storage")
+        else:
+            raise HTTPException(status_code=500, detail=f"S3 error: {str(e)}")
+
+    if use_cache and s3_response.get('ContentLength', 0) <= media_cache.max_item_bytes:
+        try:
+            content = s3_response['Body'].read()
+        finally:
+            s3_response['Body'].close()
+        media_cache.set(s3_manifest_key, content)
+        return Response(content=content, media_type=content_type, headers=headers)
+
+    # Создаем генератор для стриминга
+    def iter_file():
+        try:
+            for chunk in s3_response['Body'].iter_chunks(chunk_size=64 * 1024): # 64KB
+                yield chunk
+        except Exception as e:
+            print(f"Error streaming manifest chunk: {e}")
+            return
+        finally:
+            try:
+                s3_response['Body'].close()
+            except:
+                pass
+
+    return StreamingResponse(iter_file(), media_type=content_type, headers=headers)
+
+
+@router.get("/{file_id}/playback-session", response_model=PlaybackSessionResponse)
+def create_playback_session(
+    file_id: str,
+    current_user: User = Depends(get_current_user),
+):
+    """Проверяет доступ один раз и выдает подписанный токен для плейлистов и сегментов."""
+    return create_playback_session_service(file_id, current_user)
+
+
+@router.get("/{file_id}/play/{token}/{manifest_type}/{manifest_name:path}")
+def get_playback_manifest(
+    file_id: str,
+    token: str,
+    manifest_type: str, # "hls" или "dash"
+    manifest_name: str,
+):
+    """
+    Отдает манифест или сегмент в рамках сессии воспроизведения.
+    Доступ проверяется только по подписи и сроку токена — без запросов к БД.
+    """
+    claims = verify_playback_token(token, file_id)
+    s3_manifest_key = resolve_playback_key(claims, manifest_type, manifest_name)
+
+    if PLAYBACK_PRESIGN_SEGMENTS and manifest_name.endswith('.m3u8'):
+        # Плейлист со ссылками напрямую в хранилище: кэшировать не дольше, чем живут ссылки
+        max_age = min(300, session_expires_in(claims))
+        return Response(
+            content=load_session_playlist(claims, s3_manifest_key),
+            media_type='application/vnd.apple.mpegurl',
+            headers={"Cache-Control": "no-cache" if claims.get("live") else f"private, max-age={max_age}"},
+        )
+
+    if manifest_name.endswith(('.m3u8', '.mpd')):
+        cache_control = "no-cache" if claims.get("live") else "private, max-age=300"
+    else:
+        # Сегменты неизменны и во время транскодирования: каждая попытка пишет в свою директорию;
+        # private — URL содержит персональный токен
+        cache_control = "private, max-age=86400, immutable"
+    try:
+        return _stream_manifest_object(
+            s3_manifest_key, manifest_name, cache_control, cacheable=not claims.get("live")
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Unexpected error getting manifest {manifest_name} for file {file_id}: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
 @router.get("/{file_id}/manifest/{manifest_type}/{manifest_name:path}")
 def get_manifest(
     file_id: str,
@@ -180,17 +321,8 @@ def get_manifest(
         if not file:
             raise HTTPException(status_code=404, detail="File not found")
 
-        group_id = get_group_id_by_file_id(file_id, current_user.id)
-        if group_id:
-            group = get_group_by_id_db(group_id)
-            if not group:
-                raise HTTPException(status_code=404, detail="Group not found")
-            if not _check_user_can_read_group(group, current_user):
-                raise HTTPException(status_code=403, detail="Access denied to group")
-        else:
-            # Проверяем права доступа
-            if file.owner_id != current_user.id:
-                raise HTTPException(status_code=403, detail="Access denied")
+        # Те же права, что и при выдаче токена воспроизведения, на который ведет редирект мастер-манифеста
+        check_playback_access(file, current_user)
 
         # Определяем путь к манифесту в S3
         s3_manifest_key = None
@@ -198,53 +330,30 @@ def get_manifest(
             # Извлекаем базовый путь из hls_manifest_path
             base_hls_path = "/".join(file.hls_manifest_path.split("/")[:-1]) # Убираем имя файла
             s3_manifest_key = f"{base_hls_path}/{manifest_name}"
-        # elif manifest_type == "dash" and file.dash_manifest_path:
-        #     # Аналогично для DASH
-        #     base_dash_path = "/".join(file.dash_manifest_path.split("/")[:-1])
-        #     s3_manifest_key = f"{base_dash_path}/{manifest_name}"
+        elif manifest_type == "dash" and file.dash_manifest_path:
+            # Аналогично для DASH (в режиме CMAF это та же директория, что и у HLS)
+            base_dash_path = "/".join(file.dash_manifest_path.split("/")[:-1])
+            s3_manifest_key = f"{base_dash_path}/{manifest_name}"
         else:
             raise HTTPException(status_code=404, detail="Manifest not found or transcoding not completed")
 
-        # Запрашиваем манифест из S3
-        try:
-            s3_response = s3_client.get_object(Bucket=settings.AWS_S3_BUCKET_NAME, Key=s3_manifest_key)
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'NoSuchKey':
-                raise HTTPException(status_code=404, detail="Manifest not found in storage")
-            else:
-                raise HTTPException(status_code=500, detail=f"S3 error: {str(e)}")
-
-        # Определяем Content-Type
-        content_type, _ = mimetypes.guess_type(manifest_name)
-        if not content_type:
-            if manifest_name.endswith('.m3u8'):
-                content_type = 'application/vnd.apple.mpegurl' # Или 'audio/mpegurl'
-            elif manifest_name.endswith('.mpd'):
-                 content_type = 'application/dash+xml'
-            else:
-                content_type = 'application/octet-stream'
-
-        # Создаем генератор для стриминга
-        def iter_file():
-            try:
-                for chunk in s3_response['Body'].iter_chunks(chunk_size=64 * 1024): # 64KB
-                    yield chunk
-            except Exception as e:
-                print(f"Error streaming manifest chunk: {e}")
-                return
-            finally:
-                try:
-                    s3_response['Body'].close()
-                except:
-                    pass
-
-        return StreamingResponse(
-            iter_file(),
-            media_type=content_type,
-            headers={
-                "Cache-Control": "public, max-age=300", # Манифесты могут меняться, кэшируем коротко
-                 "Accept-Ranges": "bytes", # Полезно для Range-запросов к сегментам, если нужно
-            }
+        # Мастер-манифест открывает сессию воспроизведения: относительные ссылки
+        # на плейлисты и сегменты разрешаются уже от URL с токеном и идут мимо БД
+        if manifest_name in MASTER_MANIFESTS:
+            session = build_playback_session(file, current_user)
+            return RedirectResponse(
+                url=f"../../play/{session.token}/{manifest_type}/{manifest_name}",
+                status_code=307,
+                headers={"Cache-Control": "no-store"},
+            )
+
+        # Пока идет прогрессивное транскодирование, плейлисты дописываются — кэшировать их нельзя
+        cache_control = "public, max-age=300" # Манифесты могут меняться, кэшируем коротко
+        if manifest_name.endswith('.m3u8') and file.transcoding_status != "completed":
+            cache_control = "no-cache"
+
+        return _stream_manifest_object(
+            s3_manifest_key, manifest_name, cache_control, cacheable=file.transcoding_status == "completed"
         )
 
     except HTTPException as e:
@@ -271,6 +380,14 @@ async def get_thumbnail(key: str):
         raise HTTPException(status_code=404, detail="Thumbnail not found")
 
 
+@router.get("/media-cache/stats")
+def get_media_cache_stats(current_user: User = Depends(get_current_user)):
+    """Статистика кэша плейлистов и сегментов (hit ratio по уровням, заполнение) текущего процесса API."""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Access denied. Admin rights required.")
+    return media_cache.describe()
+
+
 @router.get("/search", response_model=FileListResponse)
 def search_files_endpoint(
     query: str = Query(None),
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends, HTTPException
+
+from app.core.security import get_current_user
+from app.models.base import User
+from app.services.queue_service import get_queue_stats
+
+router = APIRouter(prefix="/queues", tags=["Queues"])
+
+
+@router.get("/stats")
+def get_queue_stats_endpoint(current_user: User = Depends(get_current_user)):
+    """Глубина очередей Celery, возраст ожидающих задач и задачи в работе (только для администраторов)."""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Access denied. Admin rights required.")
+    return get_queue_stats()
@@ -0,0 +1,56 @@
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.core.security import get_current_user
+from app.models.base import User
+from app.schemas.file_schemas import TranscodeBackfillCreate, TranscodeBackfillResponse
+from app.services.transcode_backfill_service import (
+    create_backfill_service,
+    get_backfill_service,
+    list_backfills_service,
+    pause_backfill_service,
+    resume_backfill_service,
+)
+
+router = APIRouter(prefix="/transcode-backfills", tags=["Transcoding"])
+
+
+def _require_admin(current_user: User) -> None:
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Access denied. Admin rights required.")
+
+
+@router.post("", response_model=TranscodeBackfillResponse)
+def create_backfill_endpoint(request: TranscodeBackfillCreate, current_user: User = Depends(get_current_user)):
+    """
+    Пакетное перетранскодирование: отбор по статусу, типу, дате, длительности или устаревшей
+    лестнице рендитций, постановка в очередь с ограничением скорости.
+    """
+    _require_admin(current_user)
+    return create_backfill_service(request, current_user)
+
+
+@router.get("", response_model=List[TranscodeBackfillResponse])
+def list_backfills_endpoint(limit: int = Query(20, ge=1, le=100), current_user: User = Depends(get_current_user)):
+    _require_admin(current_user)
+    return list_backfills_service(limit)
+
+
+@router.get("/{backfill_id}", response_model=TranscodeBackfillResponse)
+def get_backfill_endpoint(backfill_id: str, current_user: User = Depends(get_current_user)):
+    """Прогресс запуска: кандидаты, поставлено, пропущено, готово, с ошибкой, в работе."""
+    _require_admin(current_user)
+    return get_backfill_service(backfill_id)
+
+
+@router.post("/{backfill_id}/pause", response_model=TranscodeBackfillResponse)
+def pause_backfill_endpoint(backfill_id: str, current_user: User = Depends(get_current_user)):
+    _require_admin(current_user)
+    return pause_backfill_service(backfill_id)
+
+
+@router.post("/{backfill_id}/resume", response_model=TranscodeBackfillResponse)
+def resume_backfill_endpoint(backfill_id: str, current_user: User = Depends(get_current_user)):
+    _require_admin(current_user)
+    return resume_backfill_service(backfill_id)
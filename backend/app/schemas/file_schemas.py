@@ -16,6 +16,7 @@ class FileCreate(BaseModel):
     category_id: UUID
     thumbnail_path: Optional[str] = None
     group_id: Optional[UUID] = None
+    content_hash: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -32,6 +33,7 @@ class FileResponse(FileCreate):
     transcoding_status: Optional[str] = "pending" # Убедитесь, что тип совпадает с моделью SQLAlchemy
     hls_manifest_path: Optional[str] = None
     dash_manifest_path: Optional[str] = None
+    transcoding_progress: Optional[dict] = None
     file_record: Optional[float] = None
 
     class Config:
@@ -43,3 +45,55 @@ class FileListResponse(BaseModel):
     total: int
     page: int
     limit: int
+
+
+class TranscodeStatusResponse(BaseModel):
+    file_id: UUID
+    transcoding_status: Optional[str] = None
+    stage: Optional[str] = None
+    percent: Optional[float] = None
+    speed: Optional[float] = None # Скорость относительно реального времени (x realtime)
+    eta_seconds: Optional[int] = None
+    segments_done: Optional[int] = None
+    playable: bool = False
+    started_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    stalled: bool = False # Нет обновлений прогресса дольше порога
+
+
+class PlaybackSessionResponse(BaseModel):
+    file_id: UUID
+    token: str
+    expires_in: int # Время жизни токена, секунды
+    hls_url: Optional[str] = None # Относительно API: /files/{id}/play/{token}/hls/master.m3u8
+    dash_url: Optional[str] = None
+
+
+class TranscodeBackfillCreate(BaseModel):
+    statuses: List[str] = ["pending", "failed"]
+    mime_types: List[str] = [] # Пусто — все видео
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+    min_duration: Optional[float] = None
+    max_duration: Optional[float] = None
+    outdated_ladder: bool = False # Только файлы, транскодированные по другой лестнице рендитций
+    queue: str = "reencode" # Профиль кодирования и очередь: "reencode" или "new_upload"
+    rate_per_minute: int = 30 # Файлов в минуту (размер порции пересчитывается на интервал между порциями)
+    max_queue_depth: int = 100 # Не добавлять задачи, пока очередь транскодирования глубже
+    dry_run: bool = False # Только посчитать подходящие файлы
+
+
+class TranscodeBackfillResponse(BaseModel):
+    id: Optional[UUID] = None
+    status: str
+    filters: dict
+    rate_per_minute: int
+    max_queue_depth: int
+    total: int = 0
+    enqueued: int = 0
+    skipped: int = 0
+    completed: int = 0
+    failed: int = 0
+    in_flight: int = 0 # Поставлено в очередь, результата еще нет
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
@@ -0,0 +1,146 @@
+import json
+import hashlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Set
+
+from app.core.config import settings
+from app.core.database import s3_client
+from app.services.blob_storage_service import is_blob_key
+
+# Манифесты лежат отдельно от архивов: предыдущий снимок находится без скачивания ZIP
+MANIFEST_PREFIX = "backup_manifests/"
+MANIFEST_ARCNAME = "backup_manifest.json"  # копия манифеста внутри архива, по ней собирается цепочка при восстановлении
+BACKUP_MODES = ("full", "incremental", "differential")
+
+
+def manifest_scope(backup_type: str, user_id) -> str:
+    """Цепочка бэкапов ведется отдельно для полного бэкапа и для каждого пользователя."""
+    return "full" if backup_type == "full" else f"user_{user_id}"
+
+
+def manifest_key(scope: str, started_at: datetime, mode: str) -> str:
+    # Имя сортируется по времени, режим в имени позволяет найти базу без чтения манифестов
+    return f"{MANIFEST_PREFIX}{scope}/{started_at.strftime('%Y%m%d_%H%M%S')}_{mode}.json"
+
+
+def find_previous_manifest_key(scope: str, mode: str) -> Optional[str]:
+    """
+    Манифест, от которого считаются изменения: для incremental — последний бэкап цепочки,
+    для differential — последний полный.
+    """
+    keys = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=settings.AWS_S3_BUCKET_NAME, Prefix=f"{MANIFEST_PREFIX}{scope}/"):
+        keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    for key in sorted(keys, reverse=True):
+        if mode == "incremental" or key.endswith("_full.json"):
+            return key
+    return None
+
+
+def load_manifest(key: str) -> Dict[str, Any]:
+    response = s3_client.get_object(Bucket=settings.AWS_S3_BUCKET_NAME, Key=key)
+    return json.loads(response["Body"].read())
+
+
+def save_manifest(key: str, manifest: Dict[str, Any]) -> None:
+    s3_client.put_object(
+        Bucket=settings.AWS_S3_BUCKET_NAME,
+        Key=key,
+        Body=json.dumps(manifest).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def file_fingerprint(file) -> str:
+    """Отпечаток файла: меняется, если изменились содержимое или набор объектов в S3."""
+    values = [
+        str(file.updated_at),
+        file.content_hash,
+        file.size,
+        file.file_path,
+        file.thumbnail_path,
+        file.preview_path,
+        file.hls_manifest_path,
+        file.dash_manifest_path,
+    ]
+    return hashlib.sha1(json.dumps(values).encode("utf-8")).hexdigest()
+
+
+def build_manifest(archive_key: str, mode: str, files: Iterable, previous: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Манифест нового бэкапа: для каждого файла — отпечаток и архив, где лежат его объекты.
+    Файлы с прежним отпечатком ссылаются на архив предыдущего снимка, остальные — на новый.
+    Общие оригиналы (blobs/) адресуются по содержимому и повторно не архивируются.
+    """
+    previous_files = previous["files"] if previous else {}
+    previous_blobs = previous["blobs"] if previous else {}
+    manifest = {
+        "archive": archive_key,
+        "mode": mode,
+        "base": previous["base"] if previous else archive_key,
+        "parent": previous["archive"] if previous else None,
+        "files": {},
+        "blobs": {},
+    }
+    for file in files:
+        file_id = str(file.id)
+        fingerprint = file_fingerprint(file)
+        entry = previous_files.get(file_id)
+        # Общий оригинал, которого нет в цепочке (например, не удалось сохранить), архивируется вместе с файлом
+        blob_missing = bool(file.file_path and is_blob_key(file.file_path) and file.file_path not in previous_blobs)
+        if entry and entry["fingerprint"] == fingerprint and entry.get("archive") and not blob_missing:
+            manifest["files"][file_id] = entry
+        else:
+            manifest["files"][file_id] = {"fingerprint": fingerprint, "archive": archive_key}
+        if file.file_path and is_blob_key(file.file_path):
+            manifest["blobs"].setdefault(file.file_path, previous_blobs.get(file.file_path, archive_key))
+    return manifest
+
+
+def member_file_id(name: str) -> Optional[str]:
+    """Id файла, которому принадлежит запись архива (files/, thumbnails/, previews/, transcoded/)."""
+    parts = name.split("/")
+    if len(parts) < 2:
+        return None
+    if parts[0] == "transcoded":
+        return parts[1]
+    if parts[0] in ("files", "thumbnails", "previews"):
+        return parts[1].split("_", 1)[0]
+    return None
+
+
+def forget_failed_members(manifest: Dict[str, Any], names: Iterable[str]) -> None:
+    """Объекты, не попавшие в архив, следующий инкрементальный бэкап заберет заново."""
+    for name in names:
+        if is_blob_key(name):
+            manifest["blobs"].pop(name, None)
+            continue
+        entry = manifest["files"].get(member_file_id(name))
+        if entry:
+            entry["fingerprint"] = None
+
+
+def required_archives(manifest: Dict[str, Any]) -> Set[str]:
+    """Предыдущие архивы цепочки, объекты из которых нужны для восстановления этого снимка."""
+    archives = {entry["archive"] for entry in manifest["files"].values()}
+    archives.update(manifest["blobs"].values())
+    archives.discard(manifest["archive"])
+    return archives
+
+
+def archive_for_member(manifest: Dict[str, Any], name: str) -> Optional[str]:
+    """Архив, из которого по манифесту берется запись name."""
+    if is_blob_key(name):
+        return manifest["blobs"].get(name)
+    entry = manifest["files"].get(member_file_id(name))
+    return entry["archive"] if entry else None
+
+
+def read_archive_manifest(zip_file) -> Optional[Dict[str, Any]]:
+    """Манифест из открытого ZipFile; у архивов, созданных до инкрементальных бэкапов, его нет."""
+    try:
+        with zip_file.open(MANIFEST_ARCNAME) as f:
+            return json.load(f)
+    except KeyError:
+        return None
@@ -0,0 +1,203 @@
+import os
+import json
+from typing import Any, Callable, Dict, Iterable, Iterator, Tuple
+
+from sqlalchemy import String, cast, func, select
+
+from app.core.database import get_db_session
+from app.models.base import Category, File as DBFile, Group, GroupMember, Tag, User, file_group
+
+# Строк ORM на один шаг серверного курсора
+BACKUP_METADATA_BATCH_SIZE = int(os.getenv("BACKUP_METADATA_BATCH_SIZE", "1000"))
+METADATA_WRITE_BUFFER = 1024 * 1024
+
+# Заголовок бэкапа: тип, дата, владелец и число записей в секциях; сами записи — в metadata/<секция>.ndjson
+METADATA_HEADER_NAME = "backup_metadata.json"
+METADATA_SECTION_PREFIX = "metadata/"
+METADATA_FORMAT = "ndjson"
+USER_SECTIONS = ("files", "tags", "categories", "groups", "file_group_links")
+FULL_SECTIONS = ("users", "files", "tags", "categories", "groups", "group_members", "file_group_links")
+
+
+def section_name(section: str) -> str:
+    return f"{METADATA_SECTION_PREFIX}{section}.ndjson"
+
+
+def backup_sections(backup_type: str) -> Tuple[str, ...]:
+    return FULL_SECTIONS if backup_type == "full" else USER_SECTIONS
+
+
+def user_record(user) -> Dict[str, Any]:
+    return {
+        "id": str(user.id),
+        "username": user.username,
+        "email": user.email,
+        "is_active": user.is_active,
+        "is_admin": user.is_admin,
+        "password": user.password,
+        "created_at": str(user.created_at),
+        "updated_at": str(user.updated_at),
+    }
+
+
+def file_record(file, owner_username: str) -> Dict[str, Any]:
+    return {
+        "id": str(file.id),
+        "original_name": file.original_name,
+        "mime_type": file.mime_type,
+        "file_path": file.file_path,
+        "size": file.size,
+        "thumbnail_path": file.thumbnail_path,
+        "preview_path": file.preview_path,
+        "description": file.description,
+        "tags": [str(tid) for tid in file.tags],
+        "category_id": str(file.category_id) if file.category_id else None,
+        "owner_id": str(file.owner_id),
+        "owner_username": owner_username,
+        "created_at": str(file.created_at),
+        "updated_at": str(file.updated_at),
+        "transcoding_status": file.transcoding_status,
+        "duration": file.duration,
+        "hls_manifest_path": file.hls_manifest_path,
+        "dash_manifest_path": file.dash_manifest_path,
+        "content_hash": file.content_hash,
+    }
+
+
+def tag_record(tag) -> Dict[str, Any]:
+    return {
+        "id": str(tag.id),
+        "name": tag.name,
+        "slug": tag.slug,
+        "created_at": str(tag.created_at),
+        "updated_at": str(tag.updated_at),
+    }
+
+
+def category_record(category) -> Dict[str, Any]:
+    return {
+        "id": str(category.id),
+        "name": category.name,
+        "slug": category.slug,
+        "description": category.description,
+        "created_at": str(category.created_at),
+    }
+
+
+def group_record(group) -> Dict[str, Any]:
+    return {
+        "id": str(group.id),
+        "name": group.name,
+        "description": group.description,
+        "creator_id": str(group.creator_id),
+        "access_level": group.access_level,
+        "created_at": str(group.created_at),
+        "updated_at": str(group.updated_at),
+    }
+
+
+def member_record(member) -> Dict[str, Any]:
+    return {
+        "user_id": str(member.user_id),
+        "group_id": str(member.group_id),
+        "role": member.role,
+        "invited_by": str(member.invited_by) if member.invited_by else None,
+        "invited_at": str(member.invited_at),
+        "accepted_at": str(member.accepted_at) if member.accepted_at else None,
+        "revoked_at": str(member.revoked_at) if member.revoked_at else None,
+    }
+
+
+def link_record(link) -> Dict[str, Any]:
+    return {
+        "file_id": str(link.file_id),
+        "group_id": str(link.group_id),
+    }
+
+
+def _section_query(db, section: str, backup_type: str, owner) -> Tuple[Any, Callable[[Any], Dict[str, Any]]]:
+    """Запрос секции и преобразование строки в запись. Для бэкапа пользователя — только связанное с его файлами."""
+    full = backup_type == "full"
+    owner_files = select(DBFile.id).where(DBFile.owner_id == owner.id)
+    if section == "users":
+        return db.query(User).order_by(User.id), user_record
+    if section == "files":
+        if full:
+            query = db.query(DBFile, User.username).outerjoin(User, User.id == DBFile.owner_id).order_by(DBFile.id)
+            return query, lambda row: file_record(row[0], row[1] or "unknown")
+        query = db.query(DBFile).filter(DBFile.owner_id == owner.id).order_by(DBFile.id)
+        return query, lambda file: file_record(file, owner.username)
+    if section == "tags":
+        query = db.query(Tag)
+        if not full:
+            used_tags = select(func.jsonb_array_elements_text(DBFile.tags)).where(DBFile.owner_id == owner.id)
+            query = query.filter(cast(Tag.id, String).in_(used_tags))
+        return query.order_by(Tag.id), tag_record
+    if section == "categories":
+        query = db.query(Category)
+        if not full:
+            query = query.filter(Category.id.in_(select(DBFile.category_id).where(DBFile.owner_id == owner.id)))
+        return query.order_by(Category.id), category_record
+    if section == "groups":
+        query = db.query(Group)
+        if not full:
+            query = query.filter(Group.id.in_(select(file_group.c.group_id).where(file_group.c.file_id.in_(owner_files))))
+        return query.order_by(Group.id), group_record
+    if section == "group_members":
+        return db.query(GroupMember).order_by(GroupMember.group_id, GroupMember.user_id), member_record
+    if section == "file_group_links":
+        query = db.query(file_group)
+        if not full:
+            query = query.filter(file_group.c.file_id.in_(owner_files))
+        return query.order_by(file_group.c.file_id, file_group.c.group_id), link_record
+    raise ValueError(f"Unknown metadata section: {section}")
+
+
+def iter_section_records(section: str, backup_type: str, owner) -> Iterator[Dict[str, Any]]:
+    """Записи секции по одной: строки читаются серверным курсором пакетами BACKUP_METADATA_BATCH_SIZE."""
+    with get_db_session() as db:
+        query, to_record = _section_query(db, section, backup_type, owner)
+        for row in query.yield_per(BACKUP_METADATA_BATCH_SIZE):
+            yield to_record(row)
+
+
+def iter_backup_files(backup_type: str, owner) -> Iterator[DBFile]:
+    """Файлы бэкапа в стабильном порядке (по id), без загрузки всего каталога в память."""
+    with get_db_session() as db:
+        query = db.query(DBFile)
+        if backup_type != "full":
+            query = query.filter(DBFile.owner_id == owner.id)
+        for file in query.order_by(DBFile.id).yield_per(BACKUP_METADATA_BATCH_SIZE):
+            yield file
+
+
+def write_ndjson(dest, records: Iterable[Dict[str, Any]]) -> int:
+    """Пишет записи по одной на строку в файлоподобный dest. Возвращает количество записей."""
+    count = 0
+    buffer = []
+    buffered = 0
+    for record in records:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        buffer.append(line)
+        buffered += len(line)
+        count += 1
+        if buffered >= METADATA_WRITE_BUFFER:
+            dest.write(b"".join(buffer))
+            buffer.clear()
+            buffered = 0
+    if buffer:
+        dest.write(b"".join(buffer))
+    return count
+
+
+def iter_ndjson(chunks: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+    """Разбирает поток байтов NDJSON (куски произвольного размера) в записи по одной."""
+    tail = b""
+    for chunk in chunks:
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if tail.strip():
+        yield json.loads(tail)
@@ -15,36 +15,54 @@ from app.models.base import Category
 from app.models.base import File as DBFile
 from app.models.base import Tag, User, Group, GroupMember
 from app.models.base import file_group # Импортируем таблицу связи
-from app.tasks.backup_tasks import create_backup_task
+from app.services.backup_manifest_service import BACKUP_MODES
+from app.services.blob_storage_service import is_blob_key
+from app.services.s3_transfer_service import iter_s3_object
+from app.tasks.backup_tasks import create_backup_task, create_snapshot_task
 
 
 class BackupService:
-    def _download_file_from_s3(self, file_path: str) -> bytes:
-        """Скачивает файл из S3 и возвращает его содержимое"""
+    def _copy_s3_object_to_zip(self, zip_file: zipfile.ZipFile, file_path: str, arcname: str) -> None:
+        """Копирует объект S3 в архив кусками фиксированного размера, не загружая его в память целиком"""
         try:
-            response = s3_client.get_object(
-                Bucket=settings.AWS_S3_BUCKET_NAME, Key=file_path
-            )
-            return response["Body"].read()
+            chunks = iter_s3_object(file_path)
+            first_chunk = next(chunks, b"")  # ошибка открытия объекта — до создания записи в архиве
+            with zip_file.open(arcname, "w", force_zip64=True) as dest:
+                dest.write(first_chunk)
+                for chunk in chunks:
+                    dest.write(chunk)
         except ClientError as e:
             raise HTTPException(
                 status_code=500, detail=f"Failed to download file from S3: {str(e)}"
             )
 
-    def create_backup(self, current_user: User) -> str: # Теперь возвращает ID задачи
+    def _check_mode(self, mode: str) -> None:
+        if mode not in BACKUP_MODES:
+            raise HTTPException(status_code=400, detail=f"Invalid backup mode: {mode}. Allowed: {', '.join(BACKUP_MODES)}")
+
+    def create_backup(self, current_user: User, mode: str = "full") -> str: # Теперь возвращает ID задачи
         """Запускает задачу создания бэкапа для пользователя и возвращает ID задачи"""
+        self._check_mode(mode)
         # Запускаем задачу Celery асинхронно
-        task = create_backup_task.delay(user_id=str(current_user.id), backup_type="user")
+        task = create_backup_task.delay(user_id=str(current_user.id), backup_type="user", mode=mode)
         return task.id # Возвращаем ID задачи
 
-    def create_full_backup(self, current_user: User) -> str: # Теперь возвращает ID задачи
+    def create_full_backup(self, current_user: User, mode: str = "full") -> str: # Теперь возвращает ID задачи
         """Запускает задачу создания полного бэкапа и возвращает ID задачи"""
         if not current_user.is_admin:
             raise HTTPException(status_code=403, detail="Admin rights required for full backup")
+        self._check_mode(mode)
         # Запускаем задачу Celery асинхронно
-        task = create_backup_task.delay(user_id=str(current_user.id), backup_type="full")
+        task = create_backup_task.delay(user_id=str(current_user.id), backup_type="full", mode=mode)
         return task.id # Возвращаем ID задачи
 
+    def create_snapshot(self, current_user: User, full: bool = False) -> str:
+        """Запускает бэкап серверным копированием объектов (без ZIP) и возвращает ID задачи"""
+        if full and not current_user.is_admin:
+            raise HTTPException(status_code=403, detail="Admin rights required for full backup")
+        task = create_snapshot_task.delay(user_id=str(current_user.id), backup_type="full" if full else "user")
+        return task.id
+
     def _prepare_backup_data(
         self,
         current_user: User,
@@ -89,6 +107,7 @@ class BackupService:
                 "duration": file.duration,
                 "hls_manifest_path": file.hls_manifest_path,
                 "dash_manifest_path": file.dash_manifest_path,
+                "content_hash": file.content_hash,
             }
             backup_data["files"].append(file_data)
 
@@ -202,6 +221,7 @@ class BackupService:
                 "duration": file.duration,
                 "hls_manifest_path": file.hls_manifest_path,
                 "dash_manifest_path": file.dash_manifest_path,
+                "content_hash": file.content_hash,
             }
             backup_data["files"].append(file_data)
 
@@ -277,27 +297,27 @@ class BackupService:
                     zip_file.writestr("backup_metadata.json", json_data)
 
                     # Добавляем реальные файлы из S3
+                    written_blobs = set()  # общий оригинал дубликатов пишем один раз
                     for file in files:
                         try:
                             # Добавляем основной файл
-                            if file.file_path:
-                                file_content = self._download_file_from_s3(file.file_path)
-                                zip_file.writestr(
-                                    f"files/{file.id}_{file.original_name}", file_content
+                            if file.file_path and is_blob_key(file.file_path):
+                                if file.file_path not in written_blobs:
+                                    self._copy_s3_object_to_zip(zip_file, file.file_path, file.file_path)
+                                    written_blobs.add(file.file_path)
+                            elif file.file_path:
+                                self._copy_s3_object_to_zip(
+                                    zip_file, file.file_path, f"files/{file.id}_{file.original_name}"
                                 )
                             # Добавляем thumbnail, если есть
                             if file.thumbnail_path:
-                                thumbnail_content = self._download_file_from_s3(
-                                    file.thumbnail_path
-                                )
-                                zip_file.writestr(
-                                    f"thumbnails/{file.id}_thumbnail.jpg", thumbnail_content
+                                self._copy_s3_object_to_zip(
+                                    zip_file, file.thumbnail_path, f"thumbnails/{file.id}_thumbnail.jpg"
                                 )
                             # Добавляем preview, если есть
                             if file.preview_path:
-                                preview_content = self._download_file_from_s3(file.preview_path)
-                                zip_file.writestr(
-                                    f"previews/{file.id}_preview.jpg", preview_content
+                                self._copy_s3_object_to_zip(
+                                    zip_file, file.preview_path, f"previews/{file.id}_preview.jpg"
                                 )
 
                             # Добавляем транскодированные файлы ---
@@ -308,6 +328,7 @@ class BackupService:
                                 hls_s3_base_parts = file.hls_manifest_path.split('/')
                                 if len(hls_s3_base_parts) >= 3:
                                     hls_s3_base_key = '/'.join(hls_s3_base_parts[:-1]) + '/' # Путь к папке hls
+                                    hls_layout = hls_s3_base_parts[-2] # "hls" или "cmaf" (fMP4 + manifest.mpd)
                                     # Создаем временную папку для транскодированных файлов этого файла
                                     hls_temp_dir = os.path.join(temp_dir, f"hls_files/{file.id}")
                                     os.makedirs(hls_temp_dir, exist_ok=True)
@@ -329,7 +350,7 @@ class BackupService:
                                                         os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
                                                         s3_client.download_file(settings.AWS_S3_BUCKET_NAME, s3_key, local_file_path)
                                                         # Добавляем файл в ZIP, сохраняя структуру папок
-                                                        zip_arcname = f"transcoded/{file.id}/hls/{relative_s3_key}"
+                                                        zip_arcname = f"transcoded/{file.id}/{hls_layout}/{relative_s3_key}"
                                                         zip_file.write(local_file_path, arcname=zip_arcname)
 
                                     except ClientError as e:
@@ -0,0 +1,63 @@
+import os
+import hashlib
+from typing import IO, Tuple
+
+from fastapi import UploadFile
+
+from app.core.config import settings
+from app.core.database import s3_client
+from app.repositories.blob_repository import acquire_blob, blob_exists, release_blob
+from app.repositories.s3_repository import upload_file_to_s3
+
+# Контентно-адресуемое хранение оригиналов: одинаковое содержимое хранится один раз
+CONTENT_ADDRESSED_STORAGE = os.getenv("CONTENT_ADDRESSED_STORAGE", "false").lower() == "true"
+BLOB_PREFIX = "blobs/"
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def blob_key(sha256: str) -> str:
+    return f"{BLOB_PREFIX}{sha256}"
+
+
+def is_blob_key(key: str) -> bool:
+    return bool(key) and key.startswith(BLOB_PREFIX)
+
+
+def hash_fileobj(fileobj: IO[bytes]) -> Tuple[str, int]:
+    """SHA-256 и размер локального (уже принятого сервером) файла; указатель возвращается в начало."""
+    hasher = hashlib.sha256()
+    size = 0
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b""):
+        hasher.update(chunk)
+        size += len(chunk)
+    fileobj.seek(0)
+    return hasher.hexdigest(), size
+
+
+def store_upload(file: UploadFile) -> Tuple[str, str]:
+    """
+    Сохраняет загрузку как blobs/<sha256>. Если такой blob уже есть, запись в S3 пропускается.
+    Возвращает (ключ S3, sha256).
+    """
+    sha256, size = hash_fileobj(file.file)
+    key = blob_key(sha256)
+    uploaded = False
+    if not blob_exists(sha256):
+        upload_file_to_s3(file, key)
+        uploaded = True
+    if acquire_blob(sha256, key, size) and not uploaded:
+        # Последняя ссылка была снята (и объект удален) между проверкой и захватом
+        file.file.seek(0)
+        upload_file_to_s3(file, key)
+    return key, sha256
+
+
+def release_original(key: str) -> bool:
+    """
+    Снимает ссылку файла на оригинал; объект удаляется вместе с последней ссылкой.
+    Возвращает True, если объект удален из S3.
+    """
+    return release_blob(
+        key, lambda object_key: s3_client.delete_object(Bucket=settings.AWS_S3_BUCKET_NAME, Key=object_key)
+    )
@@ -0,0 +1,132 @@
+import time
+import logging
+import threading
+from typing import IO, Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Аргументы ffmpeg: машиночитаемый прогресс в stdout, без интерактивной статистики в stderr
+PROGRESS_ARGS = ("-progress", "pipe:1", "-nostats")
+
+
+class FfmpegProgress:
+    """
+    Состояние одного процесса ffmpeg, собранное из потока `-progress`.
+
+    ffmpeg пишет блоки строк key=value, каждый блок завершается строкой
+    progress=continue или progress=end.
+    """
+
+    def __init__(self):
+        self.out_time = 0.0  # секунды обработанного видео
+        self.speed: Optional[float] = None  # во сколько раз быстрее реального времени
+        self.fps: Optional[float] = None
+        self.frame = 0
+        self.total_size = 0
+        self.finished = False
+        self.started_at = time.monotonic()
+        self.updated_at = self.started_at
+        self.advanced_at = self.started_at  # последний момент, когда out_time рос
+        self._block: Dict[str, str] = {}
+
+    def feed(self, line: str) -> None:
+        """Обрабатывает одну строку потока прогресса."""
+        line = line.strip()
+        if "=" not in line:
+            return
+        key, value = line.split("=", 1)
+        if key != "progress":
+            self._block[key] = value
+            return
+        self._apply_block(self._block)
+        self._block = {}
+        self.updated_at = time.monotonic()
+        if value == "end":
+            self.finished = True
+
+    def _apply_block(self, block: Dict[str, str]) -> None:
+        # out_time_us есть во всех версиях ffmpeg (out_time_ms исторически тоже в микросекундах)
+        out_time_us = block.get("out_time_us") or block.get("out_time_ms")
+        if out_time_us and out_time_us != "N/A":
+            try:
+                out_time = int(out_time_us) / 1_000_000
+                if out_time > self.out_time:
+                    self.out_time = out_time
+                    self.advanced_at = time.monotonic()
+            except ValueError:
+                pass
+        speed = block.get("speed", "").rstrip("x").strip()
+        if speed and speed != "N/A":
+            try:
+                self.speed = float(speed)
+            except ValueError:
+                pass
+        for key, attr, cast in (("fps", "fps", float), ("frame", "frame", int), ("total_size", "total_size", int)):
+            value = block.get(key)
+            if value and value != "N/A":
+                try:
+                    setattr(self, attr, cast(value))
+                except ValueError:
+                    pass
+
+    def average_speed(self) -> Optional[float]:
+        """Средняя скорость с момента запуска (устойчивее мгновенной)."""
+        elapsed = self.updated_at - self.started_at
+        if elapsed <= 0 or self.out_time <= 0:
+            return self.speed
+        return self.out_time / elapsed
+
+
+def start_progress_reader(stream: IO[bytes], progress: FfmpegProgress) -> threading.Thread:
+    """Читает поток `-progress` ffmpeg в фоновом потоке."""
+
+    def _reader():
+        try:
+            for raw_line in iter(stream.readline, b""):
+                progress.feed(raw_line.decode("utf-8", errors="replace"))
+        except Exception as e:
+            logger.warning(f"Error reading ffmpeg progress: {e}")
+        finally:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    thread = threading.Thread(target=_reader, daemon=True)
+    thread.start()
+    return thread
+
+
+def summarize_progress(
+    progresses: List[FfmpegProgress],
+    duration: Optional[float],
+    completed_passes: int = 0,
+    total_passes: int = 1,
+) -> Dict[str, Any]:
+    """
+    Сводит прогресс параллельных (или последовательных) проходов ffmpeg.
+
+    Параллельные процессы ограничены самым медленным, поэтому берется минимум;
+    для последовательных проходов учитываются уже завершенные проходы.
+    """
+    active = [p for p in progresses if p is not None]
+    out_time = min((p.out_time for p in active), default=0.0)
+    speeds = [s for s in (p.average_speed() for p in active) if s]
+    speed = min(speeds) if speeds else None
+
+    percent = None
+    eta_seconds = None
+    if duration:
+        total_passes = max(1, total_passes)
+        done = (completed_passes * duration + min(out_time, duration)) / (total_passes * duration)
+        percent = round(min(99.9, done * 100), 1)
+        if speed:
+            remaining_media = (total_passes - completed_passes) * duration - min(out_time, duration)
+            eta_seconds = int(max(0.0, remaining_media) / speed)
+
+    return {
+        "out_time": round(out_time, 2),
+        "speed": round(speed, 2) if speed else None,
+        "percent": percent,
+        "eta_seconds": eta_seconds,
+    }
@@ -21,15 +21,20 @@ from app.repositories.file_repository import (
     update_file,
 )
 from app.repositories.s3_repository import upload_file_to_s3
+from app.repositories.transcoded_asset_repository import attach_transcoded_asset, release_transcoded_asset
 from app.repositories.tag_repository import get_or_create_tags, get_tag_names_by_ids
-from app.schemas.file_schemas import FileCreate, FileResponse
+from app.schemas.file_schemas import FileCreate, FileResponse, TranscodeStatusResponse
+from app.services.blob_storage_service import CONTENT_ADDRESSED_STORAGE, is_blob_key, release_original, store_upload
+from app.services.media_cache import media_cache
 from app.services.s3_service import create_thumbnail_from_s3
+from app.services.transcoded_storage import delete_transcoded_output, transcoded_base_path
 from app.services.group_service import _check_user_can_read_file, _check_user_can_edit_file_in_group, _check_user_can_add_file
 import requests
 import tempfile
 import os
 import time
 import mimetypes
+from datetime import datetime, timezone
 from uuid import UUID
 from urllib.parse import urlparse
 from fastapi import UploadFile, File, HTTPException
@@ -37,6 +42,10 @@ from app.services.group_service import _check_user_can_edit_group
 from app.repositories.group_repository import get_group_by_id_db
 
 SORT_FIELD_MAP = {"date": "created_at", "name": "original_name", "size": "size", "duration": 'duration'}
+# Через сколько секунд без обновлений прогресса задача считается зависшей
+TRANSCODE_STALLED_AFTER_SECONDS = int(os.getenv("TRANSCODE_STALLED_AFTER_SECONDS", "300"))
+# Миниатюра видео требует скачать оригинал: celery — в приоритетной очереди миниатюр, inline — в запросе загрузки
+VIDEO_THUMBNAIL_DISPATCH = os.getenv("VIDEO_THUMBNAIL_DISPATCH", "celery")
 
 
 def generate_key(filename: str) -> str:
@@ -55,10 +64,15 @@ def save_file_metadata(
         raise HTTPException(status_code=401, detail="Not authorized")
 
     key = generate_key(file.filename)
+    # Миниатюра принадлежит файлу, даже если оригинал общий с дубликатом
+    thumbnail_name = key
     file.file.seek(0)
 
-    # Загружаем файл на S3 ПЕРЕД обработкой
-    upload_file_to_s3(file, key)
+    # Загружаем файл на S3 ПЕРЕД обработкой (хэш содержимого считается в том же проходе)
+    if CONTENT_ADDRESSED_STORAGE:
+        key, content_hash = store_upload(file)
+    else:
+        content_hash = upload_file_to_s3(file, key)
     
     # Перемещаем указатель в начало для повторного чтения (если нужно)
 
@@ -68,10 +82,12 @@ def save_file_metadata(
     category_id = get_category_id_by_slug(category_slug)
 
     thumbnail_key = None
+    queue_video_thumbnail = file.content_type.startswith("video/") and VIDEO_THUMBNAIL_DISPATCH == "celery"
     # Для создания превью скачайте файл с S3 или используйте отдельный поток
-    if file.content_type.startswith("image/") or file.content_type.startswith("video/"):
+    # (миниатюра видео из очереди ставится после создания записи файла)
+    if (file.content_type.startswith("image/") or file.content_type.startswith("video/")) and not queue_video_thumbnail:
         # Создайте превью отдельно, не загружая весь файл в память
-        thumbnail_key = create_thumbnail_from_s3(key, file.content_type)
+        thumbnail_key = create_thumbnail_from_s3(key, file.content_type, thumbnail_name)
 
     if group_id:
         temp_user = User(id=owner.id) # Создаем временного пользователя
@@ -90,14 +106,26 @@ def save_file_metadata(
         category_id=category_id,
         thumbnail_path=thumbnail_key,
         group_id=group_id,
+        content_hash=content_hash,
     )
 
     file_record = create_file(file_create)
-    file_record = FileMetadataService.enrich_file_metadata(file_record)
     from app.services.transcode_service import start_transcoding
 
+    if queue_video_thumbnail:
+        from app.tasks.generate_thumbnail import generate_thumbnail_task
+
+        generate_thumbnail_task.delay(str(file_record.id), thumbnail_name)
+
     if file_record.mime_type and file_record.mime_type.startswith("video/"):
-        start_transcoding(str(file_record.id))
+        # Такое же содержимое уже транскодировано — используем общий результат
+        asset = attach_transcoded_asset(file_record.id, content_hash)
+        if asset:
+            print(f"Reusing transcoded output {asset.base_path} for duplicate upload {file_record.id}")
+            file_record = get_file_by_id(file_record.id)
+        else:
+            start_transcoding(str(file_record.id))
+    file_record = FileMetadataService.enrich_file_metadata(file_record)
     return FileResponse.model_validate(file_record)
 
 
@@ -193,6 +221,40 @@ def search_files_service(
     }
 
 
+def get_transcode_status_service(file_id: str, user_id: str) -> TranscodeStatusResponse:
+    """Прогресс транскодирования файла: этап, процент, скорость и ETA"""
+    file = get_file_by_id(file_id)
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+    temp_user = User(id=user_id) # Это временный объект, используемый только для проверки
+    if not _check_user_can_read_file(file, temp_user):
+        raise HTTPException(status_code=403, detail="Access denied to file")
+
+    progress = file.transcoding_progress or {}
+    stalled = False
+    updated_at = progress.get("updated_at")
+    if file.transcoding_status == "processing" and updated_at:
+        try:
+            age = datetime.now(timezone.utc) - datetime.fromisoformat(updated_at)
+            stalled = age.total_seconds() > TRANSCODE_STALLED_AFTER_SECONDS
+        except (TypeError, ValueError):
+            stalled = False
+
+    return TranscodeStatusResponse(
+        file_id=file.id,
+        transcoding_status=file.transcoding_status,
+        stage=progress.get("stage"),
+        percent=progress.get("percent"),
+        speed=progress.get("speed"),
+        eta_seconds=progress.get("eta_seconds"),
+        segments_done=progress.get("segments_done"),
+        playable=bool(progress.get("playable")) or file.transcoding_status == "completed",
+        started_at=progress.get("started_at"),
+        updated_at=updated_at,
+        stalled=stalled,
+    )
+
+
 def update_file_metadata(
     file_id: str,
     description: str | None,
@@ -486,11 +548,15 @@ class FileStorageService:
     @staticmethod
     def delete_file_from_s3(file: File) -> None:
         """Удаление всех связанных файлов из S3"""
-        # Удаляем основной файл
+        # Удаляем основной файл (общий blob — только вместе с последней ссылкой)
         try:
-            s3_client.delete_object(
-                Bucket=settings.AWS_S3_BUCKET_NAME, Key=file.file_path
-            )
+            if is_blob_key(file.file_path):
+                if not release_original(file.file_path):
+                    print(f"Blob {file.file_path} is still referenced by other files, keeping it")
+            else:
+                s3_client.delete_object(
+                    Bucket=settings.AWS_S3_BUCKET_NAME, Key=file.file_path
+                )
         except ClientError as e:
             # Логируем ошибку, но не прерываем процесс удаления
             print(f"Failed to delete main file from S3: {str(e)}")
@@ -516,35 +582,18 @@ class FileStorageService:
         # Проверяем, есть ли путь к HLS манифесту (это указывает на наличие транскодированных файлов)
         if file.hls_manifest_path:
             try:
-                # Определяем базовый префикс для файлов транскодирования
-                # hls_manifest_path обычно выглядит как transcoded/<file_id>/hls/master.m3u8
-                # Нам нужно удалить всю папку transcoded/<file_id>/hls/
-                hls_s3_base_parts = file.hls_manifest_path.split('/')
-                if len(hls_s3_base_parts) >= 3:
-                     # Формируем префикс папки: transcoded/<file_id>/hls/
-                    transcoded_prefix = f"transcoded/{file.id}/hls/"
-
-                    # Используем пагинатор для перечисления и удаления всех объектов с этим префиксом
-                    paginator = s3_client.get_paginator('list_objects_v2')
-                    pages = paginator.paginate(Bucket=settings.AWS_S3_BUCKET_NAME, Prefix=transcoded_prefix)
-
-                    delete_keys = []
-                    for page in pages:
-                        if 'Contents' in page:
-                            for obj in page['Contents']:
-                                delete_keys.append({'Key': obj['Key']})
-
-                    # Удаляем объекты пакетно (DeleteObjects принимает до 1000 ключей за раз)
-                    if delete_keys:
-                        for i in range(0, len(delete_keys), 1000):
-                            batch = delete_keys[i:i + 1000]
-                            s3_client.delete_objects(
-                                Bucket=settings.AWS_S3_BUCKET_NAME,
-                                Delete={'Objects': batch}
-                            )
-                        print(f"Deleted transcoded files for file ID {file.id} from S3 prefix: {transcoded_prefix}")
-                    else:
-                        print(f"No transcoded files found in S3 prefix: {transcoded_prefix} for file ID {file.id}")
+                # Определяем директорию результата транскодирования
+                # hls_manifest_path выглядит как transcoded/<file_id>/<запуск>/hls/master.m3u8
+                # (или .../cmaf/master.m3u8 для CMAF с общим manifest.mpd; у старых результатов без <запуск>)
+                # Результат может быть общим для файлов с одинаковым содержимым (другой <file_id>) —
+                # удаляем его только вместе с последней ссылкой
+                transcoded_base = transcoded_base_path(file.hls_manifest_path)
+                if transcoded_base and not release_transcoded_asset(transcoded_base):
+                    print(f"Transcoded files {transcoded_base} are still shared, keeping them for other files")
+                elif transcoded_base:
+                    deleted = delete_transcoded_output(transcoded_base)
+                    print(f"Deleted {deleted} transcoded files for file ID {file.id} from S3 prefix: {transcoded_base}/")
+                    media_cache.invalidate_prefix(f"{transcoded_base}/")
 
             except ClientError as e:
                 print(f"Failed to delete transcoded files from S3 for file ID {file.id}: {str(e)}")
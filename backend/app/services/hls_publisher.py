@@ -0,0 +1,154 @@
+import os
+import logging
+from typing import Dict, List, Set, Tuple
+
+from app.services.s3_transfer_service import (
+    upload_bytes_with_retry,
+    upload_file_with_retry,
+    upload_files_concurrently,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_media_playlist(content: str) -> Tuple[List[Tuple[str, float]], bool]:
+    """
+    Разбирает media-плейлист HLS.
+    Возвращает список (имя сегмента, длительность) и признак #EXT-X-ENDLIST.
+    """
+    segments = []
+    ended = False
+    pending_duration = 0.0
+    for raw_line in content.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+        if line.startswith("#EXTINF:"):
+            try:
+                pending_duration = float(line[len("#EXTINF:"):].split(",")[0])
+            except ValueError:
+                pending_duration = 0.0
+        elif line == "#EXT-X-ENDLIST":
+            ended = True
+        elif not line.startswith("#"):
+            segments.append((line, pending_duration))
+            pending_duration = 0.0
+    return segments, ended
+
+
+def to_vod_playlist(content: str) -> str:
+    """Превращает EVENT-плейлист в VOD и гарантирует наличие #EXT-X-ENDLIST."""
+    lines = []
+    has_type = False
+    for line in content.splitlines():
+        if line.startswith("#EXT-X-PLAYLIST-TYPE:"):
+            line = "#EXT-X-PLAYLIST-TYPE:VOD"
+            has_type = True
+        lines.append(line)
+    if not has_type:
+        # Тип ставим сразу после заголовка #EXTM3U
+        lines.insert(1, "#EXT-X-PLAYLIST-TYPE:VOD")
+    if "#EXT-X-ENDLIST" not in (line.strip() for line in lines):
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+class HlsProgressivePublisher:
+    """
+    Публикует HLS в S3 по мере работы ffmpeg.
+
+    Сегмент считается готовым, когда ffmpeg вписал его в свой плейлист.
+    Порядок публикации: сначала новые сегменты, затем плейлист рендитции (EVENT),
+    мастер-плейлист — когда у каждой рендитции есть хотя бы один сегмент.
+    """
+
+    def __init__(self, local_dir: str, s3_hls_path: str, stream_count: int):
+        self.local_dir = local_dir
+        self.s3_hls_path = s3_hls_path
+        self.stream_count = stream_count
+        self.reset()
+
+    def reset(self):
+        """Сбрасывает состояние (например, при переходе с copy на перекодирование)."""
+        self.uploaded: Dict[int, Set[str]] = {i: set() for i in range(self.stream_count)}
+        self.durations: Dict[int, float] = {i: 0.0 for i in range(self.stream_count)}
+        self.playlist_cache: Dict[int, str] = {}
+        self.master_published = False
+
+    @property
+    def segments_done(self) -> int:
+        """Количество опубликованных сегментов у самой медленной рендитции."""
+        return min((len(s) for s in self.uploaded.values()), default=0)
+
+    @property
+    def seconds_done(self) -> float:
+        """Длительность опубликованного видео у самой медленной рендитции."""
+        return min(self.durations.values(), default=0.0)
+
+    def _stream_dir(self, index: int) -> str:
+        return os.path.join(self.local_dir, f"stream_{index}")
+
+    def _read_playlist(self, index: int) -> str:
+        playlist_path = os.path.join(self._stream_dir(index), "playlist.m3u8")
+        if not os.path.exists(playlist_path):
+            return ""
+        with open(playlist_path, "r") as f:
+            return f.read()
+
+    def _publish_stream(self, index: int, final: bool = False) -> None:
+        content = self._read_playlist(index)
+        if not content:
+            return
+        segments, _ = parse_media_playlist(content)
+
+        stream_dir = self._stream_dir(index)
+        new_items = []
+        new_duration = 0.0
+        for name, duration in segments:
+            if name in self.uploaded[index]:
+                continue
+            local_path = os.path.join(stream_dir, name)
+            if not os.path.isfile(local_path):
+                # Плейлист прочитан раньше, чем сегмент появился на диске — догоним на следующем опросе
+                return
+            new_items.append((local_path, f"{self.s3_hls_path}/stream_{index}/{name}"))
+            new_duration += duration
+
+        if new_items:
+            errors = upload_files_concurrently(new_items)
+            if errors:
+                raise Exception(f"Failed to upload {len(errors)} segments for stream_{index}")
+            self.uploaded[index].update(os.path.basename(local) for local, _ in new_items)
+            self.durations[index] += new_duration
+
+        if final:
+            content = to_vod_playlist(content)
+        if content != self.playlist_cache.get(index):
+            upload_bytes_with_retry(content.encode("utf-8"), f"{self.s3_hls_path}/stream_{index}/playlist.m3u8")
+            self.playlist_cache[index] = content
+
+    def _publish_master(self) -> None:
+        master_local = os.path.join(self.local_dir, "master.m3u8")
+        if os.path.exists(master_local):
+            upload_file_with_retry(master_local, f"{self.s3_hls_path}/master.m3u8")
+            self.master_published = True
+
+    def poll(self) -> bool:
+        """
+        Публикует всё, что ffmpeg успел завершить с прошлого вызова.
+        Возвращает True, если мастер-плейлист был опубликован именно сейчас.
+        """
+        for index in range(self.stream_count):
+            self._publish_stream(index)
+        if not self.master_published and all(self.uploaded[i] for i in range(self.stream_count)):
+            self._publish_master()
+            return self.master_published
+        return False
+
+    def finalize(self) -> None:
+        """Финальная публикация: плейлисты рендитций переводятся в VOD с #EXT-X-ENDLIST."""
+        for index in range(self.stream_count):
+            self._publish_stream(index, final=True)
+        if not self.master_published:
+            self._publish_master()
+        logger.info(f"Progressive HLS publishing finalized for {self.s3_hls_path}")
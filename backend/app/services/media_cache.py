@@ -0,0 +1,289 @@
+import os
+import time
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- Параметры кэша плейлистов и сегментов ---
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))  # 0 — кэш выключен
+MEDIA_CACHE_MAX_ITEM_BYTES = int(os.getenv("MEDIA_CACHE_MAX_ITEM_BYTES", str(8 * 1024 * 1024)))
+# Страховка для нескольких воркеров API: инвалидация в памяти видна только своему процессу
+MEDIA_CACHE_TTL_SECONDS = int(os.getenv("MEDIA_CACHE_TTL_SECONDS", "600"))
+MEDIA_CACHE_REDIS_URL = os.getenv("MEDIA_CACHE_REDIS_URL", "")  # пусто — без Redis-уровня
+MEDIA_CACHE_DISK_DIR = os.getenv("MEDIA_CACHE_DISK_DIR", "")  # пусто — без дискового уровня
+MEDIA_CACHE_DISK_MAX_BYTES = int(os.getenv("MEDIA_CACHE_DISK_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+REDIS_KEY_PREFIX = "media_cache:"
+
+
+class CacheStats:
+    """Счетчики попаданий и промахов одного уровня кэша."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+        }
+
+
+class MemoryTier:
+    """LRU в памяти процесса с бюджетом в байтах и TTL записей."""
+
+    name = "memory"
+
+    def __init__(self, max_bytes: int, ttl_seconds: int):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.current_bytes = 0
+        self.evictions = 0
+        self._items: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (value, time.monotonic() + self.ttl_seconds)
+            self.current_bytes += len(value)
+            while self.current_bytes > self.max_bytes and self._items:
+                oldest = next(iter(self._items))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete_prefix(self, prefix: str) -> None:
+        with self._lock:
+            for key in [key for key in self._items if key.startswith(prefix)]:
+                self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        value, _ = self._items.pop(key)
+        self.current_bytes -= len(value)
+
+    def describe(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+class RedisTier:
+    """Общий для всех воркеров уровень в Redis (TTL задается самим Redis)."""
+
+    name = "redis"
+
+    def __init__(self, url: str, ttl_seconds: int):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(REDIS_KEY_PREFIX + key)
+
+    def set(self, key: str, value: bytes) -> None:
+        self.client.set(REDIS_KEY_PREFIX + key, value, ex=self.ttl_seconds)
+
+    def delete_prefix(self, prefix: str) -> None:
+        keys = list(self.client.scan_iter(match=f"{REDIS_KEY_PREFIX}{prefix}*", count=500))
+        for i in range(0, len(keys), 500):
+            self.client.delete(*keys[i:i + 500])
+
+    def describe(self) -> Dict[str, Any]:
+        return {"url": MEDIA_CACHE_REDIS_URL.rsplit("@", 1)[-1]}
+
+
+class DiskTier:
+    """Локальный дисковый уровень: ключ S3 повторяется в структуре каталогов."""
+
+    name = "disk"
+
+    def __init__(self, directory: str, max_bytes: int, ttl_seconds: int):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.written_bytes = 0  # с последней проверки бюджета
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key: str) -> Optional[str]:
+        path = os.path.abspath(os.path.join(self.directory, key))
+        if not path.startswith(self.directory + os.sep):
+            return None
+        return path
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        if not path:
+            return None
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                value = f.read()
+            os.utime(path, None)  # mtime служит отметкой последнего использования для LRU
+            return value
+        except OSError:
+            return None
+
+    def set(self, key: str, value: bytes) -> None:
+        path = self._path(key)
+        if not path:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(value)
+        os.replace(temp_path, path)
+        with self._lock:
+            self.written_bytes += len(value)
+            if self.written_bytes > self.max_bytes // 10:
+                self.written_bytes = 0
+                self._enforce_budget()
+
+    def _enforce_budget(self) -> None:
+        entries: List[Tuple[float, int, str]] = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def delete_prefix(self, prefix: str) -> None:
+        path = self._path(prefix.rstrip("/"))
+        if path and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"directory": self.directory, "max_bytes": self.max_bytes}
+
+
+class MediaCache:
+    """
+    Многоуровневый кэш объектов HLS/DASH по ключу S3: память -> Redis -> диск.
+    Попадание на нижнем уровне поднимает объект в память.
+    """
+
+    def __init__(self, memory: Optional[MemoryTier], tiers: List[Any], max_item_bytes: int):
+        self.memory = memory
+        self.tiers = tiers
+        self.max_item_bytes = max_item_bytes
+        self.stats: Dict[str, CacheStats] = {"total": CacheStats()}
+        for tier in [memory] + tiers:
+            if tier:
+                self.stats[tier.name] = CacheStats()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.memory or self.tiers)
+
+    def get(self, key: str) -> Optional[bytes]:
+        if self.memory:
+            value = self.memory.get(key)
+            self.stats["memory"].record(value is not None)
+            if value is not None:
+                self.stats["total"].record(True)
+                return value
+        for tier in self.tiers:
+            try:
+                value = tier.get(key)
+            except Exception as e:
+                logger.warning(f"Media cache {tier.name} get failed for {key}: {e}")
+                value = None
+            self.stats[tier.name].record(value is not None)
+            if value is not None:
+                if self.memory:
+                    self.memory.set(key, value)
+                self.stats["total"].record(True)
+                return value
+        self.stats["total"].record(False)
+        return None
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_item_bytes:
+            return
+        if self.memory:
+            self.memory.set(key, value)
+        for tier in self.tiers:
+            try:
+                tier.set(key, value)
+            except Exception as e:
+                logger.warning(f"Media cache {tier.name} set failed for {key}: {e}")
+
+    def invalidate_prefix(self, prefix: str) -> None:
+        for tier in [self.memory] + self.tiers:
+            if not tier:
+                continue
+            try:
+                tier.delete_prefix(prefix)
+            except Exception as e:
+                logger.warning(f"Media cache {tier.name} invalidation failed for {prefix}: {e}")
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "max_item_bytes": self.max_item_bytes,
+            "stats": {name: stats.as_dict() for name, stats in self.stats.items()},
+            "tiers": {tier.name: tier.describe() for tier in [self.memory] + self.tiers if tier},
+        }
+
+
+def _build_media_cache() -> MediaCache:
+    memory = MemoryTier(MEDIA_CACHE_MAX_BYTES, MEDIA_CACHE_TTL_SECONDS) if MEDIA_CACHE_MAX_BYTES > 0 else None
+    tiers = []
+    if MEDIA_CACHE_REDIS_URL:
+        try:
+            tiers.append(RedisTier(MEDIA_CACHE_REDIS_URL, MEDIA_CACHE_TTL_SECONDS))
+        except Exception as e:
+            logger.warning(f"Media cache Redis tier disabled: {e}")
+    if MEDIA_CACHE_DISK_DIR:
+        try:
+            tiers.append(DiskTier(MEDIA_CACHE_DISK_DIR, MEDIA_CACHE_DISK_MAX_BYTES, MEDIA_CACHE_TTL_SECONDS))
+        except OSError as e:
+            logger.warning(f"Media cache disk tier disabled: {e}")
+    return MediaCache(memory, tiers, MEDIA_CACHE_MAX_ITEM_BYTES)
+
+
+media_cache = _build_media_cache()
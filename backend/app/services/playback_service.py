@@ -0,0 +1,167 @@
+import os
+import re
+import time
+from typing import Any, Dict, Optional
+
+from botocore.exceptions import ClientError
+from fastapi import HTTPException
+from jose import JWTError, jwt
+
+from app.core.config import settings
+from app.core.database import s3_client, s3_public_client
+from app.models.base import File, User
+from app.repositories.file_repository import get_file_by_id
+from app.schemas.file_schemas import PlaybackSessionResponse
+from app.services.group_service import _check_user_can_read_file
+from app.services.media_cache import media_cache
+
+# Сессия воспроизведения: права проверяются один раз при выдаче токена,
+# дальше плейлисты и сегменты отдаются по подписанному токену без обращений к БД
+PLAYBACK_SESSION_TTL_SECONDS = int(os.getenv("PLAYBACK_SESSION_TTL_SECONDS", "7200"))
+PLAYBACK_TOKEN_TYPE = "playback"
+MASTER_MANIFESTS = ("master.m3u8", "manifest.mpd")
+# Ссылки на сегменты в media-плейлистах заменяются presigned URL хранилища:
+# трафик сегментов идет напрямую в S3/MinIO, API отдает только плейлисты
+PLAYBACK_PRESIGN_SEGMENTS = os.getenv("PLAYBACK_PRESIGN_SEGMENTS", "true").lower() == "true"
+URI_ATTRIBUTE_RE = re.compile(r'URI="([^"]+)"')
+
+
+def _manifest_dir(manifest_path: Optional[str]) -> Optional[str]:
+    if not manifest_path:
+        return None
+    return "/".join(manifest_path.split("/")[:-1])
+
+
+def create_playback_token(claims: Dict[str, Any], ttl_seconds: int = PLAYBACK_SESSION_TTL_SECONDS) -> str:
+    """Подписывает (HMAC, тот же секрет, что и у access-токенов) токен сессии воспроизведения."""
+    to_encode = dict(claims, typ=PLAYBACK_TOKEN_TYPE, exp=int(time.time()) + ttl_seconds)
+    return jwt.encode(to_encode, settings.JWT_SECRET_KEY, algorithm=settings.JWT_ALGORITHM)
+
+
+def verify_playback_token(token: str, file_id: str) -> Dict[str, Any]:
+    """Проверяет подпись, срок действия и привязку токена к файлу. Без обращений к БД."""
+    try:
+        claims = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=403, detail="Invalid or expired playback session")
+    if claims.get("typ") != PLAYBACK_TOKEN_TYPE or claims.get("fid") != str(file_id):
+        raise HTTPException(status_code=403, detail="Invalid playback session")
+    return claims
+
+
+def resolve_playback_key(claims: Dict[str, Any], manifest_type: str, manifest_name: str) -> str:
+    """Ключ объекта в S3 внутри директории манифеста, зафиксированной в токене."""
+    base_path = claims.get(manifest_type) if manifest_type in ("hls", "dash") else None
+    if not base_path:
+        raise HTTPException(status_code=404, detail="Manifest not found or transcoding not completed")
+    if any(part in ("", ".", "..") for part in manifest_name.split("/")):
+        raise HTTPException(status_code=400, detail="Invalid manifest path")
+    return f"{base_path}/{manifest_name}"
+
+
+def session_expires_in(claims: Dict[str, Any]) -> int:
+    """Сколько секунд осталось до окончания сессии."""
+    return max(1, int(claims.get("exp", 0)) - int(time.time()))
+
+
+def _presign_segment(s3_key: str, expires_in: int) -> str:
+    return s3_public_client.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": settings.AWS_S3_BUCKET_NAME, "Key": s3_key},
+        ExpiresIn=expires_in,
+    )
+
+
+def rewrite_media_playlist(content: str, base_key: str, expires_in: int) -> str:
+    """
+    Заменяет относительные URI сегментов (и init-сегмента в #EXT-X-MAP) на presigned URL.
+    Мастер-плейлист не трогаем: его ссылки ведут на media-плейлисты, которые
+    должны запрашиваться через API, чтобы тоже быть переписанными.
+    """
+    if "#EXTINF" not in content:
+        return content
+
+    def resolve(uri: str) -> str:
+        if "://" in uri:
+            return uri
+        return _presign_segment(f"{base_key}/{uri}", expires_in)
+
+    lines = []
+    for line in content.splitlines():
+        stripped = line.strip()
+        if stripped and not stripped.startswith("#"):
+            line = resolve(stripped)
+        elif stripped.startswith("#EXT-X-MAP:"):
+            line = URI_ATTRIBUTE_RE.sub(lambda m: f'URI="{resolve(m.group(1))}"', line)
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def load_session_playlist(claims: Dict[str, Any], s3_key: str) -> str:
+    """
+    Читает плейлист из S3 (или из кэша, если видео готово) и переписывает
+    ссылки на сегменты с учетом срока сессии. В кэше хранится исходный плейлист.
+    """
+    use_cache = media_cache.enabled and not claims.get("live")
+    raw = media_cache.get(s3_key) if use_cache else None
+    if raw is None:
+        try:
+            s3_response = s3_client.get_object(Bucket=settings.AWS_S3_BUCKET_NAME, Key=s3_key)
+            raw = s3_response["Body"].read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                raise HTTPException(status_code=404, detail="Manifest not found in storage")
+            raise HTTPException(status_code=500, detail=f"S3 error: {str(e)}")
+        if use_cache:
+            media_cache.set(s3_key, raw)
+    content = raw.decode("utf-8")
+    return rewrite_media_playlist(content, s3_key.rsplit("/", 1)[0], session_expires_in(claims))
+
+
+def build_playback_session(file: File, user: User) -> PlaybackSessionResponse:
+    """Выдает токен сессии для файла, доступ к которому уже проверен вызывающим кодом."""
+    hls_path = _manifest_dir(file.hls_manifest_path)
+    dash_path = _manifest_dir(file.dash_manifest_path)
+    if not (hls_path or dash_path):
+        raise HTTPException(status_code=404, detail="Manifest not found or transcoding not completed")
+
+    ttl_seconds = PLAYBACK_SESSION_TTL_SECONDS
+    token = create_playback_token(
+        {
+            "fid": str(file.id),
+            "uid": str(user.id),
+            "hls": hls_path,
+            "dash": dash_path,
+            # Пока идет прогрессивное транскодирование, плейлисты дописываются
+            "live": file.transcoding_status != "completed",
+        },
+        ttl_seconds,
+    )
+    base_url = f"/files/{file.id}/play/{token}"
+    return PlaybackSessionResponse(
+        file_id=file.id,
+        token=token,
+        expires_in=ttl_seconds,
+        hls_url=f"{base_url}/hls/master.m3u8" if hls_path else None,
+        dash_url=f"{base_url}/dash/manifest.mpd" if dash_path else None,
+    )
+
+
+def check_playback_access(file: File, user: User) -> None:
+    """
+    Доступ к воспроизведению файла — одна проверка и для мастер-манифеста, и для выдачи токена:
+    иначе редирект на сессию и сама сессия могли бы разойтись в правах.
+    """
+    if not _check_user_can_read_file(file, user):
+        raise HTTPException(status_code=403, detail="Access denied to file")
+
+
+def create_playback_session_service(file_id: str, user: User) -> PlaybackSessionResponse:
+    """Проверяет доступ к файлу и выдает токен сессии воспроизведения."""
+    file = get_file_by_id(file_id)
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+    check_playback_access(file, user)
+    if file.transcoding_status != "completed" and not (file.transcoding_progress or {}).get("playable"):
+        raise HTTPException(status_code=404, detail="Manifest not found or transcoding not completed")
+    return build_playback_session(file, user)
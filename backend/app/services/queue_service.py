@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import logging
+from typing import Any, Dict, Optional
+
+from app.celery_app import ENQUEUED_AT_HEADER, QUEUE_CONCURRENCY, QUEUES, celery_app
+
+logger = logging.getLogger(__name__)
+
+QUEUE_INSPECT_TIMEOUT = float(os.getenv("QUEUE_INSPECT_TIMEOUT", "1.0"))  # ожидание ответа воркеров, секунды
+
+
+def _oldest_enqueued_at(channel, queue: str) -> Optional[float]:
+    """
+    Время постановки самой старой ожидающей задачи (только Redis: сообщения
+    добавляются LPUSH и забираются с правого конца списка).
+    """
+    client = getattr(channel, "client", None)
+    if client is None or not hasattr(channel, "_q_for_pri"):
+        return None
+    oldest = None
+    for priority in channel.priority_steps:
+        raw = client.lindex(channel._q_for_pri(queue, priority), -1)
+        if not raw:
+            continue
+        try:
+            enqueued_at = json.loads(raw).get("headers", {}).get(ENQUEUED_AT_HEADER)
+        except (ValueError, AttributeError):
+            continue
+        if enqueued_at and (oldest is None or enqueued_at < oldest):
+            oldest = float(enqueued_at)
+    return oldest
+
+
+def _queue_depth(channel, queue: str) -> int:
+    # Redis: пустая очередь — это отсутствующий ключ, пассивное объявление на ней падает
+    if hasattr(channel, "_size"):
+        return channel._size(queue)
+    return channel.queue_declare(queue=queue, passive=True).message_count
+
+
+def _count_worker_tasks(replies: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    counts = {queue: 0 for queue in QUEUES}
+    for tasks in (replies or {}).values():
+        for task in tasks:
+            queue = (task.get("delivery_info") or {}).get("routing_key")
+            if queue in counts:
+                counts[queue] += 1
+    return counts
+
+
+def get_queue_depth(queue: str) -> Optional[int]:
+    """Число ожидающих задач в очереди; None, если брокер недоступен."""
+    try:
+        with celery_app.connection_for_read() as connection:
+            return _queue_depth(connection.default_channel, queue)
+    except Exception as e:
+        logger.warning(f"Failed to read depth of queue {queue}: {e}")
+        return None
+
+
+def get_queue_stats() -> Dict[str, Any]:
+    """Глубина очередей, возраст самой старой ожидающей задачи и задачи в работе по очередям."""
+    now = time.time()
+    queues: Dict[str, Dict[str, Any]] = {}
+    with celery_app.connection_for_read() as connection:
+        channel = connection.default_channel
+        for queue in QUEUES:
+            stats: Dict[str, Any] = {"concurrency": QUEUE_CONCURRENCY[queue], "depth": None, "oldest_age_seconds": None}
+            try:
+                stats["depth"] = _queue_depth(channel, queue)
+                oldest = _oldest_enqueued_at(channel, queue)
+                if oldest is not None:
+                    stats["oldest_age_seconds"] = round(max(0.0, now - oldest), 1)
+            except Exception as e:
+                logger.warning(f"Failed to read depth of queue {queue}: {e}")
+            queues[queue] = stats
+
+    inspect = celery_app.control.inspect(timeout=QUEUE_INSPECT_TIMEOUT)
+    try:
+        active = inspect.active()
+        reserved = inspect.reserved()
+    except Exception as e:
+        logger.warning(f"Failed to inspect Celery workers: {e}")
+        active = reserved = None
+    active_counts = _count_worker_tasks(active)
+    reserved_counts = _count_worker_tasks(reserved)
+    for queue, stats in queues.items():
+        stats["active"] = active_counts[queue]
+        stats["reserved"] = reserved_counts[queue]
+
+    return {
+        "queues": queues,
+        "workers": sorted(active or {}),
+        "workers_responding": active is not None,
+    }
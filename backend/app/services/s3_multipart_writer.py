@@ -0,0 +1,180 @@
+import os
+import json
+import hashlib
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from app.core.config import settings
+from app.core.database import s3_client
+from app.services.s3_transfer_service import _call_with_retry
+
+logger = logging.getLogger(__name__)
+
+# Размер части multipart upload: это же граница памяти писателя.
+# S3 допускает не более 10000 частей, 64 МБ дают архивы до ~640 ГБ
+MULTIPART_PART_SIZE = int(os.getenv("BACKUP_MULTIPART_PART_SIZE", str(64 * 1024 * 1024)))
+MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
+# Состояние незавершенных загрузок (ключ, UploadId) хранится отдельно от backups/, чтобы не попадать в список бэкапов
+MULTIPART_STATE_PREFIX = "backup_uploads/"
+
+
+class MultipartUploadError(Exception):
+    """Сбой отправки части: поток архива прерван, продолжать запись нельзя."""
+
+
+class S3MultipartWriter:
+    """
+    Файлоподобный объект только для записи: данные копятся до размера части
+    и отправляются через UploadPart, так что в памяти не больше одной части.
+
+    При возобновлении (upload_id уже есть) части с тем же номером, размером и MD5,
+    что уже загружены, повторно не отправляются: детерминированный поток байтов
+    докачивается с первой отличающейся части.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        upload_id: Optional[str] = None,
+        part_size: int = MULTIPART_PART_SIZE,
+        content_type: str = "application/octet-stream",
+        on_part: Optional[Callable[[int, int], None]] = None,
+    ):
+        self.key = key
+        self.part_size = max(part_size, MULTIPART_MIN_PART_SIZE)
+        self.on_part = on_part
+        self.parts: List[Dict[str, Any]] = []
+        self.bytes_written = 0
+        self.bytes_uploaded = 0
+        self.parts_reused = 0
+        self._buffer = bytearray()
+        self._closed = False
+        self._existing_parts: Dict[int, Dict[str, Any]] = {}
+        if upload_id:
+            self.upload_id = upload_id
+            self._existing_parts = self._list_uploaded_parts()
+        else:
+            self.upload_id = s3_client.create_multipart_upload(
+                Bucket=settings.AWS_S3_BUCKET_NAME, Key=key, ContentType=content_type
+            )["UploadId"]
+
+    def _list_uploaded_parts(self) -> Dict[int, Dict[str, Any]]:
+        parts = {}
+        paginator = s3_client.get_paginator("list_parts")
+        for page in paginator.paginate(Bucket=settings.AWS_S3_BUCKET_NAME, Key=self.key, UploadId=self.upload_id):
+            for part in page.get("Parts", []):
+                parts[part["PartNumber"]] = part
+        return parts
+
+    def write(self, data) -> int:
+        if self._closed:
+            raise ValueError("write to closed S3MultipartWriter")
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            chunk = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._upload_part(chunk)
+        return len(data)
+
+    def flush(self) -> None:
+        # Части меньше минимального размера S3 отправляются только при close()
+        pass
+
+    def _upload_part(self, chunk: bytes) -> None:
+        part_number = len(self.parts) + 1
+        etag = f'"{hashlib.md5(chunk).hexdigest()}"'
+        existing = self._existing_parts.get(part_number)
+        if existing and existing["Size"] == len(chunk) and existing["ETag"] == etag:
+            self.parts_reused += 1
+        else:
+            def upload():
+                nonlocal etag
+                response = s3_client.upload_part(
+                    Bucket=settings.AWS_S3_BUCKET_NAME,
+                    Key=self.key,
+                    UploadId=self.upload_id,
+                    PartNumber=part_number,
+                    Body=chunk,
+                )
+                etag = response["ETag"]
+
+            try:
+                _call_with_retry(upload, f"{self.key} part {part_number}")
+            except (ClientError, BotoCoreError, OSError) as e:
+                raise MultipartUploadError(f"Failed to upload part {part_number} of {self.key}: {e}") from e
+            self.bytes_uploaded += len(chunk)
+        self.parts.append({"PartNumber": part_number, "ETag": etag})
+        if self.on_part:
+            self.on_part(part_number, self.bytes_written)
+
+    def close(self) -> None:
+        """Отправляет последнюю часть и завершает загрузку: объект появляется в S3 только целиком."""
+        if self._closed:
+            return
+        if self._buffer or not self.parts:
+            chunk = bytes(self._buffer)
+            self._buffer.clear()
+            self._upload_part(chunk)
+        try:
+            s3_client.complete_multipart_upload(
+                Bucket=settings.AWS_S3_BUCKET_NAME,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={"Parts": self.parts},
+            )
+        except (ClientError, BotoCoreError) as e:
+            raise MultipartUploadError(f"Failed to complete multipart upload of {self.key}: {e}") from e
+        self._closed = True
+
+    def abort(self) -> None:
+        self._closed = True
+        try:
+            s3_client.abort_multipart_upload(Bucket=settings.AWS_S3_BUCKET_NAME, Key=self.key, UploadId=self.upload_id)
+        except ClientError as e:
+            logger.warning(f"Failed to abort multipart upload {self.upload_id} for {self.key}: {e}")
+
+
+def _state_key(name: str) -> str:
+    return f"{MULTIPART_STATE_PREFIX}{name}.json"
+
+
+def load_multipart_state(name: str) -> Optional[Dict[str, Any]]:
+    """Состояние незавершенной загрузки (например, по id задачи Celery) или None."""
+    try:
+        response = s3_client.get_object(Bucket=settings.AWS_S3_BUCKET_NAME, Key=_state_key(name))
+        return json.loads(response["Body"].read())
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+
+
+def save_multipart_state(name: str, state: Dict[str, Any]) -> None:
+    s3_client.put_object(
+        Bucket=settings.AWS_S3_BUCKET_NAME,
+        Key=_state_key(name),
+        Body=json.dumps(state).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def delete_multipart_state(name: str) -> None:
+    s3_client.delete_object(Bucket=settings.AWS_S3_BUCKET_NAME, Key=_state_key(name))
+
+
+def abort_multipart_state(name: str) -> None:
+    """Отменяет незавершенную загрузку по сохраненному состоянию и удаляет состояние."""
+    state = load_multipart_state(name)
+    if not state:
+        return
+    if state.get("upload_id"):
+        try:
+            s3_client.abort_multipart_upload(
+                Bucket=settings.AWS_S3_BUCKET_NAME, Key=state["s3_key"], UploadId=state["upload_id"]
+            )
+        except ClientError as e:
+            logger.warning(f"Failed to abort multipart upload {state['upload_id']}: {e}")
+    delete_multipart_state(name)
@@ -0,0 +1,41 @@
+import itertools
+import concurrent.futures
+from collections import deque
+from typing import Callable, Deque, Iterable, Iterator, Tuple, TypeVar, Union
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_END = object()
+
+
+def ordered_prefetch(
+    items: Iterable[T],
+    fetch: Callable[[T], R],
+    workers: int,
+    window: int,
+) -> Iterator[Tuple[T, Union[R, Exception]]]:
+    """
+    Выполняет fetch для элементов в пуле потоков, опережая потребителя не более чем
+    на window элементов, и отдает результаты строго в исходном порядке.
+    Исключение fetch возвращается вместо результата, чтобы потребитель решил, пропускать ли элемент.
+    """
+    iterator = iter(items)
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers))
+    pending: Deque[Tuple[T, concurrent.futures.Future]] = deque()
+    try:
+        for item in itertools.islice(iterator, max(1, window)):
+            pending.append((item, pool.submit(fetch, item)))
+        while pending:
+            item, future = pending.popleft()
+            next_item = next(iterator, _END)
+            if next_item is not _END:
+                pending.append((next_item, pool.submit(fetch, next_item)))
+            try:
+                result = future.result()
+            except Exception as e:
+                result = e
+            yield item, result
+    finally:
+        # Потребитель прервал обход: не ждем опережающих загрузок
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -114,8 +114,11 @@ def upload_file_to_s3_bytes(content: bytes, key: str, content_type: str):
     )
 
 
-def create_thumbnail_from_s3(s3_key: str, content_type: str) -> str:
-    """Создает превью, скачивая файл по частям"""
+def create_thumbnail_from_s3(s3_key: str, content_type: str, thumbnail_name: str = None) -> str:
+    """
+    Создает превью, скачивая файл по частям.
+    thumbnail_name задает имя миниатюры, если ключ оригинала общий (blobs/<sha256>).
+    """
     from app.main import logger
     
     try:
@@ -127,9 +130,9 @@ def create_thumbnail_from_s3(s3_key: str, content_type: str) -> str:
         # Создаем превью из временного файла
         thumbnail_key = None
         if content_type.startswith("image/"):
-            thumbnail_key = create_image_thumbnail_from_file(temp_file_path, s3_key)
+            thumbnail_key = create_image_thumbnail_from_file(temp_file_path, thumbnail_name or s3_key)
         elif content_type.startswith("video/"):
-            thumbnail_key = create_video_thumbnail_from_file(temp_file_path, s3_key)
+            thumbnail_key = create_video_thumbnail_from_file(temp_file_path, thumbnail_name or s3_key)
         
         # Удаляем временный файл
         os.unlink(temp_file_path)
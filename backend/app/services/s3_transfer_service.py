@@ -0,0 +1,227 @@
+import os
+import time
+import logging
+import concurrent.futures
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import BotoCoreError, ClientError
+
+from app.core.config import settings
+from app.core.database import s3_client
+
+# --- Параметры параллельной загрузки ---
+UPLOAD_MAX_WORKERS = int(os.getenv("S3_UPLOAD_MAX_WORKERS", "8"))
+UPLOAD_MAX_RETRIES = int(os.getenv("S3_UPLOAD_MAX_RETRIES", "3"))
+UPLOAD_RETRY_BACKOFF = float(os.getenv("S3_UPLOAD_RETRY_BACKOFF", "0.5"))  # секунды, удваивается на каждой попытке
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("S3_DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Серверное копирование: до 5 ГБ один CopyObject, крупнее — multipart с UploadPartCopy
+COPY_OBJECT_MAX_SIZE = 5 * 1024 * 1024 * 1024
+COPY_PART_SIZE = int(os.getenv("S3_COPY_PART_SIZE", str(512 * 1024 * 1024)))
+
+# Multipart для крупных объектов (например, fMP4 init/segments или оригиналы при восстановлении)
+transfer_config = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=MULTIPART_CHUNKSIZE,
+    max_concurrency=4,
+    use_threads=True,
+)
+
+CONTENT_TYPES = {
+    ".ts": "video/mp2t",
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+    ".mpd": "application/dash+xml",
+    ".jpg": "image/jpeg",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def get_content_type(key: str) -> str:
+    """Определяет Content-Type объекта по расширению."""
+    _, ext = os.path.splitext(key)
+    return CONTENT_TYPES.get(ext.lower(), "application/octet-stream")
+
+
+def _call_with_retry(func, s3_key: str) -> None:
+    """Выполняет операцию с S3 с повторами и экспоненциальной задержкой."""
+    attempt = 0
+    while True:
+        try:
+            func()
+            return
+        except (ClientError, BotoCoreError, OSError) as e:
+            attempt += 1
+            if attempt > UPLOAD_MAX_RETRIES:
+                logger.error(f"Upload of {s3_key} failed after {attempt} attempts: {e}")
+                raise
+            delay = UPLOAD_RETRY_BACKOFF * (2 ** (attempt - 1))
+            logger.warning(f"Upload of {s3_key} failed (attempt {attempt}), retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+
+
+def upload_file_with_retry(local_path: str, s3_key: str, content_type: Optional[str] = None) -> None:
+    """Загружает файл в S3 с повторами и экспоненциальной задержкой."""
+    extra_args = {"ContentType": content_type or get_content_type(s3_key)}
+    _call_with_retry(
+        lambda: s3_client.upload_file(
+            local_path,
+            settings.AWS_S3_BUCKET_NAME,
+            s3_key,
+            ExtraArgs=extra_args,
+            Config=transfer_config,
+        ),
+        s3_key,
+    )
+
+
+def upload_bytes_with_retry(content: bytes, s3_key: str, content_type: Optional[str] = None) -> None:
+    """Загружает байты в S3 с повторами (для небольших объектов вроде плейлистов)."""
+    _call_with_retry(
+        lambda: s3_client.put_object(
+            Bucket=settings.AWS_S3_BUCKET_NAME,
+            Key=s3_key,
+            Body=content,
+            ContentType=content_type or get_content_type(s3_key),
+        ),
+        s3_key,
+    )
+
+
+def upload_stream_with_retry(
+    open_stream: Callable[[], BinaryIO], s3_key: str, content_type: Optional[str] = None
+) -> None:
+    """
+    Загружает поток в S3 без чтения целиком: крупные объекты уходят multipart частями MULTIPART_CHUNKSIZE.
+    open_stream открывает поток заново на каждую попытку (например, запись ZIP-архива).
+    """
+    extra_args = {"ContentType": content_type or get_content_type(s3_key)}
+
+    def upload():
+        with open_stream() as stream:
+            s3_client.upload_fileobj(
+                stream,
+                settings.AWS_S3_BUCKET_NAME,
+                s3_key,
+                ExtraArgs=extra_args,
+                Config=transfer_config,
+            )
+
+    _call_with_retry(upload, s3_key)
+
+
+def iter_s3_object(s3_key: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Читает объект S3 фиксированными кусками (память не зависит от размера объекта).
+    Обрыв чтения продолжается Range-запросом с текущего смещения.
+    """
+    offset = 0
+    attempt = 0
+    while True:
+        params = {"Bucket": settings.AWS_S3_BUCKET_NAME, "Key": s3_key}
+        if offset:
+            params["Range"] = f"bytes={offset}-"
+        try:
+            body = s3_client.get_object(**params)["Body"]
+            for chunk in body.iter_chunks(chunk_size):
+                offset += len(chunk)
+                yield chunk
+            return
+        except ClientError as e:
+            # Отсутствующий объект и запреты доступа не повторяем
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404", "AccessDenied", "InvalidRange"):
+                raise
+            error = e
+        except (BotoCoreError, OSError) as e:
+            error = e
+        attempt += 1
+        if attempt > UPLOAD_MAX_RETRIES:
+            logger.error(f"Download of {s3_key} failed at offset {offset} after {attempt} attempts: {error}")
+            raise error
+        delay = UPLOAD_RETRY_BACKOFF * (2 ** (attempt - 1))
+        logger.warning(f"Download of {s3_key} interrupted at offset {offset}, retrying in {delay:.1f}s: {error}")
+        time.sleep(delay)
+
+
+def copy_object_server_side(source_key: str, dest_key: str, size: Optional[int] = None) -> int:
+    """
+    Копирует объект внутри бакета на стороне S3: байты не проходят через процесс.
+    Возвращает размер объекта.
+    """
+    bucket = settings.AWS_S3_BUCKET_NAME
+    copy_source = {"Bucket": bucket, "Key": source_key}
+    if size is None:
+        size = s3_client.head_object(Bucket=bucket, Key=source_key)["ContentLength"]
+    if size <= COPY_OBJECT_MAX_SIZE:
+        _call_with_retry(lambda: s3_client.copy_object(Bucket=bucket, Key=dest_key, CopySource=copy_source), dest_key)
+        return size
+
+    head = s3_client.head_object(Bucket=bucket, Key=source_key)
+    upload_id = s3_client.create_multipart_upload(
+        Bucket=bucket, Key=dest_key, ContentType=head.get("ContentType", "application/octet-stream")
+    )["UploadId"]
+    try:
+        parts = []
+        for part_number, offset in enumerate(range(0, size, COPY_PART_SIZE), start=1):
+            last_byte = min(offset + COPY_PART_SIZE, size) - 1
+            response = {}
+            _call_with_retry(
+                lambda: response.update(
+                    s3_client.upload_part_copy(
+                        Bucket=bucket,
+                        Key=dest_key,
+                        UploadId=upload_id,
+                        PartNumber=part_number,
+                        CopySource=copy_source,
+                        CopySourceRange=f"bytes={offset}-{last_byte}",
+                    )
+                ),
+                f"{dest_key} part {part_number}",
+            )
+            parts.append({"PartNumber": part_number, "ETag": response["CopyPartResult"]["ETag"]})
+        s3_client.complete_multipart_upload(
+            Bucket=bucket, Key=dest_key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+    except Exception:
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=dest_key, UploadId=upload_id)
+        raise
+    return size
+
+
+def delete_prefix(prefix: str) -> int:
+    """Удаляет все объекты с префиксом пакетами по 1000 ключей. Возвращает количество удаленных."""
+    paginator = s3_client.get_paginator("list_objects_v2")
+    deleted = 0
+    for page in paginator.paginate(Bucket=settings.AWS_S3_BUCKET_NAME, Prefix=prefix):
+        keys = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+        if keys:
+            s3_client.delete_objects(Bucket=settings.AWS_S3_BUCKET_NAME, Delete={"Objects": keys})
+            deleted += len(keys)
+    return deleted
+
+
+def upload_files_concurrently(items: List[Tuple[str, str]], max_workers: int = UPLOAD_MAX_WORKERS) -> Dict[str, Exception]:
+    """
+    Загружает список (local_path, s3_key) через ограниченный пул потоков.
+    Возвращает словарь s3_key -> исключение для неудавшихся загрузок.
+    """
+    errors: Dict[str, Exception] = {}
+    if not items:
+        return errors
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {
+            pool.submit(upload_file_with_retry, local_path, s3_key): s3_key
+            for local_path, s3_key in items
+        }
+        for future in concurrent.futures.as_completed(futures):
+            s3_key = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                errors[s3_key] = e
+    return errors
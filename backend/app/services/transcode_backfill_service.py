@@ -0,0 +1,174 @@
+import os
+import logging
+from typing import Any, Dict, List
+
+from fastapi import HTTPException
+
+from app.celery_app import QUEUE_TRANSCODE_NEW, QUEUE_TRANSCODE_REENCODE
+from app.models.base import TranscodeBackfill, User
+from app.repositories.transcode_backfill_repository import (
+    advance_backfill,
+    claim_backfill_files,
+    count_backfill_candidates,
+    create_backfill,
+    get_backfill,
+    list_backfills,
+    resume_backfill,
+    select_backfill_batch,
+    set_backfill_status,
+)
+from app.schemas.file_schemas import TranscodeBackfillCreate, TranscodeBackfillResponse
+from app.services.queue_service import get_queue_depth
+from app.services.transcode_scheduler import QUEUE_NEW_UPLOAD, QUEUE_REENCODE
+
+logger = logging.getLogger(__name__)
+
+# Порция ставится раз в интервал; ее размер — rate_per_minute, пересчитанный на интервал
+BACKFILL_BATCH_INTERVAL_SECONDS = int(os.getenv("BACKFILL_BATCH_INTERVAL_SECONDS", "60"))
+BACKFILL_MAX_RATE_PER_MINUTE = int(os.getenv("BACKFILL_MAX_RATE_PER_MINUTE", "1000"))
+CELERY_QUEUE_BY_PROFILE = {QUEUE_REENCODE: QUEUE_TRANSCODE_REENCODE, QUEUE_NEW_UPLOAD: QUEUE_TRANSCODE_NEW}
+
+
+def _to_response(backfill: TranscodeBackfill) -> TranscodeBackfillResponse:
+    return TranscodeBackfillResponse(
+        id=backfill.id,
+        status=backfill.status,
+        filters=backfill.filters,
+        rate_per_minute=backfill.rate_per_minute,
+        max_queue_depth=backfill.max_queue_depth,
+        total=backfill.total,
+        enqueued=backfill.enqueued,
+        skipped=backfill.skipped,
+        completed=backfill.completed,
+        failed=backfill.failed,
+        in_flight=max(0, backfill.enqueued - backfill.completed - backfill.failed),
+        created_at=backfill.created_at,
+        updated_at=backfill.updated_at,
+    )
+
+
+def _build_filters(request: TranscodeBackfillCreate) -> Dict[str, Any]:
+    from app.services.transcode_service import transcode_ladder_version
+
+    return {
+        "statuses": request.statuses,
+        "mime_types": request.mime_types,
+        "created_from": request.created_from.isoformat() if request.created_from else None,
+        "created_to": request.created_to.isoformat() if request.created_to else None,
+        "min_duration": request.min_duration,
+        "max_duration": request.max_duration,
+        # Лестница фиксируется при запуске: повторный запуск пропустит уже перекодированные файлы
+        "ladder": transcode_ladder_version() if request.outdated_ladder else None,
+        "queue": request.queue,
+    }
+
+
+def _batch_size(rate_per_minute: int) -> int:
+    """Файлов в порции, чтобы за минуту ставилось rate_per_minute."""
+    return max(1, round(rate_per_minute * BACKFILL_BATCH_INTERVAL_SECONDS / 60))
+
+
+def _schedule_next_batch(
+    backfill_id: str, generation: int, countdown: int = BACKFILL_BATCH_INTERVAL_SECONDS
+) -> None:
+    from app.tasks.transcode_tasks import transcode_backfill_batch_task
+
+    transcode_backfill_batch_task.apply_async(args=[backfill_id, generation], countdown=countdown)
+
+
+def create_backfill_service(request: TranscodeBackfillCreate, user: User) -> TranscodeBackfillResponse:
+    """Создает пакетный запуск перетранскодирования (или только считает кандидатов при dry_run)."""
+    if request.queue not in CELERY_QUEUE_BY_PROFILE:
+        raise HTTPException(status_code=400, detail=f"Unknown queue: {request.queue}")
+    if not 1 <= request.rate_per_minute <= BACKFILL_MAX_RATE_PER_MINUTE:
+        raise HTTPException(
+            status_code=400, detail=f"rate_per_minute must be between 1 and {BACKFILL_MAX_RATE_PER_MINUTE}"
+        )
+    if request.max_queue_depth < 1:
+        raise HTTPException(status_code=400, detail="max_queue_depth must be positive")
+
+    filters = _build_filters(request)
+    total = count_backfill_candidates(filters)
+    if request.dry_run:
+        return TranscodeBackfillResponse(
+            status="dry_run",
+            filters=filters,
+            rate_per_minute=request.rate_per_minute,
+            max_queue_depth=request.max_queue_depth,
+            total=total,
+        )
+
+    backfill = create_backfill(filters, request.rate_per_minute, request.max_queue_depth, total, user.id)
+    logger.info(f"Transcode backfill {backfill.id} created by {user.id}: {total} candidate files")
+    _schedule_next_batch(str(backfill.id), backfill.generation, countdown=0)
+    return _to_response(backfill)
+
+
+def run_backfill_batch(backfill_id: str, generation: int = 0) -> Dict[str, Any]:
+    """
+    Ставит в очередь очередную порцию файлов и планирует следующую.
+    Если очередь транскодирования глубже max_queue_depth, порция откладывается.
+    Задача устаревшего поколения (запланированная до паузы и возобновления) цепочку не продолжает.
+    """
+    from app.services.transcode_service import start_transcoding
+
+    backfill = get_backfill(backfill_id)
+    if not backfill or backfill.status != "running":
+        return {"backfill_id": backfill_id, "status": backfill.status if backfill else None}
+    if backfill.generation != generation:
+        return {"backfill_id": backfill_id, "status": "superseded"}
+
+    profile_queue = backfill.filters.get("queue") or QUEUE_REENCODE
+    depth = get_queue_depth(CELERY_QUEUE_BY_PROFILE[profile_queue])
+    if depth is None or depth >= backfill.max_queue_depth:
+        logger.info(f"Transcode backfill {backfill_id} throttled (queue depth: {depth})")
+        _schedule_next_batch(backfill_id, generation)
+        return {"backfill_id": backfill_id, "status": "throttled", "queue_depth": depth}
+
+    batch_size = _batch_size(backfill.rate_per_minute)
+    batch = select_backfill_batch(backfill.filters, backfill.cursor, batch_size)
+    claimed = claim_backfill_files(batch, backfill.id) if batch else []
+    for file_id in claimed:
+        start_transcoding(str(file_id), profile_queue, backfill_id=str(backfill.id))
+
+    finished = len(batch) < batch_size
+    advanced = advance_backfill(
+        backfill.id, generation, batch[-1] if batch else backfill.cursor, len(claimed), len(batch) - len(claimed), finished
+    )
+    if not advanced:
+        # Пока порция ставилась, запуск возобновили новой цепочкой — курсор ведет она
+        return {"backfill_id": backfill_id, "status": "superseded", "enqueued": len(claimed)}
+    if not finished:
+        _schedule_next_batch(backfill_id, generation)
+    logger.info(
+        f"Transcode backfill {backfill_id}: enqueued {len(claimed)}, skipped {len(batch) - len(claimed)}"
+        f"{' (finished)' if finished else ''}"
+    )
+    return {"backfill_id": backfill_id, "status": "completed" if finished else "running", "enqueued": len(claimed)}
+
+
+def get_backfill_service(backfill_id: str) -> TranscodeBackfillResponse:
+    backfill = get_backfill(backfill_id)
+    if not backfill:
+        raise HTTPException(status_code=404, detail="Backfill not found")
+    return _to_response(backfill)
+
+
+def list_backfills_service(limit: int) -> List[TranscodeBackfillResponse]:
+    return [_to_response(backfill) for backfill in list_backfills(limit)]
+
+
+def pause_backfill_service(backfill_id: str) -> TranscodeBackfillResponse:
+    """Останавливает постановку новых порций; уже поставленные задания доработают."""
+    if not set_backfill_status(backfill_id, "paused", from_status="running"):
+        raise HTTPException(status_code=409, detail="Backfill is not running")
+    return get_backfill_service(backfill_id)
+
+
+def resume_backfill_service(backfill_id: str) -> TranscodeBackfillResponse:
+    """Продолжает запуск с сохраненного курсора новой цепочкой порций (прежняя отбрасывается)."""
+    generation = resume_backfill(backfill_id)
+    if generation is None:
+        raise HTTPException(status_code=409, detail="Backfill is not paused")
+    _schedule_next_batch(backfill_id, generation, countdown=0)
+    return get_backfill_service(backfill_id)
@@ -0,0 +1,141 @@
+import os
+import logging
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# --- Очереди транскодирования ---
+QUEUE_NEW_UPLOAD = "new_upload"  # Новые загрузки: как можно быстрее получить воспроизводимый HLS
+QUEUE_REENCODE = "reencode"  # Перекодирование библиотеки (например, ночью): качество важнее скорости
+
+# Профили кодирования по очередям; переопределяются переменными
+# TRANSCODE_<QUEUE>_PRESET и TRANSCODE_<QUEUE>_CRF
+DEFAULT_PROFILES: Dict[str, Dict[str, Any]] = {
+    QUEUE_NEW_UPLOAD: {"preset": "ultrafast", "crf": 28},
+    QUEUE_REENCODE: {"preset": "slow", "crf": 21},
+}
+
+# Оценки бюджета на одно задание
+DEFAULT_THREADS_PER_JOB = 4  # x264 масштабируется сублинейно: несколько заданий по 4 потока эффективнее одного на все ядра
+JOB_MEMORY_MB = int(os.getenv("TRANSCODE_JOB_MEMORY_MB", "1024"))
+
+
+class TranscodePlan(BaseModel):
+    cpu_count: int
+    memory_mb: Optional[int]
+    max_jobs: int
+    threads_per_job: int
+
+
+def _read_first_line(path: str) -> Optional[str]:
+    try:
+        with open(path, "r") as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def detect_cpu_count() -> int:
+    """Доступные ядра с учетом affinity и квоты cgroup (контейнеры)."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count() or 1
+
+    # cgroup v2: "quota period" или "max period"
+    cpu_max = _read_first_line("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            try:
+                cpus = min(cpus, max(1, int(int(quota) / int(period))))
+            except ValueError:
+                pass
+    else:
+        # cgroup v1
+        quota = _read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+        period = _read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        try:
+            if quota and period and int(quota) > 0:
+                cpus = min(cpus, max(1, int(int(quota) / int(period))))
+        except ValueError:
+            pass
+    return max(1, cpus)
+
+
+def detect_memory_mb() -> Optional[int]:
+    """Доступная память: лимит cgroup, иначе MemTotal из /proc/meminfo."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        value = _read_first_line(path)
+        if value and value != "max":
+            try:
+                limit = int(value)
+                # v1 без лимита возвращает огромное число
+                if limit < 1 << 60:
+                    return limit // (1024 * 1024)
+            except ValueError:
+                pass
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def build_plan(
+    cpu_count: Optional[int] = None,
+    memory_mb: Optional[int] = None,
+    max_jobs: Optional[int] = None,
+    threads_per_job: Optional[int] = None,
+) -> TranscodePlan:
+    """
+    Рассчитывает число параллельных заданий и потоков ffmpeg на задание.
+    Явные значения (аргументы или TRANSCODE_MAX_JOBS / TRANSCODE_THREADS_PER_JOB) имеют приоритет.
+    """
+    cpu_count = cpu_count or detect_cpu_count()
+    if memory_mb is None:
+        memory_mb = detect_memory_mb()
+
+    threads_per_job = threads_per_job or int(os.getenv("TRANSCODE_THREADS_PER_JOB", "0")) or min(
+        DEFAULT_THREADS_PER_JOB, cpu_count
+    )
+    max_jobs = max_jobs or int(os.getenv("TRANSCODE_MAX_JOBS", "0"))
+    if not max_jobs:
+        max_jobs = max(1, cpu_count // threads_per_job)
+        if memory_mb:
+            max_jobs = max(1, min(max_jobs, memory_mb // JOB_MEMORY_MB))
+
+    return TranscodePlan(
+        cpu_count=cpu_count,
+        memory_mb=memory_mb,
+        max_jobs=max_jobs,
+        threads_per_job=threads_per_job,
+    )
+
+
+def get_profile(queue: str) -> Dict[str, Any]:
+    """Профиль кодирования (preset, crf) для очереди с учетом переменных окружения."""
+    profile = dict(DEFAULT_PROFILES.get(queue, DEFAULT_PROFILES[QUEUE_NEW_UPLOAD]))
+    prefix = f"TRANSCODE_{queue.upper()}"
+    preset = os.getenv(f"{prefix}_PRESET")
+    crf = os.getenv(f"{prefix}_CRF")
+    if preset:
+        profile["preset"] = preset
+    if crf:
+        try:
+            profile["crf"] = int(crf)
+        except ValueError:
+            logger.warning(f"Invalid {prefix}_CRF value: {crf}")
+    return profile
+
+
+TRANSCODE_PLAN = build_plan()
+logger.info(
+    f"Transcode plan: {TRANSCODE_PLAN.max_jobs} jobs x {TRANSCODE_PLAN.threads_per_job} threads "
+    f"(cpus={TRANSCODE_PLAN.cpu_count}, memory_mb={TRANSCODE_PLAN.memory_mb})"
+)
@@ -1,28 +1,79 @@
 import os
+import json
+import time
 import uuid
+import hashlib
 import shutil
+import signal
 import logging
+import functools
+import resource
+import threading
+import subprocess
 import concurrent.futures
-from typing import List, Dict, Any, Optional
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple
 
 import ffmpeg
 
 from app.core.config import settings
 from app.models.base import File
 from app.core.database import get_db_session, s3_client
+from app.services.ffmpeg_progress import PROGRESS_ARGS, FfmpegProgress, start_progress_reader, summarize_progress
+from app.services.hls_publisher import HlsProgressivePublisher
+from app.services.playback_service import PLAYBACK_SESSION_TTL_SECONDS
+from app.repositories.transcoded_asset_repository import remove_transcoded_asset_reference, switch_transcoded_output
+from app.services.s3_transfer_service import upload_file_with_retry, upload_files_concurrently
+from app.services.transcoded_storage import delete_transcoded_output, new_transcode_base, transcoded_base_path
+from app.services.transcode_scheduler import QUEUE_NEW_UPLOAD, QUEUE_REENCODE, TRANSCODE_PLAN, get_profile
 
-# --- Настройки пула потоков и ресурсов ---
-MAX_WORKERS = 1
-FFMPEG_THREADS = 1
+# --- Запуск заданий ---
+# celery — очереди Celery с приоритетами (транскодирование не делит процесс с API);
+# thread — пул потоков процесса API
+TRANSCODE_DISPATCH = os.getenv("TRANSCODE_DISPATCH", "celery")
+# --- Настройки пула потоков и ресурсов (рассчитываются по ядрам и памяти хоста) ---
+MAX_WORKERS = TRANSCODE_PLAN.max_jobs
+FFMPEG_THREADS = TRANSCODE_PLAN.threads_per_job
 FFMPEG_NICE = 19
-FFMPEG_PRESET = "ultrafast"
-# --- Таймауты ---
-BASE_TIMEOUT = 10800
+# --- Таймауты (на всё задание: все попытки и повтор с локальной копией входа) ---
+BASE_TIMEOUT = 3600
 TIMEOUT_PER_GB = 3600
 MAX_TIMEOUT = 10800
+FFMPEG_STALL_TIMEOUT = 600  # секунды без прогресса, после которых ffmpeg считается зависшим
+FFMPEG_KILL_GRACE = 10  # секунды между SIGTERM и SIGKILL
+# --- Ограничения ресурсов ffmpeg ---
+FFMPEG_MEMORY_LIMIT_MB = int(os.getenv("FFMPEG_MEMORY_LIMIT_MB", "0"))  # 0 — без ограничения (RLIMIT_AS)
+SAFE_PROFILE_RETRY = True  # Повтор упавшего/зависшего задания с «безопасным» профилем
 SEGMENT_DURATION = 10  # Увеличено для скорости
 # --- Оптимизации ---
 USE_COPY_CODEC = True  # Попытка копирования без перекодирования
+# --- Формат выходных сегментов ---
+# ts — MPEG-TS HLS (с прогрессивной публикацией); cmaf — fMP4-сегменты, записанные один раз
+# и общие для master.m3u8 (HLS) и manifest.mpd (DASH)
+TRANSCODE_OUTPUT_FORMAT = os.getenv("TRANSCODE_OUTPUT_FORMAT", "ts")
+# --- Прогрессивная публикация HLS ---
+PROGRESSIVE_HLS = True  # Публиковать сегменты по мере готовности (плейлист EVENT -> VOD)
+PROGRESSIVE_POLL_INTERVAL = 2  # секунды между проверками выходной директории
+PROGRESS_UPDATE_INTERVAL = 5  # секунды между записями прогресса в БД
+# Прежний результат удаляется не сразу после переключения файла: выданные на него токены
+# воспроизведения и presigned-ссылки действуют до PLAYBACK_SESSION_TTL_SECONDS
+PREVIOUS_OUTPUT_RETENTION_SECONDS = int(
+    os.getenv("PREVIOUS_OUTPUT_RETENTION_SECONDS", str(PLAYBACK_SESSION_TTL_SECONDS))
+)
+# --- Источник входного файла ---
+TRANSCODE_INPUT_MODE = os.getenv("TRANSCODE_INPUT_MODE", "stream")  # stream — чтение из S3 по presigned URL, download — полная загрузка
+# Контейнеры, которые ffmpeg эффективно читает по HTTP с range-запросами (format_name из ffprobe);
+# остальные (avi, asf и т.п.) скачиваются целиком
+STREAMABLE_FORMATS = {"mov", "mp4", "m4a", "3gp", "3g2", "mj2", "matroska", "webm", "mpegts", "flv"}
+PRESIGNED_URL_MARGIN = 3600  # запас срока действия ссылки сверх таймаута задания, секунды
+HTTP_INPUT_OPTIONS = {
+    "seekable": 1,  # S3 поддерживает Range — переходы к moov/индексу без чтения всего файла
+    "multiple_requests": 1,  # keep-alive между range-запросами
+    "reconnect": 1,
+    "reconnect_streamed": 1,
+    "reconnect_delay_max": 10,
+    "rw_timeout": 60_000_000,  # микросекунды
+}
 
 # Создаем пул потоков на уровне модуля
 executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS)
@@ -30,26 +81,28 @@ executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS)
 # Настройка логгирования
 logger = logging.getLogger(__name__)
 
-def _get_file_size_mb(file_path: str) -> float:
-    """Получает размер файла в мегабайтах."""
-    try:
-        size_bytes = os.path.getsize(file_path)
-        return size_bytes / (1024 * 1024)
-    except OSError as e:
-        logger.warning(f"Could not get file size for {file_path}: {e}")
-        return 0.0
-
-def _calculate_timeout(file_path: str) -> int:
-    """Рассчитывает таймаут на основе размера файла."""
-    file_size_mb = _get_file_size_mb(file_path)
-    file_size_gb = file_size_mb / 1024
+def _calculate_timeout(size_bytes: Optional[int]) -> int:
+    """Рассчитывает таймаут на основе размера файла (из метаданных, без локальной копии)."""
+    file_size_gb = (size_bytes or 0) / (1024 * 1024 * 1024)
     timeout = BASE_TIMEOUT + int(file_size_gb * TIMEOUT_PER_GB)
     return max(BASE_TIMEOUT, min(timeout, MAX_TIMEOUT))
 
+def _is_remote_input(input_path: str) -> bool:
+    return input_path.startswith(("http://", "https://"))
+
+def _input_options(input_path: str) -> Dict[str, Any]:
+    """Опции чтения входа: для HTTP — range-запросы и переподключение."""
+    return dict(HTTP_INPUT_OPTIONS) if _is_remote_input(input_path) else {}
+
+@functools.lru_cache(maxsize=16)
+def _probe(input_path: str) -> Dict[str, Any]:
+    """ffprobe с кэшем: при чтении по URL каждая проба — это HTTP-запросы к S3."""
+    return ffmpeg.probe(input_path, **_input_options(input_path))
+
 def _probe_audio_streams(file_path: str) -> bool:
     """Проверяет наличие аудио потоков в файле."""
     try:
-        probe = ffmpeg.probe(file_path)
+        probe = _probe(file_path)
         audio_streams = [stream for stream in probe['streams'] if stream['codec_type'] == 'audio']
         return len(audio_streams) > 0
     except Exception as e:
@@ -59,7 +112,7 @@ def _probe_audio_streams(file_path: str) -> bool:
 def _can_copy_codec(input_path: str) -> tuple[bool, str, str, float]:
     """Проверяет, можно ли использовать copy codec"""
     try:
-        probe = ffmpeg.probe(input_path)
+        probe = _probe(input_path)
         video_stream = next((s for s in probe['streams'] if s['codec_type'] == 'video'), None)
         audio_stream = next((s for s in probe['streams'] if s['codec_type'] == 'audio'), None)
         
@@ -75,7 +128,7 @@ def _can_copy_codec(input_path: str) -> tuple[bool, str, str, float]:
         return supported_video and supported_audio, video_codec, audio_codec, duration
     except Exception as e:
         logger.warning(f"Error checking copy codec capability: {e}")
-        return False, '', ''
+        return False, '', '', 0.0
     
 def _extract_video_metadata(file_path: str) -> dict:
     """
@@ -84,7 +137,7 @@ def _extract_video_metadata(file_path: str) -> dict:
     """
     metadata = {}
     try:
-        probe = ffmpeg.probe(file_path)
+        probe = _probe(file_path)
         # Ищем основной видео поток
         video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
         if video_stream:
@@ -114,44 +167,78 @@ def _get_all_renditions() -> List[Dict[str, Any]]:
         {"name": "360p", "height": 360, "video_bitrate": "300k", "audio_bitrate": "48k"}
     ]
 
-def _try_copy_transcode_all(input_path: str, output_dir: str, segment_duration: int, has_audio: bool, renditions: List[Dict[str, Any]]) -> bool:
-    """Попытка транскодирования без перекодирования для всех рендитций"""
+def transcode_ladder_version() -> str:
+    """Отпечаток лестницы рендитций и формата выхода: по нему находятся файлы, транскодированные по старым настройкам."""
+    ladder = {"renditions": _get_all_renditions(), "format": TRANSCODE_OUTPUT_FORMAT, "segment_duration": SEGMENT_DURATION}
+    return hashlib.sha1(json.dumps(ladder, sort_keys=True).encode()).hexdigest()[:12]
+
+def _threads_per_rendition(rendition_count: int) -> int:
+    """Делит бюджет потоков задания между рендитциями (в прогрессивном режиме они кодируются параллельно)."""
+    if PROGRESSIVE_HLS:
+        return max(1, FFMPEG_THREADS // max(1, rendition_count))
+    return FFMPEG_THREADS
+
+def _hls_output_options(progressive: bool) -> Dict[str, Any]:
+    """Дополнительные опции HLS-муксера для прогрессивной публикации."""
+    if not progressive:
+        return {}
+    # EVENT-плейлист дописывается по мере работы; temp_file гарантирует,
+    # что сегменты и плейлист появляются на диске только целиком
+    return {"hls_playlist_type": "event", "hls_flags": "temp_file"}
+
+def _build_copy_hls_commands(
+    input_path: str,
+    output_dir: str,
+    renditions: List[Dict[str, Any]],
+    segment_duration: int,
+    has_audio: bool,
+    hls_options: Optional[Dict[str, Any]] = None
+) -> List[Any]:
+    """Строит команды нарезки на сегменты без перекодирования для всех рендитций"""
+    commands = []
+    hls_options = hls_options or {}
+    threads = _threads_per_rendition(len(renditions))
+
+    for i, rendition in enumerate(renditions):
+        stream_dir = os.path.join(output_dir, f"stream_{i}")
+        os.makedirs(stream_dir, exist_ok=True)
+        playlist_path = os.path.join(stream_dir, 'playlist.m3u8')
+
+        # Для каждого потока создаем отдельный плейлист с тем же видео
+        stream = ffmpeg.input(input_path, **_input_options(input_path))
+        streams = [stream.video, stream.audio] if has_audio else [stream.video]
+        output = ffmpeg.output(
+            *streams,
+            playlist_path,
+            format='hls',
+            hls_time=segment_duration,
+            hls_list_size=0,
+            c='copy',  # Копируем без перекодирования
+            threads=threads,
+            **hls_options
+        )
+        commands.append((output, i, rendition))
+
+    return commands
+
+def _try_copy_transcode_all(
+    input_path: str,
+    output_dir: str,
+    segment_duration: int,
+    has_audio: bool,
+    renditions: List[Dict[str, Any]],
+    deadline: float
+) -> bool:
+    """Попытка транскодирования без перекодирования для всех рендитций (deadline — срок задания, time.monotonic())"""
     try:
-        # Создаем директории для всех рендитций
-        for i, rendition in enumerate(renditions):
-            stream_dir = os.path.join(output_dir, f"stream_{i}")
-            os.makedirs(stream_dir, exist_ok=True)
-        
-        # Копируем исходный файл в каждый поток
-        for i, rendition in enumerate(renditions):
-            stream_dir = os.path.join(output_dir, f"stream_{i}")
-            playlist_path = os.path.join(stream_dir, 'playlist.m3u8')
-            
-            # Для каждого потока создаем отдельный плейлист с тем же видео
-            stream = ffmpeg.input(input_path)
-            
-            if has_audio:
-                output = ffmpeg.output(
-                    stream.video, stream.audio,
-                    playlist_path,
-                    format='hls',
-                    hls_time=segment_duration,
-                    hls_list_size=0,
-                    c='copy',  # Копируем без перекодирования
-                    threads=FFMPEG_THREADS
-                )
-            else:
-                output = ffmpeg.output(
-                    stream.video,
-                    playlist_path,
-                    format='hls',
-                    hls_time=segment_duration,
-                    hls_list_size=0,
-                    c='copy',
-                    threads=FFMPEG_THREADS
-                )
-            
-            ffmpeg.run(output, overwrite_output=True, quiet=True)
+        commands = _build_copy_hls_commands(input_path, output_dir, renditions, segment_duration, has_audio)
+        for output, index, rendition in commands:
+            log_path = os.path.join(os.path.dirname(output_dir), f"ffmpeg_copy_{index}.log")
+            process, progress = _spawn_ffmpeg(output, log_path)
+            reason = _wait_ffmpeg(process, progress, deadline)
+            if reason or process.returncode != 0:
+                logger.warning(f"Copy transcode failed for {rendition['name']} ({reason or 'error'}): {_read_log_tail(log_path)}")
+                return False
             logger.info(f"Copy transcode successful for rendition {rendition['name']}")
         
         return True
@@ -165,18 +252,32 @@ def _build_fast_hls_commands(
     output_dir: str,
     renditions: List[Dict[str, Any]],
     segment_duration: int,
-    has_audio: bool
+    has_audio: bool,
+    hls_options: Optional[Dict[str, Any]] = None,
+    safe: bool = False,
+    profile: Optional[Dict[str, Any]] = None
 ) -> List[Any]:
-    """Строит максимально быстрые команды для всех рендитций"""
+    """
+    Строит максимально быстрые команды для всех рендитций.
+    safe=True — «безопасный» профиль для повторной попытки: терпимость к битым
+    пакетам на входе, принудительный yuv420p и стерео, увеличенная очередь муксера.
+    """
     
     commands = []
+    hls_options = dict(hls_options or {})
+    profile = profile or get_profile(QUEUE_NEW_UPLOAD)
+    threads = profile.get('threads') or _threads_per_rendition(len(renditions))
+    input_options = _input_options(input_path)
+    if safe:
+        input_options.update(fflags="+genpts+discardcorrupt", err_detect="ignore_err")
+        hls_options.update(pix_fmt="yuv420p", max_muxing_queue_size=1024)
     
     for i, rendition in enumerate(renditions):
         stream_dir = os.path.join(output_dir, f"stream_{i}")
         os.makedirs(stream_dir, exist_ok=True)
         
         try:
-            stream = ffmpeg.input(input_path)
+            stream = ffmpeg.input(input_path, **input_options)
             
             # Простое масштабирование без сложных фильтров
             video = stream.video.filter('scale', -2, rendition['height'])
@@ -191,11 +292,12 @@ def _build_fast_hls_commands(
                     hls_list_size=0,
                     video_bitrate=rendition['video_bitrate'],
                     audio_bitrate=rendition['audio_bitrate'],
-                    preset=FFMPEG_PRESET,
-                    threads=FFMPEG_THREADS,
-                    crf=28,  # Более низкое качество для скорости
+                    preset=profile['preset'],
+                    threads=threads,
+                    crf=profile['crf'],
                     maxrate=rendition['video_bitrate'],
-                    bufsize=rendition['video_bitrate']
+                    bufsize=rendition['video_bitrate'],
+                    **(dict(hls_options, ac=2) if safe else hls_options)
                 )
             else:
                 output = ffmpeg.output(
@@ -205,9 +307,10 @@ def _build_fast_hls_commands(
                     hls_time=segment_duration,
                     hls_list_size=0,
                     video_bitrate=rendition['video_bitrate'],
-                    preset=FFMPEG_PRESET,
-                    threads=FFMPEG_THREADS,
-                    crf=28
+                    preset=profile['preset'],
+                    threads=threads,
+                    crf=profile['crf'],
+                    **hls_options
                 )
             
             commands.append((output, i, rendition))
@@ -218,15 +321,212 @@ def _build_fast_hls_commands(
     
     return commands
 
-def _run_ffmpeg_commands_fast(commands: List[tuple], timeout: int) -> bool:
-    """Быстрый запуск ffmpeg команд последовательно"""
+def _build_cmaf_commands(
+    input_path: str,
+    output_dir: str,
+    renditions: List[Dict[str, Any]],
+    segment_duration: int,
+    has_audio: bool,
+    copy: bool = False,
+    safe: bool = False,
+    profile: Optional[Dict[str, Any]] = None
+) -> List[Any]:
+    """
+    Строит одну команду ffmpeg (муксер dash), которая пишет fMP4-сегменты всех рендитций
+    и оба манифеста: manifest.mpd и master.m3u8 с media-плейлистами на те же сегменты.
+    Аудио кодируется один раз и используется всеми видео-рендитциями.
+    """
+    input_options = _input_options(input_path)
+    if safe:
+        input_options.update(fflags="+genpts+discardcorrupt", err_detect="ignore_err")
+    stream = ffmpeg.input(input_path, **input_options)
+
+    output_options: Dict[str, Any] = dict(
+        format='dash',
+        seg_duration=segment_duration,
+        use_template=1,
+        use_timeline=1,
+        hls_playlist=1,  # master.m3u8 + media_<N>.m3u8 рядом с manifest.mpd
+        init_seg_name='init_$RepresentationID$.m4s',
+        media_seg_name='chunk_$RepresentationID$_$Number%05d$.m4s',
+        adaptation_sets="id=0,streams=v id=1,streams=a" if has_audio else "id=0,streams=v",
+    )
+
+    if copy:
+        # Без перекодирования — одна рендитция с исходным качеством
+        streams = [stream.video, stream.audio] if has_audio else [stream.video]
+        output_options.update(c='copy', threads=_threads_per_rendition(1))
+        renditions = renditions[:1]
+    else:
+        profile = profile or get_profile(QUEUE_NEW_UPLOAD)
+        split = stream.video.filter_multi_output('split', len(renditions))
+        streams = [split.stream(i).filter('scale', -2, rendition['height']) for i, rendition in enumerate(renditions)]
+        output_options.update(
+            vcodec='libx264',
+            preset=profile['preset'],
+            crf=profile['crf'],
+            threads=profile.get('threads') or FFMPEG_THREADS,
+            # Ключевые кадры на границах сегментов во всех рендитциях — переключение качества без разрывов
+            force_key_frames=f"expr:gte(t,n_forced*{segment_duration})",
+        )
+        for i, rendition in enumerate(renditions):
+            output_options[f'b:v:{i}'] = rendition['video_bitrate']
+            output_options[f'maxrate:v:{i}'] = rendition['video_bitrate']
+            output_options[f'bufsize:v:{i}'] = rendition['video_bitrate']
+        if safe:
+            output_options.update(pix_fmt="yuv420p", max_muxing_queue_size=1024)
+        if has_audio:
+            streams.append(stream.audio)
+            output_options.update(acodec='aac', audio_bitrate=max(
+                (rendition['audio_bitrate'] for rendition in renditions), key=lambda b: int(b.rstrip('k'))
+            ))
+            if safe:
+                output_options['ac'] = 2
+
+    output = ffmpeg.output(*streams, os.path.join(output_dir, 'manifest.mpd'), **output_options)
+    return [(output, 0, {"name": "cmaf" if not copy else "cmaf-copy"})]
+
+def _ffmpeg_command_prefix() -> List[str]:
+    """
+    Префикс для запуска ffmpeg с пониженным приоритетом CPU и ограничением адресного
+    пространства (RLIMIT_AS через prlimit) — оба действуют с первой инструкции ffmpeg.
+    """
+    prefix = []
+    if FFMPEG_MEMORY_LIMIT_MB and shutil.which("prlimit"):
+        prefix += ["prlimit", f"--as={FFMPEG_MEMORY_LIMIT_MB * 1024 * 1024}", "--"]
+    if FFMPEG_NICE and shutil.which("nice"):
+        prefix += ["nice", "-n", str(FFMPEG_NICE)]
+    return prefix
+
+def _limit_memory_in_child():
+    """Без утилиты prlimit: RLIMIT_AS выставляется в дочернем процессе до exec ffmpeg."""
+    limit = FFMPEG_MEMORY_LIMIT_MB * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _spawn_ffmpeg(command: Any, log_path: str) -> Tuple[subprocess.Popen, FfmpegProgress]:
+    """
+    Запускает ffmpeg в фоне с потоком -progress в stdout.
+    Процесс получает собственную группу, чтобы его можно было убить целиком;
+    stderr пишется в лог, чтобы не переполнить пайп.
+    """
+    args = _ffmpeg_command_prefix() + ffmpeg.compile(command.global_args(*PROGRESS_ARGS), overwrite_output=True)
+    preexec_fn = _limit_memory_in_child if FFMPEG_MEMORY_LIMIT_MB and args[0] != "prlimit" else None
+    with open(log_path, "wb") as log_file:
+        process = subprocess.Popen(
+            args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=log_file,
+            start_new_session=True,
+            preexec_fn=preexec_fn,
+        )
+    progress = FfmpegProgress()
+    start_progress_reader(process.stdout, progress)
+    return process, progress
+
+def _terminate_process_group(process: subprocess.Popen):
+    """Завершает группу процессов ffmpeg: SIGTERM, затем SIGKILL."""
+    if process.poll() is not None:
+        return
     try:
-        for command, index, rendition in commands:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=FFMPEG_KILL_GRACE)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+    except ProcessLookupError:
+        process.wait()
+
+def _check_limits(progress: FfmpegProgress, deadline: float) -> Optional[str]:
+    """Возвращает причину остановки ('timeout' или 'stalled') или None."""
+    now = time.monotonic()
+    if now > deadline:
+        return "timeout"
+    if now - progress.advanced_at > FFMPEG_STALL_TIMEOUT:
+        return "stalled"
+    return None
+
+def _wait_ffmpeg(process: subprocess.Popen, progress: FfmpegProgress, deadline: float, on_tick=None) -> Optional[str]:
+    """
+    Ждет завершения ffmpeg с контролем таймаута и зависания.
+    Возвращает причину принудительной остановки или None, если процесс завершился сам.
+    """
+    while process.poll() is None:
+        reason = _check_limits(progress, deadline)
+        if reason:
+            logger.error(f"ffmpeg process {process.pid} {reason}, killing process group")
+            _terminate_process_group(process)
+            return reason
+        if on_tick:
+            on_tick()
+        time.sleep(PROGRESSIVE_POLL_INTERVAL)
+    return None
+
+def _read_log_tail(log_path: str, max_bytes: int = 2000) -> str:
+    """Возвращает хвост лога ffmpeg для диагностики."""
+    try:
+        with open(log_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - max_bytes))
+            return f.read().decode("utf-8", errors="replace")
+    except OSError:
+        return ""
+
+def _update_transcoding_progress(file_id: str, progress: Dict[str, Any], hls_manifest_path: Optional[str] = None):
+    """Сохраняет прогресс транскодирования (и путь к манифесту, когда он стал доступен)."""
+    try:
+        with get_db_session() as db:
+            file_record = db.query(File).filter(File.id == file_id).first()
+            if not file_record:
+                return
+            progress = dict(progress, updated_at=datetime.now(timezone.utc).isoformat())
+            file_record.transcoding_progress = progress
+            if hls_manifest_path:
+                file_record.hls_manifest_path = hls_manifest_path
+    except Exception as e:
+        logger.warning(f"Could not update transcoding progress for file {file_id}: {e}")
+
+def _run_ffmpeg_commands_fast(
+    commands: List[tuple],
+    deadline: float,
+    file_id: Optional[str] = None,
+    duration: Optional[float] = None,
+    log_dir: Optional[str] = None,
+    started_at: Optional[str] = None
+) -> bool:
+    """
+    Быстрый запуск ffmpeg команд последовательно с отчетом о прогрессе.
+    deadline — срок всего задания (time.monotonic()), общий для всех попыток.
+    """
+    log_dir = log_dir or "/tmp"
+    try:
+        for position, (command, index, rendition) in enumerate(commands):
             logger.info(f"Running fast ffmpeg command {index+1}/{len(commands)} for {rendition['name']}")
-            
-            # Упрощенный запуск без лишнего логгирования
-            ffmpeg.run(command, overwrite_output=True, quiet=True)
-            
+
+            log_path = os.path.join(log_dir, f"ffmpeg_{index}.log")
+            process, progress = _spawn_ffmpeg(command, log_path)
+            last_report = [0.0]
+
+            def report():
+                if file_id and time.monotonic() - last_report[0] >= PROGRESS_UPDATE_INTERVAL:
+                    last_report[0] = time.monotonic()
+                    summary = summarize_progress([progress], duration, position, len(commands))
+                    _update_transcoding_progress(
+                        file_id,
+                        dict(summary, mode="batch", stage="transcoding", rendition=rendition['name'], started_at=started_at),
+                    )
+
+            reason = _wait_ffmpeg(process, progress, deadline, on_tick=report)
+            if reason:
+                logger.error(f"ffmpeg for {rendition['name']} stopped: {reason}")
+                return False
+            if process.returncode != 0:
+                logger.error(f"ffmpeg failed for {rendition['name']}: {_read_log_tail(log_path)}")
+                return False
+
             logger.info(f"Fast ffmpeg command completed for {rendition['name']}")
         
         return True
@@ -234,6 +534,85 @@ def _run_ffmpeg_commands_fast(commands: List[tuple], timeout: int) -> bool:
         logger.error(f"Error running fast ffmpeg commands: {e}")
         return False
 
+def _run_ffmpeg_commands_progressive(
+    commands: List[tuple],
+    publisher: HlsProgressivePublisher,
+    file_id: str,
+    duration: Optional[float],
+    log_dir: str,
+    manifest_path: str,
+    deadline: float,
+    started_at: Optional[str] = None
+) -> bool:
+    """
+    Запускает ffmpeg для всех рендитций параллельно и публикует сегменты по мере готовности.
+    Мастер-плейлист становится доступен плееру после первого сегмента каждой рендитции.
+    deadline — срок всего задания (time.monotonic()).
+    """
+    processes = []
+    try:
+        for command, index, rendition in commands:
+            log_path = os.path.join(log_dir, f"ffmpeg_{index}.log")
+            process, progress = _spawn_ffmpeg(command, log_path)
+            processes.append((process, progress, log_path, rendition))
+            logger.info(f"Started progressive ffmpeg for {rendition['name']}")
+
+        last_segments_done = -1
+        last_report = 0.0
+        while True:
+            running = any(process.poll() is None for process, _, _, _ in processes)
+            master_published_now = publisher.poll()
+
+            segments_changed = publisher.segments_done != last_segments_done
+            if master_published_now or segments_changed or time.monotonic() - last_report >= PROGRESS_UPDATE_INTERVAL:
+                last_segments_done = publisher.segments_done
+                last_report = time.monotonic()
+                summary = summarize_progress([progress for _, progress, _, _ in processes], duration)
+                _update_transcoding_progress(
+                    file_id,
+                    dict(
+                        summary,
+                        mode="progressive",
+                        stage="transcoding",
+                        segments_done=publisher.segments_done,
+                        playable=publisher.master_published,
+                        started_at=started_at,
+                    ),
+                    hls_manifest_path=manifest_path if master_published_now else None,
+                )
+
+            if not running:
+                break
+
+            for process, progress, _, rendition in processes:
+                reason = _check_limits(progress, deadline) if process.poll() is None else None
+                if reason:
+                    logger.error(f"Progressive ffmpeg for {rendition['name']} {reason}, aborting job")
+                    return False
+            time.sleep(PROGRESSIVE_POLL_INTERVAL)
+
+        failed = [(log_path, rendition) for process, _, log_path, rendition in processes if process.returncode != 0]
+        if failed:
+            for log_path, rendition in failed:
+                logger.error(f"Progressive ffmpeg failed for {rendition['name']}: {_read_log_tail(log_path)}")
+            return False
+
+        publisher.finalize()
+        return True
+    except Exception as e:
+        logger.error(f"Error during progressive HLS transcoding: {e}")
+        return False
+    finally:
+        for process, _, _, _ in processes:
+            _terminate_process_group(process)
+
+def _clear_rendition_dirs(output_dir: str):
+    """Удаляет локальные директории рендитций перед повторной попыткой."""
+    for item in os.listdir(output_dir):
+        item_path = os.path.join(output_dir, item)
+        if os.path.isdir(item_path) and item.startswith("stream_"):
+            shutil.rmtree(item_path, ignore_errors=True)
+
 def _create_master_playlist(output_dir: str, renditions: List[Dict[str, Any]]):
     """Создает мастер плейлист для всех рендитций"""
     master_playlist_path = os.path.join(output_dir, "master.m3u8")
@@ -253,30 +632,201 @@ def _create_master_playlist(output_dir: str, renditions: List[Dict[str, Any]]):
             f.write(f"stream_{i}/playlist.m3u8\n")
 
 def _upload_to_s3_complete(local_dir: str, s3_base_path: str, file_id: str):
-    """Полная загрузка всех рендитций в S3"""
+    """
+    Полная загрузка всех рендитций в S3.
+    Сегменты грузятся параллельно, плейлисты — в конце (сначала рендитций, затем мастер),
+    чтобы плеер никогда не увидел манифест со ссылками на ещё не загруженные сегменты.
+    """
     logger.info(f"Complete uploading to S3 path {s3_base_path} for file ID: {file_id}")
     s3_hls_path = f"{s3_base_path}/hls"
 
-    master_playlist_local = os.path.join(local_dir, "master.m3u8")
-    if os.path.exists(master_playlist_local):
-        s3_key_master = f"{s3_hls_path}/master.m3u8"
-        s3_client.upload_file(master_playlist_local, settings.AWS_S3_BUCKET_NAME, s3_key_master)
-
-    # Загружаем все рендитции
-    for item in os.listdir(local_dir):
+    segments = []
+    playlists = []
+    for item in sorted(os.listdir(local_dir)):
         item_path = os.path.join(local_dir, item)
         if os.path.isdir(item_path) and item.startswith("stream_"):
-            logger.info(f"Uploading rendition directory {item} to S3")
-            for filename in os.listdir(item_path):
+            for filename in sorted(os.listdir(item_path)):
                 local_file_path = os.path.join(item_path, filename)
-                if os.path.isfile(local_file_path):
-                    s3_key = f"{s3_hls_path}/{item}/{filename}"
-                    s3_client.upload_file(local_file_path, settings.AWS_S3_BUCKET_NAME, s3_key)
+                if not os.path.isfile(local_file_path):
+                    continue
+                s3_key = f"{s3_hls_path}/{item}/{filename}"
+                if filename.endswith(".m3u8"):
+                    playlists.append((local_file_path, s3_key))
+                else:
+                    segments.append((local_file_path, s3_key))
+
+    logger.info(f"Uploading {len(segments)} segments for file ID: {file_id}")
+    errors = upload_files_concurrently(segments)
+    if errors:
+        raise Exception(f"Failed to upload {len(errors)} HLS segments for file {file_id}")
+
+    for local_file_path, s3_key in playlists:
+        upload_file_with_retry(local_file_path, s3_key)
 
-def _transcode_video_task_internal(file_id: str):
+    master_playlist_local = os.path.join(local_dir, "master.m3u8")
+    if os.path.exists(master_playlist_local):
+        upload_file_with_retry(master_playlist_local, f"{s3_hls_path}/master.m3u8")
+
+def _download_original(s3_key: str, temp_dir: str) -> str:
+    """Скачивает оригинал целиком во временную директорию."""
+    local_path = os.path.join(temp_dir, "original.mp4")
+    logger.info(f"[Worker Thread] Downloading file {s3_key} from S3 to {local_path}")
+    s3_client.download_file(settings.AWS_S3_BUCKET_NAME, s3_key, local_path)
+    return local_path
+
+def _resolve_transcode_input(s3_key: str, temp_dir: str, timeout: int) -> str:
+    """
+    Возвращает вход для ffmpeg: presigned URL оригинала, если контейнер читается
+    по HTTP с range-запросами, иначе путь к полностью скачанной копии.
+    """
+    if TRANSCODE_INPUT_MODE == "stream":
+        try:
+            # Ссылка должна пережить все попытки (copy, перекодирование, безопасный профиль) —
+            # они укладываются в общий срок задания; ffmpeg переподключается и делает новые range-запросы
+            url = s3_client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': settings.AWS_S3_BUCKET_NAME, 'Key': s3_key},
+                ExpiresIn=timeout + PRESIGNED_URL_MARGIN,
+            )
+            format_name = _probe(url).get('format', {}).get('format_name', '')
+            if STREAMABLE_FORMATS.intersection(format_name.split(',')):
+                logger.info(f"[Worker Thread] Streaming {s3_key} from S3 (format: {format_name})")
+                return url
+            logger.info(f"[Worker Thread] Container '{format_name}' is not streamable, downloading {s3_key}")
+        except Exception as e:
+            logger.warning(f"[Worker Thread] Could not probe {s3_key} over presigned URL, downloading instead: {e}")
+    return _download_original(s3_key, temp_dir)
+
+def _upload_cmaf_to_s3(local_dir: str, s3_cmaf_path: str, file_id: str):
+    """
+    Загружает CMAF-вывод в S3: сначала init- и media-сегменты параллельно,
+    затем media-плейлисты, и в самом конце master.m3u8 и manifest.mpd.
+    """
+    logger.info(f"Uploading CMAF output to S3 path {s3_cmaf_path} for file ID: {file_id}")
+    segments = []
+    playlists = []
+    for filename in sorted(os.listdir(local_dir)):
+        local_file_path = os.path.join(local_dir, filename)
+        if not os.path.isfile(local_file_path) or filename.endswith(".tmp"):
+            continue
+        item = (local_file_path, f"{s3_cmaf_path}/{filename}")
+        if filename.endswith(".m4s"):
+            segments.append(item)
+        elif filename.endswith(".m3u8") and filename != "master.m3u8":
+            playlists.append(item)
+
+    logger.info(f"Uploading {len(segments)} CMAF segments for file ID: {file_id}")
+    errors = upload_files_concurrently(segments)
+    if errors:
+        raise Exception(f"Failed to upload {len(errors)} CMAF segments for file {file_id}")
+
+    for local_file_path, s3_key in playlists:
+        upload_file_with_retry(local_file_path, s3_key)
+    for manifest_name in ("master.m3u8", "manifest.mpd"):
+        manifest_local = os.path.join(local_dir, manifest_name)
+        if os.path.exists(manifest_local):
+            upload_file_with_retry(manifest_local, f"{s3_cmaf_path}/{manifest_name}")
+
+def _transcode_cmaf(
+    input_path: str,
+    output_dir: str,
+    renditions: List[Dict[str, Any]],
+    has_audio: bool,
+    use_copy: bool,
+    safe: bool,
+    profile: Dict[str, Any],
+    deadline: float,
+    file_id: str,
+    duration: Optional[float],
+    log_dir: str,
+    started_at: Optional[str]
+) -> Optional[str]:
+    """
+    Кодирует в CMAF (copy, если возможно, иначе перекодирование) в чистую директорию.
+    Возвращает фактически использованный путь ("copy" или "encode") или None при неудаче.
+    """
+    for copy in ([True, False] if use_copy and not safe else [False]):
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir, exist_ok=True)
+        commands = _build_cmaf_commands(
+            input_path, output_dir, renditions, SEGMENT_DURATION, has_audio, copy=copy, safe=safe, profile=profile
+        )
+        if _run_ffmpeg_commands_fast(commands, deadline, file_id, duration, log_dir, started_at):
+            if copy:
+                logger.info("Using copy transcode for CMAF output")
+            return "copy" if copy else "encode"
+    return None
+
+def _retire_transcoded_outputs(base_paths: List[str]):
+    """
+    Объекты результатов, на которые больше никто не ссылается (ссылки сняты и закоммичены),
+    удаляются через PREVIOUS_OUTPUT_RETENTION_SECONDS, чтобы не оборвать уже идущее воспроизведение.
+    """
+    for base_path in base_paths:
+        try:
+            logger.info(
+                f"[Worker Thread] Unreferenced transcoded output {base_path} will be removed "
+                f"in {PREVIOUS_OUTPUT_RETENTION_SECONDS}s"
+            )
+            schedule_transcoded_output_deletion(base_path, PREVIOUS_OUTPUT_RETENTION_SECONDS)
+        except Exception as cleanup_error:
+            logger.warning(f"[Worker Thread] Could not schedule removal of {base_path}: {cleanup_error}")
+
+def _delete_transcoded_output_logged(base_path: str):
+    try:
+        deleted = delete_transcoded_output(base_path)
+        logger.info(f"Removed {deleted} objects of previous transcoded output {base_path}")
+    except Exception as e:
+        logger.warning(f"Could not remove previous transcoded output {base_path}: {e}")
+
+def schedule_transcoded_output_deletion(base_path: str, delay_seconds: int):
+    """Отложенное удаление объектов результата: задачей Celery с задержкой или таймером процесса."""
+    if delay_seconds <= 0:
+        _delete_transcoded_output_logged(base_path)
+        return
+    if TRANSCODE_DISPATCH == "celery":
+        from app.celery_app import QUEUE_MAINTENANCE
+        from app.tasks.transcode_tasks import delete_transcoded_output_task
+
+        delete_transcoded_output_task.apply_async(args=[base_path], countdown=delay_seconds, queue=QUEUE_MAINTENANCE)
+        return
+    timer = threading.Timer(delay_seconds, _delete_transcoded_output_logged, args=[base_path])
+    timer.daemon = True
+    timer.start()
+
+def _delete_abandoned_outputs(base_paths: List[str]):
+    """Удаляет объекты попыток, результат которых не был опубликован (они не зарегистрированы)."""
+    for base_path in base_paths:
+        try:
+            delete_transcoded_output(base_path)
+        except Exception as cleanup_error:
+            logger.warning(f"[Worker Thread] Could not remove partial output {base_path}: {cleanup_error}")
+
+def _restored_progress(previous: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Прогресс файла после неудачного перетранскодирования: прежний (с лестницей рендитций)
+    без отметки постановки в очередь и с временем сбоя.
+    """
+    progress = {
+        key: value
+        for key, value in (previous["transcoding_progress"] or {}).items()
+        if key not in ("queued_at", "backfill")
+    }
+    if previous["transcoding_status"] == "completed":
+        progress["stage"] = "completed"
+    progress["last_run_failed_at"] = datetime.now(timezone.utc).isoformat()
+    return progress
+
+def _transcode_video_task_internal(file_id: str, queue: str = QUEUE_NEW_UPLOAD):
     """Внутренняя функция, выполняющая фактическое транскодирование."""
-    logger.info(f"[Worker Thread] Fast transcoding task started for file ID: {file_id}")
+    logger.info(f"[Worker Thread] Fast transcoding task started for file ID: {file_id} (queue: {queue})")
+    profile = get_profile(queue)
     temp_dir: Optional[str] = None
+    base_s3_path: Optional[str] = None
+    keep_previous = False
+    run_bases: List[str] = []
+    unused_bases: List[str] = []
+    previous: Dict[str, Any] = {}
     try:
         with get_db_session() as db:
             file_record = db.query(File).filter(File.id == file_id).first()
@@ -289,87 +839,255 @@ def _transcode_video_task_internal(file_id: str):
                 file_record.transcoding_status = "completed"
                 return
 
+            # Файл мог ссылаться на общий результат транскодирования дубликата.
+            # Готовый результат остается доступным плееру до успешного завершения нового запуска
+            previous = {
+                "hls_manifest_path": file_record.hls_manifest_path,
+                "dash_manifest_path": file_record.dash_manifest_path,
+                "transcoding_status": file_record.transcoding_status,
+                "transcoding_progress": file_record.transcoding_progress,
+            }
+            previous_base = transcoded_base_path(file_record.hls_manifest_path)
+            keep_previous = bool(file_record.hls_manifest_path)
+
             logger.info(f"[Worker Thread] Setting transcoding status to 'processing' for file ID: {file_id}")
             file_record.transcoding_status = "processing"
+            started_at = datetime.now(timezone.utc).isoformat()
+            file_record.transcoding_progress = {"stage": "downloading", "percent": 0.0, "started_at": started_at}
             db.commit()
 
             temp_dir = f"/tmp/transcode_{uuid.uuid4()}"
             os.makedirs(temp_dir, exist_ok=True)
-            original_local_path = os.path.join(temp_dir, "original.mp4")
             output_dir = os.path.join(temp_dir, "output", "hls")
             os.makedirs(output_dir, exist_ok=True)
+            cmaf_output = TRANSCODE_OUTPUT_FORMAT == "cmaf"
 
-            logger.info(f"[Worker Thread] Downloading file {file_record.file_path} from S3 to {original_local_path}")
-            s3_client.download_file(settings.AWS_S3_BUCKET_NAME, file_record.file_path, original_local_path)
+            timeout = _calculate_timeout(file_record.size)
+            # Один срок на всё задание: copy, перекодирование, безопасный профиль и повтор с локальной копией
+            deadline = time.monotonic() + timeout
+            input_path = _resolve_transcode_input(file_record.file_path, temp_dir, timeout)
 
             # Все рендитции
             renditions = _get_all_renditions()
             
-            has_audio = _probe_audio_streams(original_local_path)
+            has_audio = _probe_audio_streams(input_path)
             logger.info(f"[Worker Thread] Audio streams detected: {has_audio}")
 
-            timeout = _calculate_timeout(original_local_path)
-            
+            duration = _extract_video_metadata(input_path).get('duration')
+
             # Попытка copy transcode (самый быстрый способ)
+            use_copy = False
             if USE_COPY_CODEC:
-                can_copy, video_codec, audio_codec, duration = _can_copy_codec(original_local_path)
+                can_copy, video_codec, audio_codec, _ = _can_copy_codec(input_path)
                 logger.info(f"Copy codec capability: {can_copy}, Video: {video_codec}, Audio: {audio_codec}")
-                
-                if can_copy and _try_copy_transcode_all(original_local_path, output_dir, SEGMENT_DURATION, has_audio, renditions):
-                    logger.info("Using copy transcode - fastest method for all renditions")
-                    # Создаем мастер плейлист для всех рендитций
-                    _create_master_playlist(output_dir, renditions)
-                else:
-                    # Быстрое перекодирование всех рендитций
-                    commands = _build_fast_hls_commands(
-                        original_local_path, output_dir, renditions, SEGMENT_DURATION, has_audio
+                use_copy = can_copy
+
+            # Вторая попытка — безопасный профиль с одной (минимальной) рендитцией
+            attempts = [False, True] if SAFE_PROFILE_RETRY else [False]
+            transcoded = False
+            # Какой путь фактически дал результат: remux без перекодирования ("copy") или "encode"
+            codec_path = None
+            publisher = None
+            attempt_index = 0
+            while attempt_index < len(attempts):
+                if time.monotonic() > deadline:
+                    logger.error(f"[Worker Thread] Transcoding time limit exceeded for file {file_id}, no more attempts")
+                    break
+                # Каждая попытка пишет в свою директорию: опубликованные объекты (в том числе
+                # предыдущего результата) никогда не перезаписываются, и закэшированные по ключу
+                # плейлисты и сегменты не устаревают ни в одном процессе
+                base_s3_path = new_transcode_base(file_record.id)
+                run_bases.append(base_s3_path)
+                safe = attempts[attempt_index]
+                attempt_renditions = renditions[:1] if safe else renditions
+                if safe:
+                    logger.warning(f"[Worker Thread] Retrying file {file_id} with safe transcoding profile")
+                    _clear_rendition_dirs(output_dir)
+
+                if cmaf_output:
+                    cmaf_dir = os.path.join(temp_dir, "output", "cmaf")
+                    codec_path = _transcode_cmaf(
+                        input_path, cmaf_dir, attempt_renditions, has_audio, use_copy, safe, profile,
+                        deadline, file_id, duration, temp_dir, started_at
                     )
-                    
-                    if commands and not _run_ffmpeg_commands_fast(commands, timeout):
-                        raise Exception("Fast HLS transcoding failed")
-                    
-                    # Создаем мастер плейлист для всех рендитций
-                    _create_master_playlist(output_dir, renditions)
-            else:
-                # Быстрое перекодирование всех рендитций
-                commands = _build_fast_hls_commands(
-                    original_local_path, output_dir, renditions, SEGMENT_DURATION, has_audio
-                )
+                    transcoded = codec_path is not None
+                    if transcoded:
+                        _update_transcoding_progress(
+                            file_id, {"mode": "batch", "stage": "uploading", "percent": 99.9, "started_at": started_at}
+                        )
+                        _upload_cmaf_to_s3(cmaf_dir, f"{base_s3_path}/cmaf", file_id)
+                elif PROGRESSIVE_HLS:
+                    # Мастер плейлист статичен, создаем его заранее, чтобы опубликовать вместе с первыми сегментами
+                    _create_master_playlist(output_dir, attempt_renditions)
+                    publisher = HlsProgressivePublisher(output_dir, f"{base_s3_path}/hls", len(attempt_renditions))
+                    # Файл без готового результата становится воспроизводимым по мере публикации,
+                    # у перетранскодируемого плеер продолжает получать прежний результат
+                    manifest_path = None if keep_previous else f"{base_s3_path}/hls/master.m3u8"
+                    hls_options = _hls_output_options(progressive=True)
 
-                duration = _extract_video_metadata(original_local_path)
-                
-                if commands and not _run_ffmpeg_commands_fast(commands, timeout):
-                    raise Exception("Fast HLS transcoding failed")
-                
-                # Создаем мастер плейлист для всех рендитций
-                _create_master_playlist(output_dir, renditions)
+                    if use_copy and not safe:
+                        commands = _build_copy_hls_commands(
+                            input_path, output_dir, attempt_renditions, SEGMENT_DURATION, has_audio, hls_options
+                        )
+                        transcoded = _run_ffmpeg_commands_progressive(
+                            commands, publisher, file_id, duration, temp_dir, manifest_path, deadline, started_at
+                        )
+                        if transcoded:
+                            logger.info("Using copy transcode - fastest method for all renditions")
+                            codec_path = "copy"
+                        else:
+                            # Перекодированные сегменты публикуются в новую директорию, а не поверх copy-прохода
+                            _clear_rendition_dirs(output_dir)
+                            base_s3_path = new_transcode_base(file_record.id)
+                            run_bases.append(base_s3_path)
+                            publisher = HlsProgressivePublisher(output_dir, f"{base_s3_path}/hls", len(attempt_renditions))
+                            manifest_path = None if keep_previous else f"{base_s3_path}/hls/master.m3u8"
 
-            base_s3_path = f"transcoded/{file_record.id}"
-            _upload_to_s3_complete(os.path.join(temp_dir, "output", "hls"), base_s3_path, file_id)
+                    if not transcoded:
+                        commands = _build_fast_hls_commands(
+                            input_path, output_dir, attempt_renditions, SEGMENT_DURATION, has_audio, hls_options, safe, profile
+                        )
+                        transcoded = bool(commands) and _run_ffmpeg_commands_progressive(
+                            commands, publisher, file_id, duration, temp_dir, manifest_path, deadline, started_at
+                        )
+                        codec_path = "encode"
+                else:
+                    if use_copy and not safe and _try_copy_transcode_all(
+                        input_path, output_dir, SEGMENT_DURATION, has_audio, attempt_renditions, deadline
+                    ):
+                        logger.info("Using copy transcode - fastest method for all renditions")
+                        transcoded = True
+                        codec_path = "copy"
+                    else:
+                        # Быстрое перекодирование всех рендитций
+                        commands = _build_fast_hls_commands(
+                            input_path, output_dir, attempt_renditions, SEGMENT_DURATION, has_audio,
+                            safe=safe, profile=profile
+                        )
+                        transcoded = bool(commands) and _run_ffmpeg_commands_fast(
+                            commands, deadline, file_id, duration, temp_dir, started_at
+                        )
+                        codec_path = "encode"
+
+                    if transcoded:
+                        # Создаем мастер плейлист для всех рендитций
+                        _create_master_playlist(output_dir, attempt_renditions)
+                        _update_transcoding_progress(
+                            file_id, {"mode": "batch", "stage": "uploading", "percent": 99.9, "started_at": started_at}
+                        )
+                        _upload_to_s3_complete(os.path.join(temp_dir, "output", "hls"), base_s3_path, file_id)
+
+                if transcoded:
+                    break
+                if _is_remote_input(input_path):
+                    # Сбой при чтении по сети не должен стоить перехода на безопасный профиль:
+                    # повторяем ту же попытку с локальной копией
+                    logger.warning(f"[Worker Thread] Streaming input failed for file {file_id}, retrying from local copy")
+                    _clear_rendition_dirs(output_dir)
+                    input_path = _download_original(file_record.file_path, temp_dir)
+                    continue
+                attempt_index += 1
+
+            if not transcoded:
+                raise Exception("HLS transcoding failed (including safe profile retry)")
             
             logger.info(f"[Worker Thread] Setting transcoding status to 'completed' for file ID: {file_id}")
-            file_record.hls_manifest_path = f"{base_s3_path}/hls/master.m3u8"
+            if cmaf_output:
+                # HLS и DASH ссылаются на одни и те же fMP4-сегменты
+                file_record.hls_manifest_path = f"{base_s3_path}/cmaf/master.m3u8"
+                file_record.dash_manifest_path = f"{base_s3_path}/cmaf/manifest.mpd"
+            else:
+                file_record.hls_manifest_path = f"{base_s3_path}/hls/master.m3u8"
+                file_record.dash_manifest_path = None
             file_record.transcoding_status = "completed"
+            file_record.transcoding_progress = {
+                "mode": "progressive" if PROGRESSIVE_HLS and not cmaf_output else "batch",
+                "stage": "completed",
+                "percent": 100.0,
+                "eta_seconds": 0,
+                "started_at": started_at,
+                "segments_done": publisher.segments_done if publisher else None,
+                "playable": True,
+                "ladder": transcode_ladder_version(),
+                "codec_path": codec_path,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }
             file_record.duration = duration
+            # Следующие загрузки такого же содержимого будут использовать этот результат;
+            # ссылки (новая и снятая с прежнего результата) — в той же транзакции, что и пути файла
+            unused_bases = switch_transcoded_output(
+                db, file_record, previous_base, base_s3_path, file_record.transcoding_progress["ladder"]
+            )
             logger.info(f"[Worker Thread] Fast transcoding completed successfully for file {file_id}")
 
+        # Изменения закоммичены — результаты, на которые больше никто не ссылается, можно удалять
+        _retire_transcoded_outputs(unused_bases)
+        _delete_abandoned_outputs([base for base in run_bases if base != base_s3_path])
+
     except Exception as e:
         logger.error(f"[Worker Thread] Error during fast transcoding for file {file_id}: {e}", exc_info=True)
+        # Ссылки, снятые в неудавшейся транзакции, откатились вместе с ней
+        unused_bases = []
         try:
             with get_db_session() as db_fail:
                 file_record_fail = db_fail.query(File).filter(File.id == file_id).first()
-                if file_record_fail:
+                if file_record_fail and keep_previous:
+                    # Прежний результат, статус и объекты остаются как были; сбой виден в прогрессе
+                    logger.info(f"[Worker Thread] Keeping previous transcoded output for file ID: {file_id}")
+                    file_record_fail.hls_manifest_path = previous["hls_manifest_path"]
+                    file_record_fail.dash_manifest_path = previous["dash_manifest_path"]
+                    file_record_fail.transcoding_status = previous["transcoding_status"]
+                    file_record_fail.transcoding_progress = _restored_progress(previous)
+                elif file_record_fail:
                     logger.info(f"[Worker Thread] Updating transcoding status to 'failed' for file ID: {file_id}")
                     file_record_fail.transcoding_status = "failed"
+                    if PROGRESSIVE_HLS:
+                        # Недописанный EVENT-плейлист не должен отдаваться плееру
+                        abandoned_base = transcoded_base_path(file_record_fail.hls_manifest_path)
+                        file_record_fail.hls_manifest_path = None
+                        # Файл перестал ссылаться на результат, который он получил не от этого запуска
+                        if (
+                            abandoned_base
+                            and abandoned_base not in run_bases
+                            and remove_transcoded_asset_reference(db_fail, abandoned_base)
+                        ):
+                            unused_bases.append(abandoned_base)
+                        file_record_fail.transcoding_progress = dict(
+                            file_record_fail.transcoding_progress or {}, playable=False
+                        )
         except Exception as db_error:
             logger.error(f"[Worker Thread] Error updating DB status to 'failed' for file {file_id}: {db_error}")
+        else:
+            _retire_transcoded_outputs(unused_bases)
+        # Объекты незавершенного запуска не зарегистрированы и никому не нужны
+        _delete_abandoned_outputs(run_bases)
     finally:
         if temp_dir and os.path.exists(temp_dir):
             logger.info(f"[Worker Thread] Cleaning up temporary files for file ID: {file_id} (path: {temp_dir})")
             shutil.rmtree(temp_dir, ignore_errors=True)
         logger.info(f"[Worker Thread] Fast transcoding task finished for file ID: {file_id}")
 
-def start_transcoding(file_id: str):
-    """Запуск задачи транскодирования через пул потоков."""
-    logger.info(f"Scheduling fast transcoding task for file ID: {file_id}")
-    future = executor.submit(_transcode_video_task_internal, file_id)
\ No newline at end of file
+def start_transcoding(file_id: str, queue: str = QUEUE_NEW_UPLOAD, backfill_id: Optional[str] = None):
+    """
+    Запуск задачи транскодирования: через очередь Celery или пул потоков процесса.
+    backfill_id — пакетный запуск, в счетчики которого попадет результат.
+    """
+    if TRANSCODE_DISPATCH == "celery":
+        from app.celery_app import QUEUE_TRANSCODE_NEW, QUEUE_TRANSCODE_REENCODE
+        from app.tasks.transcode_tasks import transcode_video_task
+
+        celery_queue = QUEUE_TRANSCODE_REENCODE if queue == QUEUE_REENCODE else QUEUE_TRANSCODE_NEW
+        logger.info(f"Enqueueing transcoding task for file ID: {file_id} (queue: {celery_queue})")
+        transcode_video_task.apply_async(args=[file_id, queue, backfill_id], queue=celery_queue)
+        return
+    logger.info(f"Scheduling fast transcoding task for file ID: {file_id} (queue: {queue})")
+    if backfill_id:
+        from app.repositories.transcode_backfill_repository import record_backfill_result
+
+        def run_and_record():
+            _transcode_video_task_internal(file_id, queue)
+            record_backfill_result(backfill_id, file_id)
+
+        future = executor.submit(run_and_record)
+    else:
+        future = executor.submit(_transcode_video_task_internal, file_id, queue)
\ No newline at end of file
@@ -0,0 +1,37 @@
+import uuid
+from typing import Optional
+
+from app.services.s3_transfer_service import delete_prefix
+
+TRANSCODED_PREFIX = "transcoded"
+TRANSCODED_LAYOUTS = ("hls", "cmaf", "dash")
+
+
+def new_transcode_base(file_id) -> str:
+    """
+    Директория нового запуска транскодирования: transcoded/<id файла>/<запуск>.
+    Ключи объектов не переиспользуются — опубликованный результат не перезаписывается.
+    """
+    return f"{TRANSCODED_PREFIX}/{file_id}/{uuid.uuid4().hex[:12]}"
+
+
+def transcoded_base_path(manifest_path: Optional[str]) -> Optional[str]:
+    """
+    Директория результата по пути манифеста:
+    transcoded/<id>/<запуск>/hls/master.m3u8 -> transcoded/<id>/<запуск>
+    (у результатов без запуска в пути — transcoded/<id>/hls/master.m3u8 -> transcoded/<id>).
+    """
+    if not manifest_path:
+        return None
+    parts = manifest_path.split("/")
+    if len(parts) < 3:
+        return None
+    return "/".join(parts[:-2])
+
+
+def delete_transcoded_output(base_path: str) -> int:
+    """
+    Удаляет объекты результата (hls/, cmaf/, dash/ внутри base_path). Директории других
+    запусков того же файла лежат рядом с ними и не затрагиваются.
+    """
+    return sum(delete_prefix(f"{base_path}/{layout}/") for layout in TRANSCODED_LAYOUTS)
@@ -1,2 +1,4 @@
 from . import backup_tasks
-from . import backup_restore
\ No newline at end of file
+from . import backup_restore
+from . import generate_thumbnail
+from . import transcode_tasks
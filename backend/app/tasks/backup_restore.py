@@ -1,27 +1,55 @@
 from app.celery_app import celery_app
+import concurrent.futures
+import functools
 import io
+import itertools
 import json
 import os
 import tempfile
+import time
 import uuid
 import zipfile
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from botocore.exceptions import ClientError
 from app.core.database import get_db_session, s3_client
 from fastapi import HTTPException, UploadFile
-from app.models.base import Tag, User, Group, GroupMember, Category, File as DBFile
+from app.models.base import Blob, Tag, User, Group, GroupMember, Category, File as DBFile
 from app.models.base import file_group # Импортируем таблицу связи
 from app.core.config import settings # Добавьте импорт settings
+from app.repositories.blob_repository import add_blob_reference, blob_exists
+from app.repositories.restore_repository import existing_values, insert_missing
+from app.services.backup_manifest_service import (
+    archive_for_member,
+    member_file_id,
+    read_archive_manifest,
+    required_archives,
+)
+from app.services.backup_metadata_service import METADATA_FORMAT, METADATA_HEADER_NAME, iter_ndjson, section_name
+from app.services.s3_prefetch import ordered_prefetch
+from app.services.s3_transfer_service import copy_object_server_side, iter_s3_object, upload_stream_with_retry
+from app.tasks.backup_tasks import BACKUP_SNAPSHOT_WORKERS, SNAPSHOT_METADATA_NAME, SNAPSHOT_OBJECTS_NAME
+from app.services.blob_storage_service import BLOB_PREFIX, is_blob_key
+from app.services.transcoded_storage import transcoded_base_path
+from app.repositories.transcoded_asset_repository import (
+    add_transcoded_asset,
+    add_transcoded_asset_reference,
+    find_transcoded_assets,
+)
 
-@celery_app.task(bind=True)
-def restore_backup_task(self, s3_key: str, user_id: str): # Добавлен параметр
-    local_temp_file_path = None
-    try:
-        print(f"Starting restore task for S3 key: {s3_key}") # Для отладки
+METADATA_READ_CHUNK_SIZE = 1024 * 1024
+RESTORE_LOOKUP_BATCH_SIZE = 1000  # записей на один запрос проверки существования и вставки
+# Ключи результата _restore_file_objects со ссылками на общие объекты (берутся при вставке строки)
+REFERENCE_KEYS = ("blob", "shared_asset", "register_asset")
+# Параллельное восстановление: объекты файлов загружаются пулом потоков, записи БД вставляются пакетами
+BACKUP_RESTORE_WORKERS = int(os.getenv("BACKUP_RESTORE_WORKERS", "8"))
+BACKUP_RESTORE_DB_BATCH_SIZE = int(os.getenv("BACKUP_RESTORE_DB_BATCH_SIZE", "500"))
+RESTORE_PROGRESS_INTERVAL = 5  # секунды между обновлениями прогресса задачи
 
-        # Скачиваем файл из S3 в локальный временный файл
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+def _download_backup_archive(s3_key: str) -> str:
+    """Скачивает архив из S3 во временный файл и возвращает путь к нему"""
+    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+        try:
             # Получаем объект из S3
             response = s3_client.get_object(Bucket=settings.AWS_S3_BUCKET_NAME, Key=s3_key)
 
@@ -29,14 +57,125 @@ def restore_backup_task(self, s3_key: str, user_id: str): # Добавлен п
             # Это предотвращает загрузку всего файла в память
             for chunk in iter(lambda: response['Body'].read(8192), b''):
                 temp_file.write(chunk)
+        except Exception:
+            os.unlink(temp_file.name)
+            raise
+    return temp_file.name
+
+def _download_backup_chain(local_path: str) -> Dict[str, str]:
+    """
+    Для инкрементального или дифференциального бэкапа скачивает предыдущие архивы цепочки,
+    на которые ссылается его манифест. Возвращает {ключ архива: локальный путь}.
+    """
+    with zipfile.ZipFile(local_path, "r") as zip_ref:
+        manifest = read_archive_manifest(zip_ref)
+    chain_paths = {}
+    if not manifest:
+        return chain_paths
+    try:
+        for archive_key in sorted(required_archives(manifest)):
+            try:
+                chain_paths[archive_key] = _download_backup_archive(archive_key)
+            except ClientError as e:
+                raise ValueError(f"Backup chain is incomplete: {archive_key} is not available: {str(e)}")
+            print(f"Downloaded chained backup {archive_key} to local temp file: {chain_paths[archive_key]}")
+    except Exception:
+        _delete_local_files(chain_paths.values())
+        raise
+    return chain_paths
+
+class _BackupArchive:
+    """
+    Записи архива бэкапа (и нужных записей предыдущих архивов цепочки) по имени.
+    Содержимое читается прямо из ZIP потоком, без распаковки архива на диск.
+    """
+
+    def __init__(self, file_path: str, chain_paths: Dict[str, str] = None):
+        self._archives: List[zipfile.ZipFile] = []
+        self._members: Dict[str, Tuple[zipfile.ZipFile, zipfile.ZipInfo]] = {}
+        try:
+            archive = self._open(file_path)
+            self._add_members(archive, archive.infolist())
+            manifest = read_archive_manifest(archive)
+            for archive_key, local_path in (chain_paths or {}).items():
+                # Из предыдущих архивов берутся только объекты, которые по манифесту не менялись с их создания
+                chained = self._open(local_path)
+                self._add_members(
+                    chained, [info for info in chained.infolist() if archive_for_member(manifest, info.filename) == archive_key]
+                )
+        except Exception:
+            self.close()
+            raise
+
+    def _open(self, path: str) -> zipfile.ZipFile:
+        archive = zipfile.ZipFile(path, "r")
+        self._archives.append(archive)
+        return archive
+
+    def _add_members(self, archive: zipfile.ZipFile, infos: Iterable[zipfile.ZipInfo]) -> None:
+        for info in infos:
+            if not info.is_dir():
+                self._members[info.filename] = (archive, info)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._members
+
+    def __enter__(self) -> "_BackupArchive":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def open(self, name: str):
+        archive, info = self._members[name]
+        return archive.open(info)
+
+    def size(self, name: str) -> int:
+        return self._members[name][1].file_size
+
+    def names_under(self, prefix: str) -> List[str]:
+        return sorted(name for name in self._members if name.startswith(prefix))
 
-            local_temp_file_path = temp_file.name
+    def close(self) -> None:
+        for archive in self._archives:
+            archive.close()
+        self._archives = []
+
+
+def _batches(items: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    """Записи секции пакетами: проверки существования и вставки делаются запросом на пакет, а не на строку"""
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def _delete_local_files(paths) -> None:
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError as e:
+            print(f"Warning: Could not delete local temporary file {path}: {e}")
+
+@celery_app.task(bind=True)
+def restore_backup_task(self, s3_key: str, user_id: str): # Добавлен параметр
+    local_temp_file_path = None
+    chain_paths = {}
+    try:
+        print(f"Starting restore task for S3 key: {s3_key}") # Для отладки
+
+        # Скачиваем файл из S3 в локальный временный файл
+        local_temp_file_path = _download_backup_archive(s3_key)
 
         print(f"Downloaded S3 file {s3_key} to local temp file: {local_temp_file_path}") # Для отладки
 
+        # Базовый и промежуточные архивы, если бэкап инкрементальный
+        chain_paths = _download_backup_chain(local_temp_file_path)
+
         # Теперь вызываем основную логику восстановления, передавая путь к локальному файлу
-        service = BackupService()
-        result = service.restore_backup_from_path(local_temp_file_path, user_id)
+        service = BackupService(progress=lambda meta: self.update_state(state='PROGRESS', meta=meta))
+        result = service.restore_backup_from_path(local_temp_file_path, user_id, chain_paths)
 
         if isinstance(result, dict) and "error" in result:
             raise Exception(result["error"])
@@ -49,6 +188,7 @@ def restore_backup_task(self, s3_key: str, user_id: str): # Добавлен п
         # Возвращаем ошибку, чтобы фронтенд мог обработать её
         return {"error": str(e), "message": "Backup restore failed"}
     finally:
+        _delete_local_files(chain_paths.values())
         # Удаляем локальный временный файл
         if local_temp_file_path and os.path.exists(local_temp_file_path):
             try:
@@ -59,9 +199,31 @@ def restore_backup_task(self, s3_key: str, user_id: str): # Добавлен п
         else:
             print(f"Local temporary file was already deleted or never existed: {local_temp_file_path}")
 
+@celery_app.task(bind=True)
+def restore_snapshot_task(self, snapshot_prefix: str, user_id: str):
+    """Восстановление из снимка объектов (backups/<snapshot-id>/) серверным копированием"""
+    try:
+        print(f"Starting snapshot restore task for: {snapshot_prefix}")
+        service = SnapshotRestoreService(progress=lambda meta: self.update_state(state='PROGRESS', meta=meta))
+        result = service.restore_snapshot(snapshot_prefix, user_id)
+        print(f"Snapshot restore task completed successfully for: {snapshot_prefix}")
+        return result
+    except Exception as e:
+        print(f"Error in restore_snapshot_task: {e}")
+        return {"error": str(e), "message": "Backup restore failed"}
+
 class BackupService:
-    def restore_backup_from_path(self, file_path: str, user_id: str) -> Dict[str, Any]:
-        """Основная логика восстановления бэкапа из файла на диске"""
+    def __init__(self, progress: Callable[[Dict[str, Any]], None] = None):
+        # progress получает сводку восстановления (этап и счетчики файлов), например для self.update_state задачи
+        self.progress = progress
+        self.progress_state: Dict[str, Any] = {}
+        self._progress_reported = 0.0
+
+    def restore_backup_from_path(self, file_path: str, user_id: str, chain_paths: Dict[str, str] = None) -> Dict[str, Any]:
+        """
+        Основная логика восстановления бэкапа из файла на диске.
+        chain_paths — локальные копии предыдущих архивов цепочки для инкрементального бэкапа.
+        """
         try:
 
             with get_db_session() as db:
@@ -70,374 +232,463 @@ class BackupService:
                 if not current_user:
                     raise ValueError("User not found")
             
-            with tempfile.TemporaryDirectory() as temp_dir:
-                # Распаковываем ZIP архив
-                with zipfile.ZipFile(file_path, "r") as zip_ref:
-                    zip_ref.extractall(temp_dir)
-
+            # Архив не распаковывается: объекты загружаются в S3 потоком прямо из записей ZIP
+            with _BackupArchive(file_path, chain_paths) as archive, \
+                    concurrent.futures.ThreadPoolExecutor(max_workers=BACKUP_RESTORE_WORKERS) as upload_pool:
+                # Общий пул для сегментов транскодированных файлов (отдельно от пула файлов)
+                self._upload_pool = upload_pool
                 # Читаем метаданные
-                metadata_path = os.path.join(temp_dir, "backup_metadata.json")
-                if not os.path.exists(metadata_path):
+                if METADATA_HEADER_NAME not in archive:
                     raise ValueError("Invalid backup file: metadata not found")
 
-                with open(metadata_path, "r", encoding="utf-8") as f:
+                with archive.open(METADATA_HEADER_NAME) as f:
                     backup_data = json.load(f)
 
-                # Проверяем тип бэкапа и права доступа
-                backup_type = backup_data.get("backup_type", "user")
-                if backup_type == "full" and not current_user.is_admin:
-                    raise ValueError("Only administrators can restore full backups")
-
-                restored_files = 0
-
-                # Восстанавливаем данные
-                with get_db_session() as db:
-                    # Создаём маппинг из бэкапа в текущую БД
-                    backup_user_id_to_db_user_id = {}
-                    backup_file_id_to_db_file_id = {} # Новый маппинг для файлов
-                    backup_group_id_to_db_group_id = {} # Новый маппинг для групп
-                    # Заполняем из существующих пользователей
-                    existing_users = db.query(User).all()
-                    for u in existing_users:
-                        backup_user_id_to_db_user_id[str(u.id)] = u.id # Если backup_data содержит ID, сопоставляем с собой
-
-                    # Для full backup восстанавливаем пользователей
-                    if backup_type == "full":
-                        restored_users_backup_data = backup_data.get("users", [])
-                        restored_user_count = self._restore_users(
-                            db, restored_users_backup_data, backup_user_id_to_db_user_id
-                        )
-                        # _restore_users теперь обновляет маппинг
-                    else: # user backup
-                        # Для user backup, добавим маппинг для текущего пользователя
-                        backup_user_id_to_db_user_id[backup_data.get("user_id", str(current_user.id))] = current_user.id
-
-                    # Восстанавливаем коллекции
-                    restored_files += self._restore_groups(
-                        db, backup_data.get("groups", []), current_user, backup_type, backup_user_id_to_db_user_id, backup_group_id_to_db_group_id
-                    )
+                return self._restore_backup_data(backup_data, current_user, archive)
 
-                    # Восстанавливаем участников коллекций
-                    if backup_type == "full":
-                        self._restore_group_members(
-                            db, backup_data.get("group_members", []), backup_user_id_to_db_user_id, backup_group_id_to_db_group_id
-                        )
+        except Exception as e:
+            import traceback
+            print(f"Backup restore error: {str(e)}")
+            print(traceback.format_exc())
+            raise ValueError(f"Backup restore failed: {str(e)}")
 
-                    # Восстанавливаем категории
-                    restored_files += self._restore_categories(
-                        db, backup_data.get("categories", [])
-                    )
+    def _metadata_section(self, backup_data: Dict[str, Any], source: str, section: str) -> Iterable[Dict]:
+        """Записи секции: список из JSON старого формата или потоковое чтение NDJSON"""
+        if backup_data.get("metadata_format") != METADATA_FORMAT:
+            return backup_data.get(section, [])
+        if not backup_data.get("sections", {}).get(section):
+            return []
+        return self._read_metadata_section(source, section)
 
-                    # Восстанавливаем теги
-                    restored_files += self._restore_tags(
-                        db, backup_data.get("tags", [])
-                    )
+    def _section_count(self, backup_data: Dict[str, Any], section: str) -> int:
+        if backup_data.get("metadata_format") != METADATA_FORMAT:
+            return len(backup_data.get(section, []))
+        return backup_data.get("sections", {}).get(section, 0)
 
-                    # Восстанавливаем файлы
-                    restored_files += self._restore_files_sync(
-                        db, backup_data.get("files", []), temp_dir, current_user, backup_type, backup_user_id_to_db_user_id, backup_file_id_to_db_file_id
-                    )
+    def _read_metadata_section(self, archive: _BackupArchive, section: str) -> Iterator[Dict]:
+        with archive.open(section_name(section)) as f:
+            yield from iter_ndjson(iter(lambda: f.read(METADATA_READ_CHUNK_SIZE), b""))
 
-                    # Восстанавливаем связи файлов с коллекциями
-                    self._restore_file_group_links(
-                        db, backup_data.get("file_group_links", []), backup_file_id_to_db_file_id, backup_group_id_to_db_group_id
-                    )
+    def _report_progress(self, force: bool = False, **changes) -> None:
+        """Обновляет сводку и не чаще RESTORE_PROGRESS_INTERVAL передает ее в progress"""
+        self.progress_state.update(changes)
+        if not self.progress:
+            return
+        now = time.monotonic()
+        if not force and now - self._progress_reported < RESTORE_PROGRESS_INTERVAL:
+            return
+        self._progress_reported = now
+        try:
+            self.progress(dict(self.progress_state))
+        except Exception as e:
+            print(f"Warning: Could not report restore progress: {e}")
 
-                    db.commit()
+    def _check_restore_access(self, backup_data: Dict[str, Any], current_user: User) -> str:
+        """Проверяет тип бэкапа и права доступа, возвращает тип"""
+        backup_type = backup_data.get("backup_type", "user")
+        if backup_type == "full" and not current_user.is_admin:
+            raise ValueError("Only administrators can restore full backups")
+        return backup_type
 
-                return {
-                    "message": "Backup restored successfully",
-                    "restored_files": restored_files,
-                    "total_files": len(backup_data.get("files", [])),
-                }
+    def _restore_backup_data(self, backup_data: Dict[str, Any], current_user: User, source) -> Dict[str, Any]:
+        """Восстанавливает записи БД по метаданным; объекты файлов берет _restore_file_objects из source"""
+        backup_type = self._check_restore_access(backup_data, current_user)
 
-        except Exception as e:
-            import traceback
-            print(f"Backup restore error: {str(e)}")
-            print(traceback.format_exc())
-            raise ValueError(f"Backup restore failed: {str(e)}")
+        restored_files = 0
+        self._report_progress(
+            force=True,
+            stage="metadata",
+            files_total=self._section_count(backup_data, "files"),
+            files_processed=0,
+            files_restored=0,
+            files_failed=0,
+        )
+
+        # Восстанавливаем данные
+        with get_db_session() as db:
+            # Создаём маппинг из бэкапа в текущую БД
+            backup_user_id_to_db_user_id = {}
+            backup_file_id_to_db_file_id = {} # Новый маппинг для файлов
+            backup_group_id_to_db_group_id = {} # Новый маппинг для групп
+            # Заполняем из существующих пользователей
+            for (user_id,) in db.query(User.id):
+                backup_user_id_to_db_user_id[str(user_id)] = user_id # Если backup_data содержит ID, сопоставляем с собой
+
+            # Для full backup восстанавливаем пользователей
+            if backup_type == "full":
+                restored_users_backup_data = self._metadata_section(backup_data, source, "users")
+                restored_user_count = self._restore_users(
+                    db, restored_users_backup_data, backup_user_id_to_db_user_id
+                )
+                # _restore_users теперь обновляет маппинг
+            else: # user backup
+                # Для user backup, добавим маппинг для текущего пользователя
+                backup_user_id_to_db_user_id[backup_data.get("user_id", str(current_user.id))] = current_user.id
 
-    def _restore_users(self, db, users_data: List[Dict], backup_user_id_to_db_user_id: Dict[str, uuid.UUID]) -> int:
+            # Восстанавливаем коллекции
+            restored_files += self._restore_groups(
+                db, self._metadata_section(backup_data, source, "groups"), current_user, backup_type, backup_user_id_to_db_user_id, backup_group_id_to_db_group_id
+            )
+
+            # Восстанавливаем участников коллекций
+            if backup_type == "full":
+                self._restore_group_members(
+                    db, self._metadata_section(backup_data, source, "group_members"), backup_user_id_to_db_user_id, backup_group_id_to_db_group_id
+                )
+
+            # Восстанавливаем категории
+            restored_files += self._restore_categories(
+                db, self._metadata_section(backup_data, source, "categories")
+            )
+
+            # Восстанавливаем теги
+            restored_files += self._restore_tags(
+                db, self._metadata_section(backup_data, source, "tags")
+            )
+
+            # Восстанавливаем файлы
+            self._report_progress(force=True, stage="files")
+            restored_files += self._restore_files_sync(
+                db, self._metadata_section(backup_data, source, "files"), source, current_user, backup_type, backup_user_id_to_db_user_id, backup_file_id_to_db_file_id
+            )
+
+            # Восстанавливаем связи файлов с коллекциями
+            self._report_progress(force=True, stage="links")
+            self._restore_file_group_links(
+                db, self._metadata_section(backup_data, source, "file_group_links"), backup_file_id_to_db_file_id, backup_group_id_to_db_group_id
+            )
+
+            db.commit()
+        self._report_progress(force=True, stage="completed")
+
+        return {
+            "message": "Backup restored successfully",
+            "restored_files": restored_files,
+            "total_files": self._section_count(backup_data, "files"),
+        }
+
+    def _restore_users(self, db, users_data: Iterable[Dict], backup_user_id_to_db_user_id: Dict[str, uuid.UUID]) -> int:
         """Восстанавливает пользователей (только для полного бэкапа) и обновляет маппинг"""
         restored_count = 0
-        for user_data in users_data:
-            # Проверяем, существует ли пользователь с таким email или username
-            existing_user = db.query(User).filter(
-                (User.email == user_data["email"]) | 
-                (User.username == user_data["username"])
-            ).first()
-
-            if not existing_user:
-                new_user = User(
-                    id=uuid.UUID(user_data["id"]),
-                    username=user_data["username"],
-                    email=user_data["email"],
-                    password=user_data["password"],  # Хэш пароля
-                    is_active=user_data["is_active"],
-                    is_admin=user_data["is_admin"],
-                    created_at=user_data["created_at"],
-                    updated_at=user_data["updated_at"],
+        for batch in _batches(users_data, RESTORE_LOOKUP_BATCH_SIZE):
+            # Существующие пользователи с такими email или username — одним запросом на пакет
+            existing_users = self._users_by_login(db, batch)
+            new_users = []
+            for user_data in batch:
+                existing_user_id = existing_users.get(user_data["email"]) or existing_users.get(user_data["username"])
+                if existing_user_id:
+                    # Если пользователь существует, всё равно обновляем маппинг: ID из бэкапа -> ID в текущей БД
+                    backup_user_id_to_db_user_id[user_data["id"]] = existing_user_id
+                    continue
+                new_users.append({
+                    "id": uuid.UUID(user_data["id"]),
+                    "username": user_data["username"],
+                    "email": user_data["email"],
+                    "password": user_data["password"],  # Хэш пароля
+                    "is_active": user_data["is_active"],
+                    "is_admin": user_data["is_admin"],
+                    "created_at": user_data["created_at"],
+                    "updated_at": user_data["updated_at"],
+                })
+            inserted_ids = insert_missing(db, User, new_users, returning=User.id)
+            restored_count += len(inserted_ids)
+            # Строки, пропущенные из-за конфликта (дубликат внутри бэкапа), сопоставляем с тем, что оказалось в БД
+            conflicted = [user for user in new_users if str(user["id"]) not in inserted_ids]
+            existing_users = self._users_by_login(db, conflicted)
+            for user in new_users:
+                db_user_id = user["id"] if str(user["id"]) in inserted_ids else (
+                    existing_users.get(user["email"]) or existing_users.get(user["username"])
                 )
-                db.add(new_user)
-                # Обновляем маппинг: ID из бэкапа -> ID в текущей БД (новый UUID)
-                backup_user_id_to_db_user_id[user_data["id"]] = new_user.id
-                restored_count += 1
-            else:
-                # Если пользователь существует, всё равно обновляем маппинг: ID из бэкапа -> ID в текущей БД
-                backup_user_id_to_db_user_id[user_data["id"]] = existing_user.id
+                if db_user_id:
+                    backup_user_id_to_db_user_id[str(user["id"])] = db_user_id
         return restored_count
 
-    def _restore_groups(self, db, groups_data: List[Dict], current_user: User, backup_type: str, backup_user_id_to_db_user_id: Dict[str, uuid.UUID], backup_group_id_to_db_group_id: Dict[str, uuid.UUID]) -> int:
+    def _users_by_login(self, db, users_data: List[Dict]) -> Dict[str, uuid.UUID]:
+        """email и username существующих пользователей -> id"""
+        if not users_data:
+            return {}
+        rows = db.query(User.id, User.email, User.username).filter(
+            User.email.in_([u["email"] for u in users_data]) |
+            User.username.in_([u["username"] for u in users_data])
+        ).all()
+        by_login = {}
+        for user_id, email, username in rows:
+            by_login[email] = user_id
+            by_login[username] = user_id
+        return by_login
+
+    def _restore_groups(self, db, groups_data: Iterable[Dict], current_user: User, backup_type: str, backup_user_id_to_db_user_id: Dict[str, uuid.UUID], backup_group_id_to_db_group_id: Dict[str, uuid.UUID]) -> int:
         """Восстанавливает коллекции (группы)"""
         restored_count = 0
-        for group_data in groups_data:
-            # Проверяем, существует ли коллекция
-            existing_group = db.query(Group).filter(Group.id == group_data["id"]).first()
-            if not existing_group:
-                # Получаем creator_id из бэкапа
-                backup_creator_id_str = group_data["creator_id"]
-                # Используем маппинг, чтобы найти ID в текущей БД
-                db_creator_id = backup_user_id_to_db_user_id.get(backup_creator_id_str)
+        for batch in _batches(groups_data, RESTORE_LOOKUP_BATCH_SIZE):
+            existing_ids = existing_values(db, Group.id, [g["id"] for g in batch])
+            # Создателей, которых нет в маппинге, проверяем напрямую в БД (на всякий случай) — одним запросом
+            unmapped_creators = {
+                g["creator_id"] for g in batch
+                if g["id"] not in existing_ids and g["creator_id"] not in backup_user_id_to_db_user_id
+            }
+            for creator_id in existing_values(db, User.id, unmapped_creators):
+                backup_user_id_to_db_user_id[creator_id] = uuid.UUID(creator_id)
 
+            new_groups = []
+            for group_data in batch:
+                if group_data["id"] in existing_ids:
+                    # Если группа уже существует, всё равно обновляем маппинг: ID из бэкапа -> ID в текущей БД
+                    backup_group_id_to_db_group_id[group_data["id"]] = uuid.UUID(group_data["id"])
+                    continue
+                # Используем маппинг, чтобы найти ID создателя в текущей БД
+                db_creator_id = backup_user_id_to_db_user_id.get(group_data["creator_id"])
                 if not db_creator_id:
-                    # Если не найден в маппинге, проверим, существует ли пользователь с этим ID напрямую в БД (на всякий случай)
-                    direct_user_check = db.query(User).filter(User.id == uuid.UUID(backup_creator_id_str)).first()
-                    if direct_user_check:
-                        # Если нашли, добавим в маппинг и используем
-                        backup_user_id_to_db_user_id[backup_creator_id_str] = direct_user_check.id
-                        db_creator_id = direct_user_check.id
-                    else:
-                        print(f"Warning: Creator {backup_creator_id_str} for group {group_data['id']} does not exist in backup mapping or DB. Skipping group.")
-                        continue
-
-                # Создаём новую группу
-                new_group = Group(
-                    id=uuid.UUID(group_data["id"]),
-                    name=group_data["name"],
-                    description=group_data["description"],
-                    creator_id=db_creator_id, # Используем ID из текущей БД
+                    print(f"Warning: Creator {group_data['creator_id']} for group {group_data['id']} does not exist in backup mapping or DB. Skipping group.")
+                    continue
+                new_groups.append({
+                    "id": uuid.UUID(group_data["id"]),
+                    "name": group_data["name"],
+                    "description": group_data["description"],
+                    "creator_id": db_creator_id, # Используем ID из текущей БД
                     # access_level не используется как поле в модели Group, но сохранено в бэкапе
-                    # его можно восстановить, если потребуется, но сейчас игнорируем
-                    # access_level=group_data.get("access_level", "reader"),
-                )
-                db.add(new_group)
-                # Обновляем маппинг: ID группы из бэкапа -> ID новой группы в БД
-                backup_group_id_to_db_group_id[group_data["id"]] = new_group.id
-                restored_count += 1
-            else:
-                # Если группа уже существует, всё равно обновляем маппинг: ID из бэкапа -> ID в текущей БД
-                backup_group_id_to_db_group_id[group_data["id"]] = existing_group.id
+                })
+                # Группа создается с ID из бэкапа; при конфликте по id она уже есть в БД под тем же ID
+                backup_group_id_to_db_group_id[group_data["id"]] = uuid.UUID(group_data["id"])
+            restored_count += len(insert_missing(db, Group, new_groups, returning=Group.id))
         return restored_count
 
-    def _restore_group_members(self, db, members_data: List[Dict], backup_user_id_to_db_user_id: Dict[str, uuid.UUID], backup_group_id_to_db_group_id: Dict[str, uuid.UUID]):
+    def _restore_group_members(self, db, members_data: Iterable[Dict], backup_user_id_to_db_user_id: Dict[str, uuid.UUID], backup_group_id_to_db_group_id: Dict[str, uuid.UUID]):
         """Восстанавливает участников коллекций (только для полного бэкапа)"""
-        for member_data in members_data:
-            # Проверяем, существует ли связь
-            existing_member = db.query(GroupMember).filter(
-                GroupMember.user_id == member_data["user_id"],
-                GroupMember.group_id == member_data["group_id"]
-            ).first()
-            if not existing_member:
-                # Получаем user_id и group_id из бэкапа
-                backup_user_id_str = member_data["user_id"]
-                backup_group_id_str = member_data["group_id"]
-                # Используем маппинг, чтобы найти ID в текущей БД
-                db_user_id = backup_user_id_to_db_user_id.get(backup_user_id_str)
-                # Используем маппинг для группы
-                db_group_id = backup_group_id_to_db_group_id.get(backup_group_id_str)
-
+        # Маппинги содержат только пользователей и группы, которые есть в БД, поэтому отдельные проверки
+        # существования не нужны; уже существующие участники пропускаются по первичному ключу
+        for batch in _batches(members_data, RESTORE_LOOKUP_BATCH_SIZE):
+            new_members = []
+            for member_data in batch:
+                db_user_id = backup_user_id_to_db_user_id.get(member_data["user_id"])
+                db_group_id = backup_group_id_to_db_group_id.get(member_data["group_id"])
                 if not db_user_id:
-                    print(f"Warning: User {backup_user_id_str} for group member does not exist in backup mapping. Skipping member.")
+                    print(f"Warning: User {member_data['user_id']} for group member does not exist in backup mapping. Skipping member.")
                     continue
                 if not db_group_id:
-                    print(f"Warning: Group {backup_group_id_str} for group member does not exist in backup mapping. Skipping member.")
+                    print(f"Warning: Group {member_data['group_id']} for group member does not exist in backup mapping. Skipping member.")
                     continue
+                new_members.append({
+                    "user_id": db_user_id,
+                    "group_id": db_group_id,
+                    "role": member_data["role"],
+                    "invited_by": uuid.UUID(member_data["invited_by"]) if member_data.get("invited_by") else None,
+                    "invited_at": member_data["invited_at"],
+                    "accepted_at": member_data["accepted_at"],
+                    "revoked_at": member_data["revoked_at"],
+                })
+            insert_missing(db, GroupMember, new_members)
 
-                # Проверяем, существуют ли пользователь и группа в БД
-                user_exists = db.query(User).filter(User.id == db_user_id).first() is not None
-                group_exists = db.query(Group).filter(Group.id == db_group_id).first() is not None
-                if user_exists and group_exists:
-                    new_member = GroupMember(
-                        user_id=db_user_id,
-                        group_id=db_group_id,
-                        role=member_data["role"],
-                        invited_by=uuid.UUID(member_data["invited_by"]) if member_data.get("invited_by") else None,
-                        invited_at=member_data["invited_at"],
-                        accepted_at=member_data["accepted_at"],
-                        revoked_at=member_data["revoked_at"],
-                    )
-                    db.add(new_member)
-
-    def _restore_categories(self, db, categories_data: List[Dict]) -> int:
+    def _restore_categories(self, db, categories_data: Iterable[Dict]) -> int:
         """Восстанавливает категории"""
         restored_count = 0
-        for category_data in categories_data:
-            # Проверяем по ID
-            existing_category = (
-                db.query(Category)
-                .filter(Category.id == category_data["id"])
-                .first()
-            )
-            
-            # Если не найдено по ID, проверяем по имени
-            if not existing_category:
-                existing_category = (
-                    db.query(Category)
-                    .filter(Category.name == category_data["name"])
-                    .first()
-                )
-
-            if not existing_category:
-                new_category = Category(
-                    id=uuid.UUID(category_data["id"]),
-                    name=category_data["name"],
-                    slug=category_data["slug"],
-                    description=category_data.get("description"),
-                    created_at=category_data["created_at"],
-                )
-                db.add(new_category)
-                restored_count += 1
+        for batch in _batches(categories_data, RESTORE_LOOKUP_BATCH_SIZE):
+            # Категория считается существующей, если совпадает ID или имя
+            existing_ids = existing_values(db, Category.id, [c["id"] for c in batch])
+            existing_names = existing_values(db, Category.name, [c["name"] for c in batch])
+            new_categories = [
+                {
+                    "id": uuid.UUID(category_data["id"]),
+                    "name": category_data["name"],
+                    "slug": category_data["slug"],
+                    "description": category_data.get("description"),
+                    "created_at": category_data["created_at"],
+                }
+                for category_data in batch
+                if category_data["id"] not in existing_ids and category_data["name"] not in existing_names
+            ]
+            restored_count += len(insert_missing(db, Category, new_categories, returning=Category.id))
         return restored_count
 
-    def _restore_tags(self, db, tags_data: List[Dict]) -> int:
+    def _restore_tags(self, db, tags_data: Iterable[Dict]) -> int:
         """Восстанавливает теги"""
         restored_count = 0
-        for tag_data in tags_data:
-            # Проверяем по ID
-            existing_tag = db.query(Tag).filter(Tag.id == tag_data["id"]).first()
-            
-            # Если не найдено по ID, проверяем по имени
-            if not existing_tag:
-                existing_tag = db.query(Tag).filter(Tag.name == tag_data["name"]).first()
-
-            if not existing_tag:
-                new_tag = Tag(
-                    id=uuid.UUID(tag_data["id"]),
-                    name=tag_data["name"],
-                    slug=tag_data["slug"],
-                    created_at=tag_data["created_at"],
-                    updated_at=tag_data["updated_at"],
-                )
-                db.add(new_tag)
-                restored_count += 1
+        for batch in _batches(tags_data, RESTORE_LOOKUP_BATCH_SIZE):
+            # Тег считается существующим, если совпадает ID или имя
+            existing_ids = existing_values(db, Tag.id, [t["id"] for t in batch])
+            existing_names = existing_values(db, Tag.name, [t["name"] for t in batch])
+            new_tags = [
+                {
+                    "id": uuid.UUID(tag_data["id"]),
+                    "name": tag_data["name"],
+                    "slug": tag_data["slug"],
+                    "created_at": tag_data["created_at"],
+                    "updated_at": tag_data["updated_at"],
+                }
+                for tag_data in batch
+                if tag_data["id"] not in existing_ids and tag_data["name"] not in existing_names
+            ]
+            restored_count += len(insert_missing(db, Tag, new_tags, returning=Tag.id))
         return restored_count
 
     def _restore_files_sync(
-        self, db, files_data: List[Dict], temp_dir: str, current_user: User, backup_type: str, backup_user_id_to_db_user_id: Dict[str, uuid.UUID], backup_file_id_to_db_file_id: Dict[str, uuid.UUID]
+        self, db, files_data: Iterable[Dict], source, current_user: User, backup_type: str, backup_user_id_to_db_user_id: Dict[str, uuid.UUID], backup_file_id_to_db_file_id: Dict[str, uuid.UUID]
     ) -> int:
-        """Восстанавливает файлы"""
+        """
+        Восстанавливает файлы: объекты загружаются пулом BACKUP_RESTORE_WORKERS (порядок записей сохраняется),
+        строки БД вставляются пакетами по BACKUP_RESTORE_DB_BATCH_SIZE
+        """
         restored_count = 0
-        for file_data in files_data:
-            try:
-                # Проверяем, существует ли файл
-                existing_file = (
-                    db.query(DBFile).filter(DBFile.id == file_data["id"]).first()
-                )
+        pending_rows: List[Dict[str, Any]] = []
+        pending_refs: Dict[str, Dict[str, Any]] = {}  # id файла -> ссылки на общие объекты, которые нужны его строке
 
-                if not existing_file:
-                    # Для пользовательского бэкапа проверяем права доступа через username
-                    owner_username = file_data.get("owner_username", current_user.username)
-                    
-                    # Определяем владельца файла
-                    if backup_type == "user":
-                        # Для пользовательского бэкапа все файлы принадлежат текущему пользователю
-                        # Используем маппинг, но если owner_id из бэкапа - это current_user.id, то db_owner_id = current_user.id
-                        backup_owner_id_str = file_data["owner_id"]
-                        if backup_owner_id_str == str(current_user.id):
-                             db_owner_id = current_user.id
-                        else:
-                            # Если файл в user backup принадлежит не текущему пользователю, это ошибка
-                            print(f"Warning (User Backup): File {file_data.get('id', 'unknown')} owner mismatch. Skipping.")
-                            continue
-                    else: # backup_type == "full"
-                        # Для полного бэкапа ищем пользователя по backup_user_id_to_db_user_id
-                        backup_owner_id_str = file_data["owner_id"]
-                        db_owner_id = backup_user_id_to_db_user_id.get(backup_owner_id_str)
-                        if not db_owner_id:
-                            # Если пользователь не найден, пропускаем файл
-                            print(f"Warning (Full Backup): Owner {backup_owner_id_str} for file {file_data.get('id', 'unknown')} does not exist in backup mapping. Skipping file.")
-                            continue
-                    
-                    # Ищем файл в распакованном архиве и восстанавливаем его
-                    file_restored = self._restore_single_file(
-                        db, file_data, temp_dir, db_owner_id
+        def files_to_restore():
+            for batch in _batches(files_data, RESTORE_LOOKUP_BATCH_SIZE):
+                # Существующие файлы пакета — одним запросом
+                existing_ids = existing_values(db, DBFile.id, [f["id"] for f in batch])
+                batch_restores = []
+                for file_data in batch:
+                    restore = self._file_to_restore(
+                        file_data, existing_ids, current_user, backup_type, backup_user_id_to_db_user_id, backup_file_id_to_db_file_id
                     )
-                    if file_restored:
-                        # Обновляем маппинг: ID файла из бэкапа -> ID нового файла в БД
-                        # Предполагаем, что файл был создан с ID из бэкапа (если он не существовал в БД)
-                        backup_file_id_to_db_file_id[file_data["id"]] = uuid.UUID(file_data["id"])
-                        restored_count += 1
-                else:
-                    # Если файл уже существует, всё равно обновляем маппинг: ID из бэкапа -> ID в текущей БД
-                    backup_file_id_to_db_file_id[file_data["id"]] = existing_file.id
+                    if restore:
+                        batch_restores.append(restore)
+                # Общие объекты файлов пакета (blob, результаты транскодирования) — тоже одним запросом каждые
+                lookups = self._batch_lookups(db, [file_data for file_data, _ in batch_restores])
+                for file_data, db_owner_id in batch_restores:
+                    yield file_data, db_owner_id, lookups
 
+        # Объекты файла ищутся в source и загружаются в S3 параллельно с разбором следующих записей
+        restores = ordered_prefetch(
+            files_to_restore(),
+            lambda item: self._restore_file_objects(item[0], source, item[2]),
+            BACKUP_RESTORE_WORKERS,
+            BACKUP_RESTORE_WORKERS * 2,
+        )
+        for (file_data, db_owner_id, _), paths in restores:
+            try:
+                if isinstance(paths, Exception):
+                    raise paths
+                if paths is None:
+                    self._report_progress(files_failed=self.progress_state.get("files_failed", 0) + 1)
+                    continue
+                pending_refs[file_data["id"]] = {key: paths.pop(key) for key in REFERENCE_KEYS}
+                pending_rows.append(self._file_row(file_data, db_owner_id, **paths))
+                # Обновляем маппинг: ID файла из бэкапа -> ID нового файла в БД
+                # Файл создается с ID из бэкапа (при конфликте по id он уже есть в БД под тем же ID)
+                backup_file_id_to_db_file_id[file_data["id"]] = uuid.UUID(file_data["id"])
             except Exception as e:
+                self._report_progress(files_failed=self.progress_state.get("files_failed", 0) + 1)
                 print(
                     f"Warning: Could not restore file {file_data.get('id', 'unknown')}: {str(e)}"
                 )
+            if len(pending_rows) >= BACKUP_RESTORE_DB_BATCH_SIZE:
+                restored_count += self._insert_file_rows(db, pending_rows, pending_refs)
+        restored_count += self._insert_file_rows(db, pending_rows, pending_refs)
         return restored_count
 
-    def _restore_single_file(
-        self, db, file_data: Dict, temp_dir: str, owner_id: uuid.UUID
-    ) -> bool:
-        """Синхронная версия восстановления одного файла"""
-        file_content = None
-        thumbnail_content = None
-        preview_content = None
+    def _file_to_restore(
+        self, file_data: Dict, existing_ids: Set[str], current_user: User, backup_type: str, backup_user_id_to_db_user_id: Dict[str, uuid.UUID], backup_file_id_to_db_file_id: Dict[str, uuid.UUID]
+    ) -> Optional[Tuple[Dict, uuid.UUID]]:
+        """(file_data, id владельца в БД) для файла, которого нет в БД, иначе None"""
+        self._report_progress(files_processed=self.progress_state.get("files_processed", 0) + 1)
+        try:
+            if file_data["id"] in existing_ids:
+                # Если файл уже существует, всё равно обновляем маппинг: ID из бэкапа -> ID в текущей БД
+                backup_file_id_to_db_file_id[file_data["id"]] = uuid.UUID(file_data["id"])
+                return None
+
+            # Определяем владельца файла
+            if backup_type == "user":
+                # Для пользовательского бэкапа все файлы принадлежат текущему пользователю
+                # Используем маппинг, но если owner_id из бэкапа - это current_user.id, то db_owner_id = current_user.id
+                backup_owner_id_str = file_data["owner_id"]
+                if backup_owner_id_str == str(current_user.id):
+                     db_owner_id = current_user.id
+                else:
+                    # Если файл в user backup принадлежит не текущему пользователю, это ошибка
+                    print(f"Warning (User Backup): File {file_data.get('id', 'unknown')} owner mismatch. Skipping.")
+                    return None
+            else: # backup_type == "full"
+                # Для полного бэкапа ищем пользователя по backup_user_id_to_db_user_id
+                backup_owner_id_str = file_data["owner_id"]
+                db_owner_id = backup_user_id_to_db_user_id.get(backup_owner_id_str)
+                if not db_owner_id:
+                    # Если пользователь не найден, пропускаем файл
+                    print(f"Warning (Full Backup): Owner {backup_owner_id_str} for file {file_data.get('id', 'unknown')} does not exist in backup mapping. Skipping file.")
+                    return None
+            return file_data, db_owner_id
+        except Exception as e:
+            print(
+                f"Warning: Could not restore file {file_data.get('id', 'unknown')}: {str(e)}"
+            )
+            return None
+
+    def _batch_lookups(self, db, files: List[Dict]) -> Dict[str, Any]:
+        """
+        Какие blob-оригиналы пакета уже в хранилище и какое содержимое уже транскодировано —
+        по запросу на пакет вместо проверок в _restore_file_objects на каждый файл
+        """
+        sha256s = [f["file_path"][len(BLOB_PREFIX):] for f in files if is_blob_key(f.get("file_path"))]
+        content_hashes = {f["content_hash"] for f in files if f.get("content_hash") and f.get("hls_manifest_path")}
+        return {
+            "blobs_present": existing_values(db, Blob.sha256, sha256s),
+            "shared_assets": find_transcoded_assets(db, content_hashes),
+        }
+
+    def _insert_file_rows(self, db, rows: List[Dict[str, Any]], refs: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Вставляет накопленные строки файлов одним INSERT ... ON CONFLICT DO NOTHING, возвращает число вставленных.
+        Ссылки на blob и общие результаты транскодирования берутся только для вставленных строк и в той же
+        транзакции: пропущенная по конфликту строка или откат восстановления не оставляют лишних ссылок
+        """
+        inserted_ids = insert_missing(db, DBFile, rows, returning=DBFile.id)
+        for row in rows:
+            if str(row["id"]) in inserted_ids:
+                self._add_references(db, row, refs[str(row["id"])])
+        rows.clear()
+        refs.clear()
+        if inserted_ids:
+            self._report_progress(files_restored=self.progress_state.get("files_restored", 0) + len(inserted_ids))
+        return len(inserted_ids)
+
+    def _add_references(self, db, row: Dict[str, Any], refs: Dict[str, Any]) -> None:
+        """Ссылки вставленного файла на общие объекты (blob, результат транскодирования)"""
+        blob = refs.get("blob")
+        if blob and add_blob_reference(db, blob["sha256"], row["file_path"], row["size"]) and blob["restore"]:
+            # Blob был в хранилище при проверке, но его успели удалить до захвата ссылки
+            blob["restore"]()
+        if refs.get("shared_asset"):
+            if not add_transcoded_asset_reference(db, row["content_hash"], refs["shared_asset"]):
+                # Общий результат удален после проверки — файл остается без транскодированных версий
+                db.query(DBFile).filter(DBFile.id == row["id"]).update(
+                    {"hls_manifest_path": None, "dash_manifest_path": None}, synchronize_session=False
+                )
+        elif refs.get("register_asset") and row["content_hash"] and row["hls_manifest_path"]:
+            base_path = transcoded_base_path(row["hls_manifest_path"])
+            # Дедуплицированные файлы снимка ссылаются на одну директорию: результат регистрирует
+            # первый из них, остальные только добавляют ссылку (повторная регистрация счетчик не меняет)
+            if not add_transcoded_asset_reference(db, row["content_hash"], base_path):
+                # Восстановленный результат становится общим для будущих дубликатов
+                add_transcoded_asset(
+                    db,
+                    row["content_hash"],
+                    base_path,
+                    row["hls_manifest_path"],
+                    row["dash_manifest_path"],
+                    row["duration"],
+                )
+
+    def _restore_file_objects(
+        self, file_data: Dict, archive: _BackupArchive, lookups: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Загружает объекты одного файла потоком из записей архива (вызывается из пула потоков, без сессии БД).
+        lookups — результат _batch_lookups для пакета файла.
+        Возвращает пути для _file_row или None, если основной файл не восстановлен.
+        """
         # Ищем основной файл
-        possible_file_paths = [
-            os.path.join(
-                temp_dir,
-                "files",
-                f"{file_data['id']}_{file_data['original_name']}",
-            ),
-            os.path.join(
-                temp_dir,
-                f"files/{file_data['id']}_{file_data['original_name']}",
-            ),
-            os.path.join(temp_dir, file_data["original_name"]),
+        possible_file_names = [
+            f"files/{file_data['id']}_{file_data['original_name']}",
+            file_data["original_name"],
         ]
-        for path in possible_file_paths:
-            if os.path.exists(path):
-                with open(path, "rb") as f:
-                    file_content = f.read()
-                break
-        # Ищем thumbnail
-        if file_data.get("thumbnail_path"):
-            possible_thumb_paths = [
-                os.path.join(
-                    temp_dir,
-                    "thumbnails",
-                    f"{file_data['id']}_thumbnail.jpg",
-                ),
-                os.path.join(
-                    temp_dir,
-                    f"thumbnails/{file_data['id']}_thumbnail.jpg",
-                ),
-            ]
-            for path in possible_thumb_paths:
-                if os.path.exists(path):
-                    with open(path, "rb") as f:
-                        thumbnail_content = f.read()
-                    break
-        # Ищем preview
-        if file_data.get("preview_path"):
-            possible_preview_paths = [
-                os.path.join(
-                    temp_dir,
-                    "previews",
-                    f"{file_data['id']}_preview.jpg",
-                ),
-                os.path.join(
-                    temp_dir,
-                    f"previews/{file_data['id']}_preview.jpg",
-                ),
-            ]
-            for path in possible_preview_paths:
-                if os.path.exists(path):
-                    with open(path, "rb") as f:
-                        preview_content = f.read()
-                    break
+        if is_blob_key(file_data.get("file_path")):
+            # Общий оригинал хранится в архиве один раз под своим ключом
+            possible_file_names.insert(0, file_data["file_path"])
+        file_member = next((name for name in possible_file_names if name in archive), None)
+        # Ищем thumbnail и preview
+        thumbnail_member = f"thumbnails/{file_data['id']}_thumbnail.jpg"
+        preview_member = f"previews/{file_data['id']}_preview.jpg"
 
         # Загружаем файлы в S3 если они найдены
         file_uploaded = False
@@ -447,159 +698,337 @@ class BackupService:
         hls_manifest_path_restored = file_data.get("hls_manifest_path") # Изначально предполагаем путь из бэкапа
         dash_manifest_path_restored = file_data.get("dash_manifest_path")
 
-        if file_content:
+        blob = None
+        if file_member and is_blob_key(file_data["file_path"]):
             try:
-                s3_client.put_object(
-                    Bucket=settings.AWS_S3_BUCKET_NAME,
-                    Key=file_data["file_path"],
-                    Body=file_content,
+                sha256 = file_data["file_path"][len(BLOB_PREFIX):]
+                upload_blob = functools.partial(
+                    self._upload_member, archive, file_member, file_data["file_path"], file_data.get("mime_type")
                 )
+                blob_present = sha256 in lookups["blobs_present"]
+                if not blob_present:
+                    upload_blob()
+                # Ссылка берется при вставке строки (_insert_file_rows)
+                blob = {"sha256": sha256, "restore": upload_blob if blob_present else None}
+                file_uploaded = True
+            except Exception as e:
+                print(f"Failed to restore blob {file_data['file_path']}: {str(e)}")
+        elif file_member:
+            try:
+                self._upload_member(archive, file_member, file_data["file_path"], file_data.get("mime_type"))
                 file_uploaded = True
             except Exception as e:
                 print(f"Failed to upload file to S3: {str(e)}")
-        if thumbnail_content and file_data.get("thumbnail_path"):
+        if thumbnail_member in archive and file_data.get("thumbnail_path"):
             try:
-                s3_client.put_object(
-                    Bucket=settings.AWS_S3_BUCKET_NAME,
-                    Key=file_data["thumbnail_path"],
-                    Body=thumbnail_content,
-                )
+                self._upload_member(archive, thumbnail_member, file_data["thumbnail_path"])
                 thumbnail_uploaded = True
             except Exception as e:
                 print(f"Failed to upload thumbnail to S3: {str(e)}")
-        if preview_content and file_data.get("preview_path"):
+        if preview_member in archive and file_data.get("preview_path"):
             try:
-                s3_client.put_object(
-                    Bucket=settings.AWS_S3_BUCKET_NAME,
-                    Key=file_data["preview_path"],
-                    Body=preview_content,
-                )
+                self._upload_member(archive, preview_member, file_data["preview_path"])
                 preview_uploaded = True
             except Exception as e:
                 print(f"Failed to upload preview to S3: {str(e)}")
 
-        # Проверяем, есть ли папка с транскодированными файлами в распакованном архиве
-        hls_source_dir = os.path.join(temp_dir, "transcoded", file_data['id'], "hls")
-        if os.path.exists(hls_source_dir):
+        # Такое же содержимое уже транскодировано в текущей системе — ссылаемся на общий результат
+        # вместо повторной загрузки сегментов из архива
+        shared_asset = None
+        if file_uploaded and file_data.get("content_hash") and file_data.get("hls_manifest_path"):
+            shared_asset = lookups["shared_assets"].get(file_data["content_hash"])
+        if shared_asset:
+            transcoded_uploaded = True
+            hls_manifest_path_restored = shared_asset.hls_manifest_path
+            dash_manifest_path_restored = shared_asset.dash_manifest_path
+
+        # Записи архива с транскодированными файлами лежат под transcoded/<id>/ — те же пути, что и в S3
+        base_s3_path = f"transcoded/{file_data['id']}"
+
+        hls_members = archive.names_under(f"{base_s3_path}/hls/")
+        if not shared_asset and hls_members:
             try:
-                # Определяем базовый путь в S3 для транскодированных файлов (как в transcode_service.py)
-                base_s3_path = f"transcoded/{file_data['id']}"
                 s3_hls_path = f"{base_s3_path}/hls"
 
                 # Загружаем мастер-плейлист
-                master_playlist_local = os.path.join(hls_source_dir, "master.m3u8")
-                if os.path.exists(master_playlist_local):
-                    s3_key_master = f"{s3_hls_path}/master.m3u8"
-                    s3_client.upload_file(master_playlist_local, settings.AWS_S3_BUCKET_NAME, s3_key_master)
+                s3_key_master = f"{s3_hls_path}/master.m3u8"
+                if s3_key_master in archive:
+                    self._upload_member(archive, s3_key_master, s3_key_master)
 
                 # Загружаем все рендитции
-                for item in os.listdir(hls_source_dir):
-                    item_path = os.path.join(hls_source_dir, item)
-                    if os.path.isdir(item_path) and item.startswith("stream_"):
-                        # print(f"Uploading rendition directory {item} to S3") # Для логгирования
-                        for filename in os.listdir(item_path):
-                            local_file_path = os.path.join(item_path, filename)
-                            if os.path.isfile(local_file_path):
-                                s3_key = f"{s3_hls_path}/{item}/{filename}"
-                                s3_client.upload_file(local_file_path, settings.AWS_S3_BUCKET_NAME, s3_key)
+                renditions = []
+                for name in hls_members:
+                    relative = name[len(s3_hls_path) + 1:].split("/")
+                    if len(relative) == 2 and relative[0].startswith("stream_"):
+                        renditions.append(name)
+                self._upload_members(archive, renditions)
 
                 transcoded_uploaded = True
                 # Обновляем путь к манифесту, если он был восстановлен
                 # (В принципе, путь должен быть такой же, как в file_data, но перезапишем на всякий случай)
-                hls_manifest_path_restored = f"{base_s3_path}/hls/master.m3u8"
-                # print(f"Restored HLS manifest path: {hls_manifest_path_restored}") # Для логгирования
+                hls_manifest_path_restored = s3_key_master
 
             except Exception as e:
                 print(f"Warning: Could not restore transcoded files for {file_data.get('id', 'unknown')}: {str(e)}")
                 # Не прерываем восстановление основного файла из-за ошибки транскодирования
 
-        # Проверяем, есть ли папка с DASH файлами в распакованном архиве
-        dash_source_dir = os.path.join(temp_dir, "transcoded", file_data['id'], "dash")
-        if os.path.exists(dash_source_dir):
+        # CMAF: fMP4-сегменты и оба манифеста (master.m3u8 и manifest.mpd) в одной папке
+        s3_cmaf_path = f"{base_s3_path}/cmaf"
+        cmaf_members = [name for name in archive.names_under(f"{s3_cmaf_path}/") if "/" not in name[len(s3_cmaf_path) + 1:]]
+        if not shared_asset and cmaf_members:
             try:
-                base_s3_path = f"transcoded/{file_data['id']}"
-                s3_dash_path = f"{base_s3_path}/dash"
+                # Манифесты загружаем последними, чтобы они не ссылались на отсутствующие сегменты
+                manifests = [name for name in cmaf_members if name.rsplit("/", 1)[-1] in ("master.m3u8", "manifest.mpd")]
+                self._upload_members(archive, [name for name in cmaf_members if name not in manifests])
+                self._upload_members(archive, manifests)
 
-                for filename in os.listdir(dash_source_dir):
-                    local_file_path = os.path.join(dash_source_dir, filename)
-                    if os.path.isfile(local_file_path):
-                        s3_key = f"{s3_dash_path}/{filename}"
-                        s3_client.upload_file(local_file_path, settings.AWS_S3_BUCKET_NAME, s3_key)
+                transcoded_uploaded = True
+                hls_manifest_path_restored = f"{s3_cmaf_path}/master.m3u8"
+                if f"{s3_cmaf_path}/manifest.mpd" in archive:
+                    dash_manifest_path_restored = f"{s3_cmaf_path}/manifest.mpd"
+
+            except Exception as e:
+                print(f"Warning: Could not restore CMAF files for {file_data.get('id', 'unknown')}: {str(e)}")
+
+        # Проверяем, есть ли в архиве DASH файлы
+        s3_dash_path = f"{base_s3_path}/dash"
+        dash_members = [name for name in archive.names_under(f"{s3_dash_path}/") if "/" not in name[len(s3_dash_path) + 1:]]
+        if not shared_asset and dash_members:
+            try:
+                self._upload_members(archive, dash_members)
 
                 transcoded_uploaded = True
-                dash_manifest_path_restored = f"{base_s3_path}/dash/manifest.mpd"
+                dash_manifest_path_restored = f"{s3_dash_path}/manifest.mpd"
 
             except Exception as e:
                 print(f"Warning: Could not restore DASH files for {file_data.get('id', 'unknown')}: {str(e)}")
 
-        # Создаем запись в БД только если основной файл успешно загружен
-        if file_uploaded:
-            # Обрабатываем category_id
-            category_id = None
-            if file_data.get("category_id"):
-                try:
-                    category_id = uuid.UUID(file_data["category_id"])
-                except (ValueError, TypeError):
-                    category_id = None
-            new_file = DBFile(
-                id=uuid.UUID(file_data["id"]), # Используем ID из бэкапа
-                original_name=file_data["original_name"],
-                mime_type=file_data["mime_type"],
-                file_path=file_data["file_path"],
-                size=file_data["size"],
-                thumbnail_path=file_data.get("thumbnail_path")
-                if thumbnail_uploaded
-                else None,
-                preview_path=file_data.get("preview_path")
-                if preview_uploaded
-                else None,
-                hls_manifest_path=hls_manifest_path_restored if transcoded_uploaded else None,
-                dash_manifest_path=dash_manifest_path_restored if transcoded_uploaded else None,
-                transcoding_status=file_data.get("transcoding_status") or "not_started",
-                duration=file_data.get("duration") or None,
-                description=file_data.get("description"),
-                tags=file_data["tags"], # Оставляем теги как список строк, как они были в бэкапе
-                category_id=category_id,
-                owner_id=owner_id,  # Используем правильный owner_id (uuid.UUID)
-                created_at=file_data["created_at"],
-                updated_at=file_data["updated_at"],
-            )
-            db.add(new_file)
-            # db.commit() не вызываем здесь, так как это делается в restore_backup
-            return True
+        # Запись в БД создается только если основной файл успешно загружен
+        if not file_uploaded:
+            return None
+        return {
+            "thumbnail_path": file_data.get("thumbnail_path") if thumbnail_uploaded else None,
+            "preview_path": file_data.get("preview_path") if preview_uploaded else None,
+            "hls_manifest_path": hls_manifest_path_restored if transcoded_uploaded else None,
+            "dash_manifest_path": dash_manifest_path_restored if transcoded_uploaded else None,
+            "blob": blob,
+            "shared_asset": shared_asset.base_path if shared_asset else None,
+            "register_asset": transcoded_uploaded and not shared_asset,
+        }
 
-        return False
+    def _upload_member(self, archive: _BackupArchive, name: str, s3_key: str, content_type: str = None) -> None:
+        """Загружает запись архива в S3 потоком; память — несколько частей multipart, а не размер объекта"""
+        upload_stream_with_retry(lambda: archive.open(name), s3_key, content_type)
 
-    def _restore_file_group_links(self, db, links_data: List[Dict], backup_file_id_to_db_file_id: Dict[str, uuid.UUID], backup_group_id_to_db_group_id: Dict[str, uuid.UUID]):
+    def _upload_members(self, archive: _BackupArchive, names: List[str]) -> None:
+        """Загружает записи архива на ключи с теми же именами через общий пул; ошибка любой записи поднимается после всех"""
+        futures = [self._upload_pool.submit(self._upload_member, archive, name, name) for name in names]
+        concurrent.futures.wait(futures)
+        for future in futures:
+            future.result()
+
+    def _file_row(
+        self,
+        file_data: Dict,
+        owner_id: uuid.UUID,
+        thumbnail_path: str = None,
+        preview_path: str = None,
+        hls_manifest_path: str = None,
+        dash_manifest_path: str = None,
+    ) -> Dict[str, Any]:
+        """Строка восстановленного файла для вставки; пути — только для объектов, которые удалось восстановить"""
+        # Обрабатываем category_id
+        category_id = None
+        if file_data.get("category_id"):
+            try:
+                category_id = uuid.UUID(file_data["category_id"])
+            except (ValueError, TypeError):
+                category_id = None
+        # Вставка — пакетом в _insert_file_rows, db.commit() делается в _restore_backup_data
+        return dict(
+            id=uuid.UUID(file_data["id"]), # Используем ID из бэкапа
+            original_name=file_data["original_name"],
+            mime_type=file_data["mime_type"],
+            file_path=file_data["file_path"],
+            size=file_data["size"],
+            thumbnail_path=thumbnail_path,
+            preview_path=preview_path,
+            hls_manifest_path=hls_manifest_path,
+            dash_manifest_path=dash_manifest_path,
+            transcoding_status=file_data.get("transcoding_status") or "not_started",
+            duration=file_data.get("duration") or None,
+            content_hash=file_data.get("content_hash"),
+            description=file_data.get("description"),
+            tags=file_data["tags"], # Оставляем теги как список строк, как они были в бэкапе
+            category_id=category_id,
+            owner_id=owner_id,  # Используем правильный owner_id (uuid.UUID)
+            created_at=file_data["created_at"],
+            updated_at=file_data["updated_at"],
+        )
+
+    def _restore_file_group_links(self, db, links_data: Iterable[Dict], backup_file_id_to_db_file_id: Dict[str, uuid.UUID], backup_group_id_to_db_group_id: Dict[str, uuid.UUID]):
         """Восстанавливает связи файлов с коллекциями"""
-        for link_data in links_data:
-            backup_file_id_str = link_data["file_id"]
-            backup_group_id_str = link_data["group_id"]
+        # Маппинги содержат только файлы и коллекции, которые есть в БД; существующие связи пропускаются по первичному ключу
+        for batch in _batches(links_data, RESTORE_LOOKUP_BATCH_SIZE):
+            new_links = []
+            for link_data in batch:
+                backup_file_id_str = link_data["file_id"]
+                backup_group_id_str = link_data["group_id"]
 
-            # Используем маппинги для получения ID в текущей БД
-            db_file_id = backup_file_id_to_db_file_id.get(backup_file_id_str)
-            db_group_id = backup_group_id_to_db_group_id.get(backup_group_id_str)
+                # Используем маппинги для получения ID в текущей БД
+                db_file_id = backup_file_id_to_db_file_id.get(backup_file_id_str)
+                db_group_id = backup_group_id_to_db_group_id.get(backup_group_id_str)
 
-            if not db_file_id or not db_group_id:
-                # Если ID не найдены в маппингах, значит файл или группа не были восстановлены
-                print(f"Warning: File {backup_file_id_str} or Group {backup_group_id_str} does not exist in backup mapping. Skipping link.")
-                continue
+                if not db_file_id or not db_group_id:
+                    # Если ID не найдены в маппингах, значит файл или группа не были восстановлены
+                    print(f"Warning: File {backup_file_id_str} or Group {backup_group_id_str} does not exist in backup mapping. Skipping link.")
+                    continue
+                new_links.append({"file_id": db_file_id, "group_id": db_group_id})
+            insert_missing(db, file_group, new_links)
+
+
+class SnapshotRestoreService(BackupService):
+    """
+    Восстановление из снимка объектов: объекты копируются обратно на стороне S3,
+    без скачивания в воркер; записи БД создаются той же логикой, что и для ZIP.
+    """
+
+    def restore_snapshot(self, snapshot_prefix: str, user_id: str) -> Dict[str, Any]:
+        try:
+            with get_db_session() as db:
+                current_user = db.query(User).filter(User.id == user_id).first()
+                if not current_user:
+                    raise ValueError("User not found")
+
+            try:
+                response = s3_client.get_object(
+                    Bucket=settings.AWS_S3_BUCKET_NAME, Key=f"{snapshot_prefix}{SNAPSHOT_METADATA_NAME}"
+                )
+                backup_data = json.loads(response["Body"].read())
+            except ClientError as e:
+                raise ValueError(f"Invalid snapshot: {str(e)}")
+            self._check_restore_access(backup_data, current_user)
+
+            self._copy_back_objects(snapshot_prefix, backup_data, current_user)
+            return self._restore_backup_data(backup_data, current_user, snapshot_prefix)
 
-            # Проверяем, существуют ли файл и коллекция в БД с этими новыми ID
-            file_exists = db.query(DBFile).filter(DBFile.id == db_file_id).first() is not None
-            group_exists = db.query(Group).filter(Group.id == db_group_id).first() is not None
+        except Exception as e:
+            import traceback
+            print(f"Snapshot restore error: {str(e)}")
+            print(traceback.format_exc())
+            raise ValueError(f"Snapshot restore failed: {str(e)}")
 
-            if not file_exists or not group_exists:
-                # Если файл или коллекция не существуют, пропускаем связь
-                print(f"Warning: File {db_file_id} (from {backup_file_id_str}) or Group {db_group_id} (from {backup_group_id_str}) does not exist in DB. Skipping link.")
+    def _read_metadata_section(self, snapshot_prefix: str, section: str) -> Iterator[Dict]:
+        yield from iter_ndjson(iter_s3_object(f"{snapshot_prefix}{section_name(section)}"))
+
+    def _iter_snapshot_objects(self, snapshot_prefix: str) -> Iterator[Dict]:
+        """Список объектов снимка; снимки без объектов могли быть записаны без списка — он считается пустым"""
+        try:
+            yield from iter_ndjson(iter_s3_object(f"{snapshot_prefix}{SNAPSHOT_OBJECTS_NAME}"))
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            print(f"Warning: Snapshot {snapshot_prefix} has no object list, no objects to restore")
+
+    def _copy_back_objects(self, snapshot_prefix: str, backup_data: Dict[str, Any], current_user: User) -> None:
+        """Параллельно копирует на исходные ключи объекты файлов, которых нет в текущей БД"""
+        files_data = self._metadata_section(backup_data, snapshot_prefix, "files")
+        if backup_data.get("backup_type", "user") == "user":
+            files_data = (f for f in files_data if f["owner_id"] == str(current_user.id))
+        missing_ids = set()
+        needed_blobs = set()
+        self.shared_assets: Dict[str, Any] = {}  # id файла -> общий результат транскодирования его содержимого
+        for batch in _batches(files_data, RESTORE_LOOKUP_BATCH_SIZE):
+            with get_db_session() as db:
+                existing_ids = existing_values(db, DBFile.id, [f["id"] for f in batch])
+                missing = [f for f in batch if f["id"] not in existing_ids]
+                # Такое же содержимое уже транскодировано — сегменты из снимка не копируются
+                assets = find_transcoded_assets(
+                    db, {f["content_hash"] for f in missing if f.get("content_hash") and f.get("hls_manifest_path")}
+                )
+            for f in missing:
+                missing_ids.add(f["id"])
+                if is_blob_key(f.get("file_path")):
+                    needed_blobs.add(f["file_path"])
+                if f.get("hls_manifest_path") and f.get("content_hash") in assets:
+                    self.shared_assets[f["id"]] = assets[f["content_hash"]]
+
+        self.copied: Dict[str, set] = {}  # id файла -> виды восстановленных объектов (files, thumbnails, ...)
+        self.failed_transcoded = set()
+        self.blobs_present: Dict[str, bool] = {}  # blob -> был ли в хранилище до восстановления
+
+        def items():
+            # Список объектов снимка читается потоком, копирование идет параллельно чтению
+            for source in self._iter_snapshot_objects(snapshot_prefix):
+                name = source["name"]
+                if is_blob_key(name):
+                    if name in needed_blobs and name not in self.blobs_present:
+                        self.blobs_present[name] = blob_exists(name[len(BLOB_PREFIX):])
+                        if self.blobs_present[name]:
+                            self.blobs_available.add(name)
+                        else:
+                            yield name, source
+                elif member_file_id(name) in missing_ids:
+                    if name.startswith("transcoded/") and member_file_id(name) in self.shared_assets:
+                        continue
+                    yield name, source
+
+        def copy_back(item) -> int:
+            name, source = item
+            return copy_object_server_side(f"{snapshot_prefix}{name}", source["key"], source["size"])
+
+        self.blobs_available = set()
+        copies = ordered_prefetch(items(), copy_back, BACKUP_SNAPSHOT_WORKERS, BACKUP_SNAPSHOT_WORKERS * 4)
+        for (name, source), result in copies:
+            file_id = member_file_id(name)
+            if isinstance(result, Exception):
+                print(f"Warning: Could not restore {source['key']} from snapshot: {str(result)}")
+                if name.startswith("transcoded/"):
+                    self.failed_transcoded.add(file_id)
                 continue
+            if is_blob_key(name):
+                self.blobs_available.add(name)
+            else:
+                self.copied.setdefault(file_id, set()).add(name.split("/", 1)[0])
+
+    def _batch_lookups(self, db, files: List[Dict]) -> None:
+        # Blob-оригиналы и общие результаты проверены до копирования (_copy_back_objects)
+        return None
+
+    def _restore_file_objects(
+        self, file_data: Dict, snapshot_prefix: str, lookups: None = None
+    ) -> Optional[Dict[str, Any]]:
+        """Пути для записи файла, если его оригинал скопирован из снимка (или общий blob уже в хранилище)"""
+        copied = self.copied.get(file_data["id"], set())
+        file_path = file_data["file_path"]
+        blob = None
+        if is_blob_key(file_path):
+            if file_path not in self.blobs_available:
+                return None
+            copy_blob = functools.partial(
+                copy_object_server_side, f"{snapshot_prefix}{file_path}", file_path, file_data["size"]
+            )
+            # Ссылка берется при вставке строки (_insert_file_rows)
+            blob = {"sha256": file_path[len(BLOB_PREFIX):], "restore": copy_blob if self.blobs_present.get(file_path) else None}
+        elif "files" not in copied:
+            return None
 
-            # Проверяем, существует ли уже такая связь
-            existing_link = db.query(file_group).filter(
-                file_group.c.file_id == db_file_id,
-                file_group.c.group_id == db_group_id
-            ).first()
+        hls_manifest_path = file_data.get("hls_manifest_path")
+        dash_manifest_path = file_data.get("dash_manifest_path")
+        transcoded_restored = "transcoded" in copied and file_data["id"] not in self.failed_transcoded
+        # Общий результат найден до копирования (_copy_back_objects) — его сегменты не копировались
+        shared_asset = self.shared_assets.get(file_data["id"])
+        if shared_asset:
+            transcoded_restored = True
+            hls_manifest_path = shared_asset.hls_manifest_path
+            dash_manifest_path = shared_asset.dash_manifest_path
 
-            if not existing_link:
-                # Создаём новую связь
-                db.execute(file_group.insert().values(file_id=db_file_id, group_id=db_group_id))
+        return {
+            "thumbnail_path": file_data.get("thumbnail_path") if "thumbnails" in copied else None,
+            "preview_path": file_data.get("preview_path") if "previews" in copied else None,
+            "hls_manifest_path": hls_manifest_path if transcoded_restored else None,
+            "dash_manifest_path": dash_manifest_path if transcoded_restored else None,
+            "blob": blob,
+            "shared_asset": shared_asset.base_path if shared_asset else None,
+            "register_asset": transcoded_restored and not shared_asset,
+        }
@@ -1,74 +1,101 @@
 import io
 import json
 import os
-import tempfile
+import time
 import uuid
 import zipfile
 from datetime import datetime, timezone
+from typing import Iterator, List, NamedTuple, Optional
 from botocore.exceptions import ClientError
 from app.celery_app import celery_app
 from app.core.config import settings
 from app.core.database import get_db_session, s3_client
-from app.models.base import Category, File as DBFile, Tag, User, Group, GroupMember, file_group # Импортируем таблицу связи
+from app.models.base import User
+from app.services.backup_manifest_service import (
+    MANIFEST_ARCNAME,
+    build_manifest,
+    find_previous_manifest_key,
+    forget_failed_members,
+    load_manifest,
+    manifest_key,
+    manifest_scope,
+    save_manifest,
+)
+from app.services.backup_metadata_service import (
+    METADATA_FORMAT,
+    METADATA_HEADER_NAME,
+    backup_sections,
+    iter_backup_files,
+    iter_section_records,
+    section_name,
+    write_ndjson,
+)
+from app.services.blob_storage_service import is_blob_key
+from app.services.s3_prefetch import ordered_prefetch
+from app.services.s3_transfer_service import copy_object_server_side, iter_s3_object
+from app.services.s3_multipart_writer import (
+    MultipartUploadError,
+    S3MultipartWriter,
+    abort_multipart_state,
+    delete_multipart_state,
+    load_multipart_state,
+    save_multipart_state,
+)
+
+BACKUP_MAX_RETRIES = int(os.getenv("BACKUP_MAX_RETRIES", "3"))
+BACKUP_RETRY_COUNTDOWN = int(os.getenv("BACKUP_RETRY_COUNTDOWN", "60"))  # секунды
+ZIP_COPY_CHUNK_SIZE = 1024 * 1024
+# Предвыборка: пул скачивает следующие объекты, пока текущий пишется в архив
+BACKUP_PREFETCH_WORKERS = int(os.getenv("BACKUP_PREFETCH_WORKERS", "8"))
+BACKUP_PREFETCH_WINDOW = int(os.getenv("BACKUP_PREFETCH_WINDOW", "16"))  # объектов впереди записи
+# Крупные объекты не скачиваются заранее, а копируются потоком: память не больше WINDOW * MAX_OBJECT_BYTES
+BACKUP_PREFETCH_MAX_OBJECT_BYTES = int(os.getenv("BACKUP_PREFETCH_MAX_OBJECT_BYTES", str(8 * 1024 * 1024)))
+# Снимок объектов: параллельные запросы серверного копирования
+BACKUP_SNAPSHOT_WORKERS = int(os.getenv("BACKUP_SNAPSHOT_WORKERS", "16"))
+SNAPSHOT_METADATA_NAME = METADATA_HEADER_NAME
+SNAPSHOT_OBJECTS_NAME = "snapshot_objects.ndjson"  # имя в снимке, исходный ключ S3 и размер по строке
+# Сжатие метаданных и текстовых манифестов: "deflate" или "zstd" (zstd в ZIP читает Python 3.14+)
+BACKUP_METADATA_COMPRESSION = os.getenv("BACKUP_METADATA_COMPRESSION", "deflate")
+BACKUP_COMPRESSION_LEVEL = int(os.getenv("BACKUP_COMPRESSION_LEVEL", "6"))
+# Медиа и уже сжатые форматы пишутся как есть (ZIP_STORED): DEFLATE тратит CPU почти без выигрыша
+STORED_MIME_PREFIXES = ("image/", "video/", "audio/")
+COMPRESSIBLE_MEDIA_TYPES = frozenset({"image/svg+xml", "image/bmp", "image/x-ms-bmp", "image/tiff", "audio/wav", "audio/x-wav"})
+STORED_EXTENSIONS = frozenset({
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp4", ".m4v", ".m4s", ".m4a", ".mov", ".mkv", ".webm", ".ts", ".mp3", ".aac", ".ogg", ".opus", ".flac",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".pdf", ".docx", ".xlsx", ".pptx",
+})
 
 
 @celery_app.task(bind=True)
-def create_backup_task(self, user_id: str, backup_type: str = "user"):
+def create_backup_task(self, user_id: str, backup_type: str = "user", mode: str = "full"):
     """
     Celery задача для создания резервной копии.
     backup_type: "user" или "full"
+    mode: "full", "incremental" (изменения с последнего бэкапа) или "differential" (с последнего полного)
     """
     # self.update_state(state='PROGRESS', meta={'current': 0, 'total': 100}) # Пример прогресса
     try:
-        # Получаем текущего пользователя (для метаданных и проверки прав)
-        with get_db_session() as db:
-            current_user = db.query(User).filter(User.id == user_id).first()
-            if not current_user:
-                raise ValueError(f"User with id {user_id} not found")
-
-            if backup_type == "full" and not current_user.is_admin:
-                raise ValueError("Admin rights required for full backup")
-
-            # Получаем все данные в зависимости от типа бэкапа
-            if backup_type == "user":
-                files = db.query(DBFile).filter(DBFile.owner_id == current_user.id).all()
-                # Получаем теги, используемые в файлах пользователя
-                file_ids = [f.id for f in files]
-                tags = db.query(Tag).filter(Tag.id.in_([tid for f in files for tid in f.tags])).all()
-                # Получаем категории, используемые в файлах пользователя
-                category_ids = {f.category_id for f in files if f.category_id}
-                categories = db.query(Category).filter(Category.id.in_(category_ids)).all() if category_ids else []
-                # Получаем коллекции, к которым принадлежат файлы пользователя
-                groups = (
-                    db.query(Group)
-                    .join(file_group, Group.id == file_group.c.group_id)
-                    .filter(file_group.c.file_id.in_(file_ids))
-                    .all()
-                )
-                # Получаем связи файлов с коллекциями
-                file_group_links = db.query(file_group).filter(file_group.c.file_id.in_(file_ids)).all()
-
-                # Подготавливаем данные для бэкапа
-                backup_data = _prepare_backup_data(current_user, files, tags, categories, groups, file_group_links)
-
-            elif backup_type == "full":
-                files = db.query(DBFile).all()
-                tags = db.query(Tag).all()
-                categories = db.query(Category).all()
-                users = db.query(User).all()
-                groups = db.query(Group).all()
-                group_members = db.query(GroupMember).all()
-                file_group_links = db.query(file_group).all()
-                backup_data = _prepare_full_backup_data(users, files, tags, categories, groups, group_members, file_group_links)
-            else:
-                raise ValueError(f"Invalid backup_type: {backup_type}")
+        current_user, backup_data = _load_backup_source(user_id, backup_type)
 
         # Создаем ZIP архив и сохраняем его в S3
-        s3_backup_key = _create_and_save_zip_to_s3(backup_data, files, backup_type, current_user)
+        s3_backup_key, stats = _create_and_save_zip_to_s3(
+            backup_data, backup_type, current_user, self.request.id, mode
+        )
 
-        # Возвращаем ключ S3, где хранится бэкап
-        return {"status": "completed", "s3_key": s3_backup_key}
+        # Возвращаем ключ S3, где хранится бэкап, и отчет о скорости архивации
+        return {"status": "completed", "s3_key": s3_backup_key, "stats": stats}
 
+    except MultipartUploadError as exc:
+        # Повтор с тем же id задачи продолжит загрузку архива с последней отправленной части
+        if self.request.retries < BACKUP_MAX_RETRIES:
+            raise self.retry(exc=exc, countdown=BACKUP_RETRY_COUNTDOWN)
+        abort_multipart_state(self.request.id)
+        self.update_state(
+            state='FAILURE',
+            meta={'exc_type': type(exc).__name__, 'exc_message': str(exc)}
+        )
+        raise exc
     except Exception as exc:
         # Обновляем статус задачи в случае ошибки
         self.update_state(
@@ -77,305 +104,458 @@ def create_backup_task(self, user_id: str, backup_type: str = "user"):
         )
         raise exc # Важно: поднимите исключение, чтобы Celery знал об ошибке
 
-def _prepare_backup_data(current_user, files, tags, categories, groups, file_group_links):
-    """Подготавливает данные для бэкапа пользователя"""
-    # (Копируем логику из backup_service.py)
-    backup_data = {
-        "user_id": str(current_user.id),
-        "username": current_user.username,
-        "backup_date": str(datetime.now(timezone.utc)),
-        "backup_type": "user",
-        "files": [],
-        "tags": [],
-        "categories": [],
-        "groups": [],
-        "group_members": [],
-        "file_group_links": [],
-    }
-
-    for file in files:
-        file_data = {
-            "id": str(file.id),
-            "original_name": file.original_name,
-            "mime_type": file.mime_type,
-            "file_path": file.file_path,
-            "size": file.size,
-            "thumbnail_path": file.thumbnail_path,
-            "preview_path": file.preview_path,
-            "description": file.description,
-            "tags": [str(tid) for tid in file.tags],
-            "category_id": str(file.category_id) if file.category_id else None,
-            "owner_id": str(file.owner_id),
-            "owner_username": current_user.username,
-            "created_at": str(file.created_at),
-            "updated_at": str(file.updated_at),
-            "transcoding_status": file.transcoding_status,
-            "duration": file.duration,
-            "hls_manifest_path": file.hls_manifest_path,
-            "dash_manifest_path": file.dash_manifest_path,
-        }
-        backup_data["files"].append(file_data)
-
-    for tag in tags:
-        tag_data = {
-            "id": str(tag.id),
-            "name": tag.name,
-            "slug": tag.slug,
-            "created_at": str(tag.created_at),
-            "updated_at": str(tag.updated_at),
-        }
-        backup_data["tags"].append(tag_data)
-
-    for category in categories:
-        category_data = {
-            "id": str(category.id),
-            "name": category.name,
-            "slug": category.slug,
-            "description": category.description,
-            "created_at": str(category.created_at),
-        }
-        backup_data["categories"].append(category_data)
-
-    for group in groups:
-        group_data = {
-            "id": str(group.id),
-            "name": group.name,
-            "description": group.description,
-            "creator_id": str(group.creator_id),
-            "access_level": group.access_level,
-            "created_at": str(group.created_at),
-            "updated_at": str(group.updated_at),
-        }
-        backup_data["groups"].append(group_data)
+@celery_app.task(bind=True)
+def create_snapshot_task(self, user_id: str, backup_type: str = "full"):
+    """
+    Бэкап без ZIP: оригиналы, миниатюры, превью и транскодированные файлы копируются
+    на стороне S3 в backups/<snapshot-id>/ под теми же именами, что и в архиве;
+    метаданные и список объектов лежат рядом.
+    """
+    try:
+        current_user, backup_data = _load_backup_source(user_id, backup_type)
+
+        started_at = datetime.now(timezone.utc)
+        timestamp = started_at.strftime('%Y%m%d_%H%M%S')
+        if backup_type == "user":
+            snapshot_id = f"snapshot_{current_user.username}_{timestamp}"
+        else:  # full
+            snapshot_id = f"snapshot_all_users_{timestamp}"
+        snapshot_prefix = f"backups/{snapshot_id}/"
+        backup_data["backup_date"] = str(started_at)
+        backup_data["backup_format"] = "snapshot"
+
+        stats = _copy_snapshot_objects(snapshot_prefix, iter_backup_files(backup_type, current_user))
+
+        for section in backup_sections(backup_type):
+            records = iter_section_records(section, backup_type, current_user)
+            backup_data["sections"][section] = _write_ndjson_object(f"{snapshot_prefix}{section_name(section)}", records)
+        # Заголовок пишется последним: его наличие означает, что снимок завершен
+        s3_client.put_object(
+            Bucket=settings.AWS_S3_BUCKET_NAME,
+            Key=f"{snapshot_prefix}{SNAPSHOT_METADATA_NAME}",
+            Body=json.dumps(backup_data, indent=2, ensure_ascii=False).encode("utf-8"),
+            ContentType="application/json",
+            Metadata={"snapshot-bytes": str(stats["bytes"])},
+        )
+        print(f"Snapshot saved to S3: {snapshot_prefix} ({stats['objects']} objects, {stats['bytes']} bytes)")
+        return {"status": "completed", "s3_key": snapshot_prefix, "format": "snapshot", "stats": stats}
 
-    for link in file_group_links:
-        link_data = {
-            "file_id": str(link.file_id),
-            "group_id": str(link.group_id),
-        }
-        backup_data["file_group_links"].append(link_data)
+    except Exception as exc:
+        self.update_state(
+            state='FAILURE',
+            meta={'exc_type': type(exc).__name__, 'exc_message': str(exc)}
+        )
+        raise exc
 
-    return backup_data
+def _write_ndjson_object(key: str, records, keep_empty: bool = False) -> int:
+    """
+    Пишет записи NDJSON в объект S3 потоком. Пустая секция не создает объекта
+    (keep_empty — создается пустой объект: его читают без счетчика записей).
+    """
+    writer = S3MultipartWriter(key, content_type="application/x-ndjson")
+    try:
+        count = write_ndjson(writer, records)
+        if count:
+            writer.close()
+        else:
+            writer.abort()
+    except Exception:
+        writer.abort()
+        raise
+    if not count and keep_empty:
+        # Multipart-загрузка без частей не завершается — пустой объект пишется отдельно
+        s3_client.put_object(Bucket=settings.AWS_S3_BUCKET_NAME, Key=key, Body=b"", ContentType="application/x-ndjson")
+    return count
+
+def _copy_snapshot_objects(snapshot_prefix: str, files) -> dict:
+    """
+    Копирует объекты файлов в снимок параллельно; список скопированных ({name, key, size}
+    по строке) пишется потоком в SNAPSHOT_OBJECTS_NAME. Возвращает отчет.
+    """
+    stats = {"objects": 0, "bytes": 0, "failed": 0}
+    started = time.monotonic()
+
+    def copy(entry: _ArchiveEntry) -> int:
+        return copy_object_server_side(entry.s3_key, f"{snapshot_prefix}{entry.arcname}", entry.size)
+
+    def copied_objects():
+        copies = ordered_prefetch(_iter_archive_entries(files), copy, BACKUP_SNAPSHOT_WORKERS, BACKUP_SNAPSHOT_WORKERS * 4)
+        for entry, result in copies:
+            if isinstance(result, Exception):
+                stats["failed"] += 1
+                print(f"Warning: Could not snapshot {entry.s3_key}: {str(result)}")
+                continue
+            stats["objects"] += 1
+            stats["bytes"] += result
+            yield {"name": entry.arcname, "key": entry.s3_key, "size": result}
+
+    # Список пишется и для снимка без объектов: восстановление читает его всегда
+    _write_ndjson_object(f"{snapshot_prefix}{SNAPSHOT_OBJECTS_NAME}", copied_objects(), keep_empty=True)
+
+    seconds = time.monotonic() - started
+    stats.update(
+        seconds=round(seconds, 2),
+        objects_per_second=round(stats["objects"] / seconds, 1) if seconds else None,
+        workers=BACKUP_SNAPSHOT_WORKERS,
+    )
+    return stats
+
+def _load_backup_source(user_id: str, backup_type: str):
+    """
+    Проверяет пользователя и права, возвращает его и заголовок метаданных.
+    Сами записи (пользователи, файлы, теги, ...) читаются потоком при записи бэкапа.
+    """
+    with get_db_session() as db:
+        current_user = db.query(User).filter(User.id == user_id).first()
+        if not current_user:
+            raise ValueError(f"User with id {user_id} not found")
+    if backup_type == "full" and not current_user.is_admin:
+        raise ValueError("Admin rights required for full backup")
+    if backup_type not in ("user", "full"):
+        raise ValueError(f"Invalid backup_type: {backup_type}")
 
-def _prepare_full_backup_data(users, files, tags, categories, groups, group_members, file_group_links):
-    """Подготавливает данные для полного бэкапа"""
-    # (Копируем логику из backup_service.py)
     backup_data = {
+        "backup_type": backup_type,
         "backup_date": str(datetime.now(timezone.utc)),
-        "backup_type": "full",
-        "users": [],
-        "files": [],
-        "tags": [],
-        "categories": [],
-        "groups": [],
-        "group_members": [],
-        "file_group_links": [],
+        "metadata_format": METADATA_FORMAT,
+        "sections": {},
     }
+    if backup_type == "user":
+        backup_data["user_id"] = str(current_user.id)
+        backup_data["username"] = current_user.username
+    return current_user, backup_data
 
-    username_to_id = {user.username: str(user.id) for user in users}
-    for user in users:
-        user_data = {
-            "id": str(user.id),
-            "username": user.username,
-            "email": user.email,
-            "is_active": user.is_active,
-            "is_admin": user.is_admin,
-            "password": user.password,
-            "created_at": str(user.created_at),
-            "updated_at": str(user.updated_at),
-        }
-        backup_data["users"].append(user_data)
-
-    for file in files:
-        owner = next((u for u in users if u.id == file.owner_id), None)
-        owner_username = owner.username if owner else "unknown"
-        file_data = {
-            "id": str(file.id),
-            "original_name": file.original_name,
-            "mime_type": file.mime_type,
-            "file_path": file.file_path,
-            "size": file.size,
-            "thumbnail_path": file.thumbnail_path,
-            "preview_path": file.preview_path,
-            "description": file.description,
-            "tags": [str(tid) for tid in file.tags],
-            "category_id": str(file.category_id) if file.category_id else None,
-            "owner_id": str(file.owner_id),
-            "owner_username": owner_username,
-            "created_at": str(file.created_at),
-            "updated_at": str(file.updated_at),
-            "transcoding_status": file.transcoding_status,
-            "duration": file.duration,
-            "hls_manifest_path": file.hls_manifest_path,
-            "dash_manifest_path": file.dash_manifest_path,
-        }
-        backup_data["files"].append(file_data)
-
-    for tag in tags:
-        tag_data = {
-            "id": str(tag.id),
-            "name": tag.name,
-            "slug": tag.slug,
-            "created_at": str(tag.created_at),
-            "updated_at": str(tag.updated_at),
-        }
-        backup_data["tags"].append(tag_data)
-
-    for category in categories:
-        category_data = {
-            "id": str(category.id),
-            "name": category.name,
-            "slug": category.slug,
-            "description": category.description,
-            "created_at": str(category.created_at),
-        }
-        backup_data["categories"].append(category_data)
-
-    for group in groups:
-        group_data = {
-            "id": str(group.id),
-            "name": group.name,
-            "description": group.description,
-            "creator_id": str(group.creator_id),
-            "access_level": group.access_level,
-            "created_at": str(group.created_at),
-            "updated_at": str(group.updated_at),
-        }
-        backup_data["groups"].append(group_data)
-
-    for member in group_members:
-        member_data = {
-            "user_id": str(member.user_id),
-            "group_id": str(member.group_id),
-            "role": member.role,
-            "invited_by": str(member.invited_by) if member.invited_by else None,
-            "invited_at": str(member.invited_at),
-            "accepted_at": str(member.accepted_at) if member.accepted_at else None,
-            "revoked_at": str(member.revoked_at) if member.revoked_at else None,
-        }
-        backup_data["group_members"].append(member_data)
+def _copy_s3_object_to_zip(zip_file: zipfile.ZipFile, file_path: str, info: zipfile.ZipInfo) -> None:
+    """Копирует объект S3 в архив кусками: память не зависит от размера файла."""
+    copied = 0
+    try:
+        chunks = iter_s3_object(file_path, ZIP_COPY_CHUNK_SIZE)
+        first_chunk = next(chunks, b"")  # ошибка открытия объекта — до создания записи в архиве
+        with zip_file.open(info, "w", force_zip64=True) as dest:
+            dest.write(first_chunk)
+            copied += len(first_chunk)
+            for chunk in chunks:
+                dest.write(chunk)
+                copied += len(chunk)
+    except MultipartUploadError:
+        raise
+    except Exception as e:
+        if copied:
+            # Часть записи уже в потоке архива, пропустить файл нельзя — повторяем задачу
+            raise MultipartUploadError(f"Reading {file_path} failed after {copied} bytes: {e}") from e
+        raise ValueError(f"Failed to download file from S3: {str(e)}")
 
-    for link in file_group_links:
-        link_data = {
-            "file_id": str(link.file_id),
-            "group_id": str(link.group_id),
-        }
-        backup_data["file_group_links"].append(link_data)
+def _text_compress_type() -> int:
+    if BACKUP_METADATA_COMPRESSION == "zstd":
+        if hasattr(zipfile, "ZIP_ZSTANDARD"):
+            return zipfile.ZIP_ZSTANDARD
+        print("Warning: zstd is not supported by this Python zipfile, falling back to deflate")
+    return zipfile.ZIP_DEFLATED
+
+def _compress_type(arcname: str, mime_type: Optional[str] = None) -> int:
+    """ZIP_STORED для медиа и уже сжатых форматов, для остального — сжатие метаданных."""
+    if mime_type and mime_type.startswith(STORED_MIME_PREFIXES) and mime_type not in COMPRESSIBLE_MEDIA_TYPES:
+        return zipfile.ZIP_STORED
+    if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return _text_compress_type()
+
+def _zip_entry(arcname: str, date_time: tuple, mime_type: Optional[str] = None) -> zipfile.ZipInfo:
+    """Запись архива с фиксированной датой: повтор задачи дает тот же поток байтов."""
+    info = zipfile.ZipInfo(arcname, date_time=date_time)
+    info.compress_type = _compress_type(arcname, mime_type)
+    if info.compress_type != zipfile.ZIP_STORED:
+        # ZipInfo, созданный вручную, не наследует compresslevel архива
+        info._compresslevel = BACKUP_COMPRESSION_LEVEL
+    return info
+
+def _track_compression(stats: dict, info: zipfile.ZipInfo, seconds: float) -> None:
+    """Учитывает запись в отчете: сколько байт сэкономило сжатие и сколько времени на него ушло."""
+    if info.compress_type == zipfile.ZIP_STORED:
+        stats["stored_objects"] += 1
+        stats["stored_bytes"] += info.file_size
+    else:
+        stats["compressed_objects"] += 1
+        stats["compressed_input_bytes"] += info.file_size
+        stats["bytes_saved"] += info.file_size - info.compress_size
+        stats["compression_seconds"] += seconds
+
+class _ArchiveEntry(NamedTuple):
+    arcname: str
+    s3_key: str
+    size: Optional[int]  # None — размер неизвестен без HEAD (миниатюры, превью)
+    mime_type: Optional[str] = None
+
+def _list_prefix_entries(s3_base_key: str, arc_prefix: str) -> List[_ArchiveEntry]:
+    entries = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=settings.AWS_S3_BUCKET_NAME, Prefix=s3_base_key):
+        for obj in page.get('Contents', []):
+            relative_s3_key = obj['Key'][len(s3_base_key):]
+            if relative_s3_key:
+                entries.append(_ArchiveEntry(f"{arc_prefix}{relative_s3_key}", obj['Key'], obj['Size']))
+    return entries
+
+def _list_transcoded_entries(file) -> List[_ArchiveEntry]:
+    """Объекты HLS и DASH файла; листинг S3 выполняется в пуле предвыборки."""
+    entries = []
+    if file.hls_manifest_path:
+        hls_s3_base_parts = file.hls_manifest_path.split('/')
+        if len(hls_s3_base_parts) >= 3:
+            hls_s3_base_key = '/'.join(hls_s3_base_parts[:-1]) + '/'
+            hls_layout = hls_s3_base_parts[-2]  # "hls" (MPEG-TS) или "cmaf" (fMP4 + manifest.mpd)
+            try:
+                entries += _list_prefix_entries(hls_s3_base_key, f"transcoded/{file.id}/{hls_layout}/")
+            except ClientError as e:
+                print(f"Warning: Could not backup HLS files for {file.id}: {str(e)}")
+
+    # DASH (для CMAF манифест лежит рядом с HLS и уже попал в список выше)
+    if file.dash_manifest_path:
+        dash_s3_base_parts = file.dash_manifest_path.split('/')
+        hls_dir = file.hls_manifest_path.rsplit('/', 1)[0] if file.hls_manifest_path else None
+        if len(dash_s3_base_parts) >= 3 and '/'.join(dash_s3_base_parts[:-1]) != hls_dir:
+            dash_s3_base_key = '/'.join(dash_s3_base_parts[:-1]) + '/'
+            try:
+                entries += _list_prefix_entries(dash_s3_base_key, f"transcoded/{file.id}/dash/")
+            except ClientError as e:
+                print(f"Warning: Could not backup DASH files for {file.id}: {str(e)}")
+    return entries
+
+def _iter_archive_entries(files: list, known_blobs=(), failed: list = None) -> Iterator[_ArchiveEntry]:
+    """
+    Записи архива в детерминированном порядке: оригинал, миниатюра, превью, HLS, DASH каждого файла.
+    known_blobs — общие оригиналы, уже сохраненные в предыдущих архивах цепочки.
+    """
+    written_blobs = set(known_blobs)  # общий оригинал дубликатов попадает в архив один раз
+    listings = ordered_prefetch(files, _list_transcoded_entries, BACKUP_PREFETCH_WORKERS, BACKUP_PREFETCH_WINDOW)
+    try:
+        for file, transcoded in listings:
+            if file.file_path and is_blob_key(file.file_path):
+                if file.file_path not in written_blobs:
+                    written_blobs.add(file.file_path)
+                    yield _ArchiveEntry(file.file_path, file.file_path, file.size, file.mime_type)
+            elif file.file_path:
+                yield _ArchiveEntry(f"files/{file.id}_{file.original_name}", file.file_path, file.size, file.mime_type)
+            if file.thumbnail_path:
+                yield _ArchiveEntry(f"thumbnails/{file.id}_thumbnail.jpg", file.thumbnail_path, None)
+            if file.preview_path:
+                yield _ArchiveEntry(f"previews/{file.id}_preview.jpg", file.preview_path, None)
+
+            if isinstance(transcoded, Exception):
+                print(f"Warning: Could not backup file {file.id}: {str(transcoded)}")
+                if failed is not None:
+                    failed.append(f"transcoded/{file.id}/")
+                continue
+            yield from transcoded
+    finally:
+        listings.close()
 
-    return backup_data
+def _prefetch_entry(entry: _ArchiveEntry) -> Optional[bytes]:
+    """Скачивает небольшой объект целиком; для крупных возвращает None — они копируются потоком при записи."""
+    if entry.size is not None and entry.size > BACKUP_PREFETCH_MAX_OBJECT_BYTES:
+        return None
+    return b"".join(iter_s3_object(entry.s3_key, ZIP_COPY_CHUNK_SIZE))
 
-def _download_file_from_s3(file_path: str) -> bytes:
-    """Скачивает файл из S3 и возвращает его содержимое"""
+def _write_archive_entries(
+    zip_file: zipfile.ZipFile, files: list, date_time: tuple, known_blobs=(), failed: list = None
+) -> dict:
+    """
+    Пишет объекты файлов в архив. Пул скачивает до BACKUP_PREFETCH_WINDOW следующих объектов,
+    пока текущий пишется в архив; порядок записей от предвыборки не зависит.
+    Имена записей, которые не удалось сохранить, добавляются в failed.
+    Возвращает отчет о пропускной способности.
+    """
+    stats = {
+        "objects": 0, "bytes": 0, "prefetched": 0, "streamed": 0, "skipped": 0,
+        "stored_objects": 0, "stored_bytes": 0,
+        "compressed_objects": 0, "compressed_input_bytes": 0, "bytes_saved": 0, "compression_seconds": 0.0,
+    }
+    wait_seconds = 0.0
+    started = time.monotonic()
+    prefetched = ordered_prefetch(
+        _iter_archive_entries(files, known_blobs, failed), _prefetch_entry, BACKUP_PREFETCH_WORKERS, BACKUP_PREFETCH_WINDOW
+    )
     try:
-        response = s3_client.get_object(
-            Bucket=settings.AWS_S3_BUCKET_NAME, Key=file_path
-        )
-        return response["Body"].read()
-    except ClientError as e:
-        raise ValueError(f"Failed to download file from S3: {str(e)}")
+        while True:
+            wait_started = time.monotonic()
+            item = next(prefetched, None)
+            wait_seconds += time.monotonic() - wait_started
+            if item is None:
+                break
+            entry, content = item
+            info = _zip_entry(entry.arcname, date_time, entry.mime_type)
+            write_started = time.monotonic()
+            try:
+                if isinstance(content, Exception):
+                    raise content
+                if content is None:
+                    _copy_s3_object_to_zip(zip_file, entry.s3_key, info)
+                    stats["streamed"] += 1
+                    stats["bytes"] += entry.size
+                else:
+                    zip_file.writestr(info, content)
+                    stats["prefetched"] += 1
+                    stats["bytes"] += len(content)
+                stats["objects"] += 1
+                # Для потоковых записей время включает и чтение из S3
+                _track_compression(stats, info, time.monotonic() - write_started)
+            except MultipartUploadError:
+                raise
+            except Exception as e:
+                stats["skipped"] += 1
+                print(f"Warning: Could not backup {entry.s3_key}: {str(e)}")
+                if failed is not None:
+                    failed.append(entry.arcname)
+    finally:
+        prefetched.close()
+
+    seconds = time.monotonic() - started
+    stats.update(
+        seconds=round(seconds, 2),
+        writer_wait_seconds=round(wait_seconds, 2),  # запись простаивала в ожидании скачивания
+        throughput_mb_s=round(stats["bytes"] / (1024 * 1024) / seconds, 2) if seconds else None,
+        objects_per_second=round(stats["objects"] / seconds, 1) if seconds else None,
+        workers=BACKUP_PREFETCH_WORKERS,
+        window=BACKUP_PREFETCH_WINDOW,
+    )
+    return stats
+
+def _finish_compression_report(stats: dict) -> None:
+    stats["compression_seconds"] = round(stats["compression_seconds"], 2)
+    stats["compression_ratio"] = (
+        round(1 - stats["bytes_saved"] / stats["compressed_input_bytes"], 3) if stats["compressed_input_bytes"] else None
+    )
+    # Сколько байт экономит секунда сжатия: низкое значение — повод понизить уровень
+    stats["bytes_saved_per_second"] = (
+        int(stats["bytes_saved"] / stats["compression_seconds"]) if stats["compression_seconds"] else None
+    )
+    stats["compression"] = {
+        "method": "zstd" if _text_compress_type() != zipfile.ZIP_DEFLATED else "deflate",
+        "level": BACKUP_COMPRESSION_LEVEL,
+    }
 
-def _create_and_save_zip_to_s3(backup_data: dict, files: list, backup_type: str, current_user: User):
+def _open_backup_writer(state: dict, task_id: str = None) -> S3MultipartWriter:
+    """Продолжает сохраненную multipart-загрузку или начинает новую."""
+    if state.get("upload_id"):
+        try:
+            return S3MultipartWriter(state["s3_key"], upload_id=state["upload_id"], content_type="application/zip")
+        except ClientError as e:
+            print(f"Cannot resume upload {state['upload_id']} for {state['s3_key']}, starting over: {e}")
+    writer = S3MultipartWriter(state["s3_key"], content_type="application/zip")
+    state["upload_id"] = writer.upload_id
+    if task_id:
+        save_multipart_state(task_id, state)
+    return writer
+
+def _create_and_save_zip_to_s3(
+    backup_data: dict, backup_type: str, current_user: User, task_id: str = None, mode: str = "full"
+):
     """
-    Создает ZIP архив и сохраняет его в S3.
-    Возвращает ключ S3, под которым файл был сохранен.
+    Создает ZIP64 архив потоком и отправляет его в S3 частями multipart upload,
+    без локальной копии. При повторе задачи (тот же task_id) загрузка продолжается:
+    уже отправленные части с совпадающим содержимым не загружаются заново.
+
+    В режимах incremental и differential в архив попадают полные метаданные и объекты только
+    новых или измененных файлов; остальные берутся при восстановлении из архивов по манифесту.
+    Метаданные пишутся секциями NDJSON (metadata/<секция>.ndjson) прямо из серверного курсора,
+    файлы тоже читаются потоком: память не зависит от размера каталога.
+    Возвращает ключ S3, под которым файл был сохранен, и отчет о пропускной способности.
     """
-    # Генерируем уникальное имя файла
-    timestamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
-    if backup_type == "user":
-        filename = f"backup_{current_user.username}_{timestamp}.zip"
-    else:  # full
-        filename = f"full_backup_all_users_{timestamp}.zip"
-
-    # Ключ S3 для сохранения
-    s3_backup_key = f"backups/{filename}"
+    state = load_multipart_state(task_id) if task_id else None
+    if not state:
+        # Генерируем уникальное имя файла
+        started_at = datetime.now(timezone.utc)
+        timestamp = started_at.strftime('%Y%m%d_%H%M%S')
+        scope = manifest_scope(backup_type, current_user.id)
+        previous_manifest_key = find_previous_manifest_key(scope, mode) if mode != "full" else None
+        if mode != "full" and not previous_manifest_key:
+            print(f"No previous backup manifest for {scope}, creating full backup instead of {mode}")
+            mode = "full"
+        suffix = "" if mode == "full" else f"_{mode}"
+        if backup_type == "user":
+            filename = f"backup_{current_user.username}_{timestamp}{suffix}.zip"
+        else:  # full
+            filename = f"full_backup_all_users_{timestamp}{suffix}.zip"
+        # Ключ S3 для сохранения; предыдущий снимок фиксируется, чтобы повтор задачи собрал тот же архив
+        state = {
+            "s3_key": f"backups/{filename}",
+            "started_at": started_at.isoformat(),
+            "upload_id": None,
+            "mode": mode,
+            "manifest_key": manifest_key(scope, started_at, mode),
+            "previous_manifest_key": previous_manifest_key,
+        }
 
-    with tempfile.NamedTemporaryFile(delete=False) as temp_zip_file:
-        zip_path = temp_zip_file.name
+    s3_backup_key = state["s3_key"]
+    started_at = datetime.fromisoformat(state["started_at"])
+    mode = state.get("mode", "full")
+    backup_data["backup_date"] = str(started_at)
+    backup_data["backup_mode"] = mode
+    date_time = started_at.timetuple()[:6]
+
+    previous = load_manifest(state["previous_manifest_key"]) if state.get("previous_manifest_key") else None
+    manifest = build_manifest(s3_backup_key, mode, iter_backup_files(backup_type, current_user), previous)
+    # Файл, добавленный после построения манифеста, попадет в следующий бэкап
+    changed_files = (
+        file for file in iter_backup_files(backup_type, current_user)
+        if manifest["files"].get(str(file.id), {}).get("archive") == s3_backup_key
+    )
+    known_blobs = {key for key, archive in manifest["blobs"].items() if archive != s3_backup_key}
+    failed = []
+    writer = _open_backup_writer(state, task_id)
 
     try:
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            json_data = json.dumps(backup_data, indent=2, ensure_ascii=False)
-            zip_file.writestr("backup_metadata.json", json_data)
-
-            for file in files:
-                try:
-                    if file.file_path:
-                        file_content = _download_file_from_s3(file.file_path)
-                        zip_file.writestr(
-                            f"files/{file.id}_{file.original_name}", file_content
-                        )
-                    if file.thumbnail_path:
-                        thumbnail_content = _download_file_from_s3(file.thumbnail_path)
-                        zip_file.writestr(
-                            f"thumbnails/{file.id}_thumbnail.jpg", thumbnail_content
-                        )
-                    if file.preview_path:
-                        preview_content = _download_file_from_s3(file.preview_path)
-                        zip_file.writestr(
-                            f"previews/{file.id}_preview.jpg", preview_content
-                        )
-
-                    # HLS
-                    if file.hls_manifest_path:
-                        hls_s3_base_parts = file.hls_manifest_path.split('/')
-                        if len(hls_s3_base_parts) >= 3:
-                            hls_s3_base_key = '/'.join(hls_s3_base_parts[:-1]) + '/'
-                            with tempfile.TemporaryDirectory() as hls_temp_dir:
-                                try:
-                                    paginator = s3_client.get_paginator('list_objects_v2')
-                                    pages = paginator.paginate(Bucket=settings.AWS_S3_BUCKET_NAME, Prefix=hls_s3_base_key)
-                                    for page in pages:
-                                        if 'Contents' in page:
-                                            for obj in page['Contents']:
-                                                s3_key = obj['Key']
-                                                relative_s3_key = s3_key[len(hls_s3_base_key):]
-                                                if relative_s3_key:
-                                                    local_file_path = os.path.join(hls_temp_dir, relative_s3_key)
-                                                    os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
-                                                    s3_client.download_file(settings.AWS_S3_BUCKET_NAME, s3_key, local_file_path)
-                                                    zip_arcname = f"transcoded/{file.id}/hls/{relative_s3_key}"
-                                                    zip_file.write(local_file_path, arcname=zip_arcname)
-                                except ClientError as e:
-                                    print(f"Warning: Could not backup HLS files for {file.id}: {str(e)}")
-
-                    # DASH
-                    if file.dash_manifest_path:
-                        dash_s3_base_parts = file.dash_manifest_path.split('/')
-                        if len(dash_s3_base_parts) >= 3:
-                            dash_s3_base_key = '/'.join(dash_s3_base_parts[:-1]) + '/'
-                            with tempfile.TemporaryDirectory() as dash_temp_dir:
-                                try:
-                                    paginator = s3_client.get_paginator('list_objects_v2')
-                                    pages = paginator.paginate(Bucket=settings.AWS_S3_BUCKET_NAME, Prefix=dash_s3_base_key)
-                                    for page in pages:
-                                        if 'Contents' in page:
-                                            for obj in page['Contents']:
-                                                s3_key = obj['Key']
-                                                relative_s3_key = s3_key[len(dash_s3_base_key):]
-                                                if relative_s3_key:
-                                                    local_file_path = os.path.join(dash_temp_dir, relative_s3_key)
-                                                    os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
-                                                    s3_client.download_file(settings.AWS_S3_BUCKET_NAME, s3_key, local_file_path)
-                                                    zip_arcname = f"transcoded/{file.id}/dash/{relative_s3_key}"
-                                                    zip_file.write(local_file_path, arcname=zip_arcname)
-                                except ClientError as e:
-                                    print(f"Warning: Could not backup DASH files for {file.id}: {str(e)}")
-
-                except Exception as e:
-                    print(f"Warning: Could not backup file {file.id}: {str(e)}")
-
-        # Загружаем ZIP-архив в S3 напрямую из файла
-        with open(zip_path, 'rb') as f:
-            s3_client.put_object(
-                Bucket=settings.AWS_S3_BUCKET_NAME,
-                Key=s3_backup_key,
-                Body=f,
-                ContentType='application/zip'
-            )
-
-        print(f"Backup saved to S3: {s3_backup_key}")
-        return s3_backup_key
+        with zipfile.ZipFile(writer, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zip_file:
+            metadata_written = []
+            for section in backup_sections(backup_type):
+                info = _zip_entry(section_name(section), date_time)
+                section_started = time.monotonic()
+                with zip_file.open(info, "w", force_zip64=True) as dest:
+                    records = iter_section_records(section, backup_type, current_user)
+                    backup_data["sections"][section] = write_ndjson(dest, records)
+                metadata_written.append((info, time.monotonic() - section_started))
 
-    finally:
-        # Удаляем временный файл
-        os.remove(zip_path)
+            json_data = json.dumps(backup_data, indent=2, ensure_ascii=False)
+            metadata_info = _zip_entry(METADATA_HEADER_NAME, date_time)
+            metadata_started = time.monotonic()
+            zip_file.writestr(metadata_info, json_data)
+            metadata_written.append((metadata_info, time.monotonic() - metadata_started))
+
+            stats = _write_archive_entries(zip_file, changed_files, date_time, known_blobs, failed)
+            for info, seconds in metadata_written:
+                _track_compression(stats, info, seconds)
+            _finish_compression_report(stats)
+
+            # Манифест пишется последним: в нем уже учтены объекты, которые не удалось сохранить
+            forget_failed_members(manifest, failed)
+            zip_file.writestr(_zip_entry(MANIFEST_ARCNAME, date_time), json.dumps(manifest))
+
+        # Последняя часть и CompleteMultipartUpload
+        writer.close()
+    except MultipartUploadError:
+        # Состояние загрузки сохраняется: повтор задачи продолжит с последней отправленной части
+        raise
+    except Exception:
+        writer.abort()
+        if task_id:
+            delete_multipart_state(task_id)
+        raise
+
+    # Манифест рядом с архивами появляется только для завершенного бэкапа: от него считается следующий
+    save_manifest(state["manifest_key"], manifest)
+    if task_id:
+        delete_multipart_state(task_id)
+    archived_files = sum(1 for entry in manifest["files"].values() if entry["archive"] == s3_backup_key)
+    stats.update(
+        mode=mode,
+        parent=manifest["parent"],
+        archived_files=archived_files,
+        unchanged_files=len(manifest["files"]) - archived_files,
+    )
+    print(
+        f"Backup saved to S3: {s3_backup_key} ({writer.bytes_written} bytes, "
+        f"{len(writer.parts)} parts, {writer.parts_reused} reused, {stats['throughput_mb_s']} MB/s, "
+        f"compression saved {stats['bytes_saved']} bytes in {stats['compression_seconds']}s)"
+    )
+    stats["archive_bytes"] = writer.bytes_written
+    return s3_backup_key, stats
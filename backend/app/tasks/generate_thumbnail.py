@@ -0,0 +1,26 @@
+from app.celery_app import celery_app
+from app.core.database import get_db_session
+from app.models.base import File as DBFile
+
+
+@celery_app.task(bind=True)
+def generate_thumbnail_task(self, file_id: str, thumbnail_name: str = None):
+    """
+    Celery задача создания миниатюры из оригинала в S3.
+    thumbnail_name — имя миниатюры, если ключ оригинала общий (blobs/<sha256>).
+    """
+    from app.services.s3_service import create_thumbnail_from_s3
+
+    with get_db_session() as db:
+        file = db.query(DBFile).filter(DBFile.id == file_id).first()
+        if not file:
+            return {"file_id": file_id, "thumbnail_path": None}
+        s3_key, content_type = file.file_path, file.mime_type
+
+    thumbnail_key = create_thumbnail_from_s3(s3_key, content_type, thumbnail_name)
+    if thumbnail_key:
+        with get_db_session() as db:
+            db.query(DBFile).filter(DBFile.id == file_id).update(
+                {DBFile.thumbnail_path: thumbnail_key}, synchronize_session=False
+            )
+    return {"file_id": file_id, "thumbnail_path": thumbnail_key}
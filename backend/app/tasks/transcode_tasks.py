@@ -0,0 +1,40 @@
+from app.celery_app import celery_app
+from app.repositories.transcode_backfill_repository import record_backfill_result
+from app.services.transcode_scheduler import QUEUE_NEW_UPLOAD
+
+
+@celery_app.task(bind=True)
+def transcode_video_task(self, file_id: str, queue: str = QUEUE_NEW_UPLOAD, backfill_id: str = None):
+    """
+    Celery задача транскодирования одного файла.
+    Очередь Celery (новая загрузка или перекодирование) выбирается при постановке,
+    queue задает профиль кодирования, backfill_id — пакетный запуск для учета результата.
+    """
+    from app.services.transcode_service import _transcode_video_task_internal
+
+    _transcode_video_task_internal(file_id, queue)
+    if backfill_id:
+        record_backfill_result(backfill_id, file_id)
+    return {"file_id": file_id, "queue": queue}
+
+
+@celery_app.task(bind=True)
+def transcode_backfill_batch_task(self, backfill_id: str, generation: int = 0):
+    """
+    Ставит в очередь очередную порцию файлов пакетного перетранскодирования и планирует следующую.
+    generation — поколение цепочки; задачи устаревшей цепочки ничего не делают.
+    """
+    from app.services.transcode_backfill_service import run_backfill_batch
+
+    return run_backfill_batch(backfill_id, generation)
+
+
+@celery_app.task(bind=True)
+def delete_transcoded_output_task(self, base_path: str):
+    """
+    Удаляет объекты прежнего результата транскодирования, когда истекли выданные на него токены.
+    Удаление идемпотентно: повторная доставка задачи с задержкой ничего не ломает.
+    """
+    from app.services.transcoded_storage import delete_transcoded_output
+
+    return {"base_path": base_path, "deleted": delete_transcoded_output(base_path)}
@@ -0,0 +1,68 @@
+"""
+Запуск отдельного воркера Celery на каждую очередь со своей конкуренцией
+(CELERY_<QUEUE>_CONCURRENCY), чтобы длинные бэкапы и перекодирование
+не занимали процессы миниатюр и новых загрузок.
+
+Запуск (из каталога backend):
+    python -m app.workers                      # все очереди
+    python -m app.workers thumbnails backups   # только перечисленные
+"""
+import signal
+import subprocess
+import sys
+import time
+
+from app.celery_app import QUEUE_CONCURRENCY, QUEUES
+
+
+def worker_command(queue: str, concurrency: int):
+    return [
+        sys.executable, "-m", "celery", "-A", "app.celery_app", "worker",
+        "-Q", queue,
+        "-c", str(concurrency),
+        "-n", f"{queue}@%h",
+        "--loglevel=INFO",
+    ]
+
+
+def main():
+    queues = sys.argv[1:] or list(QUEUES)
+    unknown = [queue for queue in queues if queue not in QUEUES]
+    if unknown:
+        sys.exit(f"Unknown queues: {', '.join(unknown)} (available: {', '.join(QUEUES)})")
+
+    processes = {}
+    for queue in queues:
+        concurrency = QUEUE_CONCURRENCY[queue]
+        if concurrency <= 0:
+            print(f"Queue {queue} disabled (concurrency 0)")
+            continue
+        print(f"Starting worker for queue {queue} with concurrency {concurrency}")
+        processes[queue] = subprocess.Popen(worker_command(queue, concurrency))
+
+    def stop(signum, frame):
+        for process in processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Если один воркер упал, останавливаем остальные — перезапуск за оркестратором
+    exit_code = 0
+    while processes:
+        for queue, process in list(processes.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            del processes[queue]
+            if code != 0:
+                print(f"Worker for queue {queue} exited with code {code}")
+                exit_code = exit_code or code
+                stop(None, None)
+        time.sleep(1)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Бенчмарк памяти при создании бэкапа: пиковый RSS не должен зависеть от размера файлов.
+
+Загружает в S3 (локальный MinIO из docker-compose) корпус крупных несжимаемых объектов
+и архивирует их тем же кодом, что и create_backup_task: потоковый ZIP64 с кусочным
+копированием (_copy_s3_object_to_zip) в S3MultipartWriter. Для сравнения режим legacy
+повторяет прежнее поведение (read() всего объекта и writestr).
+
+Каждый режим выполняется в отдельном процессе; RSS снимается после каждого файла,
+пик берется из VmHWM.
+
+Запуск (из каталога backend):
+    python -m benchmarks.backup_memory --files 4 --size-mb 1024 --modes streaming,legacy --output results.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+import zipfile
+from typing import Any, Dict, List
+
+PATTERN_BLOCK_SIZE = 1024 * 1024  # Повтор случайного блока больше окна deflate — данные несжимаемы
+
+
+class PatternReader:
+    """Файлоподобный источник заданного размера без материализации данных в памяти."""
+
+    def __init__(self, size: int):
+        self.remaining = size
+        self.block = os.urandom(PATTERN_BLOCK_SIZE)
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining <= 0:
+            return b""
+        if size is None or size < 0 or size > PATTERN_BLOCK_SIZE:
+            size = PATTERN_BLOCK_SIZE
+        size = min(size, self.remaining)
+        self.remaining -= size
+        return self.block[:size]
+
+
+def read_status_mb(field: str) -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(f"{field}:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return 0.0
+
+
+def upload_corpus(prefix: str, count: int, size: int) -> List[str]:
+    from app.core.config import settings
+    from app.core.database import s3_client
+    from app.services.s3_transfer_service import transfer_config
+
+    keys = []
+    for index in range(count):
+        key = f"{prefix}source_{index}.bin"
+        s3_client.upload_fileobj(PatternReader(size), settings.AWS_S3_BUCKET_NAME, key, Config=transfer_config)
+        keys.append(key)
+    return keys
+
+
+def run_worker(mode: str, keys: List[str], archive_key: str) -> Dict[str, Any]:
+    """Архивирует корпус в дочернем процессе и возвращает профиль памяти."""
+    from app.core.config import settings
+    from app.core.database import s3_client
+    from app.services.s3_multipart_writer import S3MultipartWriter
+    from app.tasks.backup_tasks import _copy_s3_object_to_zip, _zip_entry
+
+    date_time = time.localtime()[:6]
+    rss_after_file = []
+    started = time.monotonic()
+    writer = S3MultipartWriter(archive_key, content_type="application/zip")
+    try:
+        with zipfile.ZipFile(writer, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zip_file:
+            for key in keys:
+                info = _zip_entry(f"files/{key.rsplit('/', 1)[-1]}", date_time)
+                if mode == "streaming":
+                    _copy_s3_object_to_zip(zip_file, key, info)
+                else:
+                    content = s3_client.get_object(Bucket=settings.AWS_S3_BUCKET_NAME, Key=key)["Body"].read()
+                    zip_file.writestr(info, content)
+                    del content
+                rss_after_file.append(read_status_mb("VmRSS"))
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    return {
+        "mode": mode,
+        "seconds": round(time.monotonic() - started, 2),
+        "archive_bytes": writer.bytes_written,
+        "peak_rss_mb": read_status_mb("VmHWM"),
+        "rss_after_each_file_mb": rss_after_file,
+    }
+
+
+def run_mode(mode: str, keys: List[str], prefix: str) -> Dict[str, Any]:
+    command = [
+        sys.executable, "-m", "benchmarks.backup_memory",
+        "--worker", mode, "--worker-keys", json.dumps(keys), "--worker-archive", f"{prefix}archive_{mode}.zip",
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=4, help="Количество файлов в корпусе")
+    parser.add_argument("--size-mb", type=int, default=512, help="Размер каждого файла, МБ")
+    parser.add_argument("--modes", default="streaming,legacy", help="Режимы через запятую: streaming, legacy")
+    parser.add_argument("--output", help="Путь для JSON с результатами")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-keys", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-archive", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, json.loads(args.worker_keys), args.worker_archive)))
+        return
+
+    from app.services.s3_multipart_writer import MULTIPART_PART_SIZE
+    from app.services.s3_transfer_service import delete_prefix
+
+    prefix = f"benchmarks/backup_memory/{uuid.uuid4()}/"
+    results = {
+        "files": args.files,
+        "file_size_mb": args.size_mb,
+        "part_size_mb": MULTIPART_PART_SIZE // (1024 * 1024),
+        "runs": [],
+    }
+    try:
+        keys = upload_corpus(prefix, args.files, args.size_mb * 1024 * 1024)
+        for mode in args.modes.split(","):
+            run = run_mode(mode.strip(), keys, prefix)
+            results["runs"].append(run)
+            print(
+                f"{run['mode']:>10}: peak RSS {run['peak_rss_mb']} MB, {run['seconds']}s, "
+                f"RSS after each file {run['rss_after_each_file_mb']}",
+                file=sys.stderr,
+            )
+    finally:
+        delete_prefix(prefix)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Бенчмарк полного конвейера transcode_service на синтетических роликах.
+
+В отличие от transcode_throughput, прогоняет настоящий _transcode_video_task_internal:
+чтение оригинала из S3 (presigned URL или скачивание), ffmpeg, загрузка сегментов
+и плейлистов в S3, записи в БД. Нужны БД и S3-совместимое хранилище — локальный MinIO
+из docker-compose (AWS_S3_ENDPOINT_URL и прочие переменные как у backend).
+
+Каждый прогон выполняется в отдельном процессе, чтобы CPU-секунды и пиковый RSS
+(os.wait4 учитывает дочерние ffmpeg) относились только к нему. Качество считается
+после прогона по скачанным media-плейлистам: VMAF, если ffmpeg собран с libvmaf, иначе PSNR.
+
+Запуск (из каталога backend):
+    python -m benchmarks.transcode_pipeline --clips "360x10,720x30,1080x30" \
+        --configs "4:ultrafast:28:10,4:veryfast:23:6" --output results.json
+
+Формат ролика: <высота>x<длительность, с>
+Формат конфигурации: <threads>:<preset>:<crf>:<segment_duration>
+
+Синтетические ролики уже в H.264/AAC, и с USE_COPY_CODEC сервис только переупаковал бы их
+(-c copy): preset, crf и оценка качества потеряли бы смысл. Поэтому по умолчанию copy
+отключен, --allow-copy включает его; фактический путь каждого прогона пишется в отчет (codec_path).
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from benchmarks.transcode_throughput import generate_clip
+
+BENCHMARK_QUEUE = "reencode"  # Профиль кодирования, который переопределяют конфигурации
+VMAF_RE = re.compile(r"VMAF score[:=]\s*([\d.]+)")
+PSNR_RE = re.compile(r"PSNR .*average:([\d.]+|inf)")
+
+
+def parse_clip(value: str) -> Dict[str, int]:
+    height, duration = value.split("x")
+    return {"height": int(height), "duration": int(duration)}
+
+
+def parse_config(value: str) -> Dict[str, Any]:
+    threads, preset, crf, segment_duration = value.split(":")
+    return {"threads": int(threads), "preset": preset, "crf": int(crf), "segment_duration": int(segment_duration)}
+
+
+def run_worker(file_id: str, segment_duration: int, allow_copy: bool) -> None:
+    """Точка входа дочернего процесса: только транскодирование, без подготовки и оценки."""
+    from app.services import transcode_service
+
+    transcode_service.SEGMENT_DURATION = segment_duration
+    transcode_service.USE_COPY_CODEC = allow_copy
+    transcode_service._transcode_video_task_internal(file_id, BENCHMARK_QUEUE)
+
+
+def _worker_env(config: Dict[str, Any], output_format: str, input_mode: str) -> Dict[str, str]:
+    prefix = f"TRANSCODE_{BENCHMARK_QUEUE.upper()}"
+    return dict(
+        os.environ,
+        TRANSCODE_THREADS_PER_JOB=str(config["threads"]),
+        TRANSCODE_OUTPUT_FORMAT=output_format,
+        TRANSCODE_INPUT_MODE=input_mode,
+        **{f"{prefix}_PRESET": config["preset"], f"{prefix}_CRF": str(config["crf"])},
+    )
+
+
+def transcode_in_subprocess(
+    file_id: str, config: Dict[str, Any], output_format: str, input_mode: str, allow_copy: bool
+) -> Dict[str, Any]:
+    """Запускает транскодирование в дочернем процессе и возвращает время и ресурсы."""
+    command = [
+        sys.executable, "-m", "benchmarks.transcode_pipeline",
+        "--worker", file_id, "--worker-segment-duration", str(config["segment_duration"]),
+    ]
+    if allow_copy:
+        command.append("--worker-allow-copy")
+    started = time.monotonic()
+    process = subprocess.Popen(command, env=_worker_env(config, output_format, input_mode))
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "exit_code": process.returncode,
+        "wall_seconds": round(time.monotonic() - started, 2),
+        "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 2),
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),  # Linux: килобайты; максимум по процессу и ffmpeg
+    }
+
+
+def create_benchmark_file(owner_id, clip_path: str, clip: Dict[str, int]) -> str:
+    from app.core.config import settings
+    from app.core.database import get_db_session, s3_client
+    from app.models.base import File
+
+    file_id = uuid.uuid4()
+    s3_key = f"benchmarks/{file_id}/source.mp4"
+    s3_client.upload_file(clip_path, settings.AWS_S3_BUCKET_NAME, s3_key)
+    with get_db_session() as db:
+        db.add(
+            File(
+                id=file_id,
+                original_name=f"benchmark_{clip['height']}p_{clip['duration']}s.mp4",
+                mime_type="video/mp4",
+                file_path=s3_key,
+                size=os.path.getsize(clip_path),
+                owner_id=owner_id,
+                transcoding_status="pending",
+            )
+        )
+    return str(file_id)
+
+
+def download_output(file_id: str, local_dir: str) -> int:
+    """Скачивает результат транскодирования и возвращает его суммарный размер в байтах."""
+    from app.core.config import settings
+    from app.core.database import s3_client
+
+    prefix = f"transcoded/{file_id}/"
+    total = 0
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=settings.AWS_S3_BUCKET_NAME, Prefix=prefix):
+        for item in page.get("Contents", []):
+            total += item["Size"]
+            local_path = os.path.join(local_dir, item["Key"][len(prefix):])
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            s3_client.download_file(settings.AWS_S3_BUCKET_NAME, item["Key"], local_path)
+    return total
+
+
+def has_libvmaf() -> bool:
+    result = subprocess.run(["ffmpeg", "-hide_banner", "-filters"], capture_output=True, text=True)
+    return "libvmaf" in result.stdout
+
+
+def measure_quality(distorted: str, reference: str, clip: Dict[str, int], use_vmaf: bool) -> Optional[Dict[str, Any]]:
+    """VMAF или PSNR рендитции относительно исходника (рендитция масштабируется до размера исходника)."""
+    width = int(clip["height"] * 16 / 9) // 2 * 2
+    metric = "libvmaf" if use_vmaf else "psnr"
+    filter_graph = (
+        f"[0:v]scale={width}:{clip['height']}:flags=bicubic,setpts=PTS-STARTPTS[dist];"
+        f"[1:v]setpts=PTS-STARTPTS[ref];[dist][ref]{metric}"
+    )
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-nostats", "-i", distorted, "-i", reference, "-lavfi", filter_graph, "-f", "null", "-"],
+        capture_output=True,
+        text=True,
+    )
+    match = (VMAF_RE if use_vmaf else PSNR_RE).search(result.stderr)
+    if not match:
+        return None
+    value = match.group(1)
+    return {"metric": "vmaf" if use_vmaf else "psnr", "value": float(value) if value != "inf" else None}
+
+
+def score_renditions(output_dir: str, reference: str, clip: Dict[str, int], use_vmaf: bool) -> Dict[str, Any]:
+    scores = {}
+    for root, _, files in os.walk(output_dir):
+        for name in sorted(files):
+            if name.endswith(".m3u8") and name != "master.m3u8":
+                playlist = os.path.join(root, name)
+                scores[os.path.relpath(playlist, output_dir)] = measure_quality(playlist, reference, clip, use_vmaf)
+    return scores
+
+
+def cleanup_benchmark_file(file_id: str) -> None:
+    from app.core.database import get_db_session
+    from app.models.base import File
+    from app.services.s3_transfer_service import delete_prefix
+
+    delete_prefix(f"transcoded/{file_id}/")
+    delete_prefix(f"benchmarks/{file_id}/")
+    with get_db_session() as db:
+        db.query(File).filter(File.id == file_id).delete(synchronize_session=False)
+
+
+def create_benchmark_user():
+    from app.core.database import get_db_session
+    from app.models.base import User
+
+    suffix = uuid.uuid4().hex[:12]
+    with get_db_session() as db:
+        user = User(username=f"benchmark_{suffix}", email=f"benchmark_{suffix}@example.invalid", password="!", is_active=False)
+        db.add(user)
+        db.flush()
+        return user.id
+
+
+def delete_benchmark_user(user_id) -> None:
+    from app.core.database import get_db_session
+    from app.models.base import User
+
+    with get_db_session() as db:
+        db.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+
+
+def run_benchmark(args) -> Dict[str, Any]:
+    from app.core.database import get_db_session
+    from app.models.base import File
+
+    clips = [parse_clip(value.strip()) for value in args.clips.split(",")]
+    configs = [parse_config(value.strip()) for value in args.configs.split(",")]
+    use_vmaf = not args.no_quality and has_libvmaf()
+    results = {
+        "output_format": args.output_format,
+        "input_mode": args.input_mode,
+        "allow_copy": args.allow_copy,
+        "quality_metric": None if args.no_quality else ("vmaf" if use_vmaf else "psnr"),
+        "runs": [],
+    }
+
+    work_dir = tempfile.mkdtemp(prefix="transcode_pipeline_bench_")
+    owner_id = create_benchmark_user()
+    try:
+        for clip in clips:
+            clip_path = os.path.join(work_dir, f"source_{clip['height']}p_{clip['duration']}s.mp4")
+            generate_clip(clip_path, clip["duration"], clip["height"])
+            for config in configs:
+                file_id = create_benchmark_file(owner_id, clip_path, clip)
+                try:
+                    run = dict(clip=clip, config=config, source_bytes=os.path.getsize(clip_path))
+                    run.update(
+                        transcode_in_subprocess(file_id, config, args.output_format, args.input_mode, args.allow_copy)
+                    )
+                    with get_db_session() as db:
+                        status, progress = (
+                            db.query(File.transcoding_status, File.transcoding_progress).filter(File.id == file_id).one()
+                        )
+                    run["status"] = status
+                    # copy — ролик только переупакован, и preset/crf конфигурации на результат не влияли
+                    run["codec_path"] = (progress or {}).get("codec_path")
+                    run["realtime_factor"] = round(clip["duration"] / run["wall_seconds"], 2) if run["wall_seconds"] else None
+
+                    output_dir = os.path.join(work_dir, file_id)
+                    run["output_bytes"] = download_output(file_id, output_dir)
+                    if not args.no_quality and run["status"] == "completed":
+                        run["quality"] = score_renditions(output_dir, clip_path, clip, use_vmaf)
+                    shutil.rmtree(output_dir, ignore_errors=True)
+                finally:
+                    cleanup_benchmark_file(file_id)
+
+                results["runs"].append(run)
+                print(
+                    f"{clip['height']}p/{clip['duration']}s {config}: {run['status']} ({run['codec_path']}), wall {run['wall_seconds']}s, "
+                    f"cpu {run['cpu_seconds']}s, rss {run['peak_rss_mb']}MB, output {run['output_bytes']} bytes"
+                )
+    finally:
+        delete_benchmark_user(owner_id)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clips", default="360x10,720x30", help="Ролики <высота>x<длительность> через запятую")
+    parser.add_argument(
+        "--configs", default="4:ultrafast:28:10", help="Конфигурации <threads>:<preset>:<crf>:<segment> через запятую"
+    )
+    parser.add_argument("--output-format", choices=["ts", "cmaf"], default=os.getenv("TRANSCODE_OUTPUT_FORMAT", "ts"))
+    parser.add_argument("--input-mode", choices=["stream", "download"], default=os.getenv("TRANSCODE_INPUT_MODE", "stream"))
+    parser.add_argument("--no-quality", action="store_true", help="Не считать VMAF/PSNR")
+    parser.add_argument(
+        "--allow-copy", action="store_true", help="Разрешить переупаковку без перекодирования (USE_COPY_CODEC)"
+    )
+    parser.add_argument("--output", help="Путь для JSON с результатами")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-segment-duration", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-allow-copy", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.worker_segment_duration, args.worker_allow_copy)
+        return
+
+    results = run_benchmark(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Бенчмарк пропускной способности транскодирования (видео/час) для разных конфигураций.
+
+Генерирует синтетические ролики через lavfi и прогоняет их через те же команды HLS,
+что и transcode_service, без S3 и БД.
+
+Запуск (из каталога backend):
+    python -m benchmarks.transcode_throughput --clips 8 --duration 60 \
+        --configs "1x1:ultrafast:28,4x4:ultrafast:28,8x4:veryfast:23"
+
+Формат конфигурации: <jobs>x<threads>:<preset>:<crf>
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from app.services.transcode_scheduler import build_plan
+from app.services.transcode_service import (
+    SEGMENT_DURATION,
+    _build_fast_hls_commands,
+    _get_all_renditions,
+    _run_ffmpeg_commands_fast,
+)
+
+
+def generate_clip(path: str, duration: int, height: int) -> None:
+    """Создает тестовый ролик H.264/AAC заданной длительности и высоты."""
+    width = int(height * 16 / 9) // 2 * 2
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=30:duration={duration}",
+            "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+            "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest",
+            path,
+        ],
+        check=True,
+    )
+
+
+def parse_config(value: str) -> Dict[str, Any]:
+    jobs_threads, preset, crf = value.split(":")
+    jobs, threads = jobs_threads.split("x")
+    return {"jobs": int(jobs), "threads": int(threads), "preset": preset, "crf": int(crf)}
+
+
+def transcode_clip(clip_path: str, work_dir: str, profile: Dict[str, Any]) -> float:
+    """Транскодирует один ролик в HLS и возвращает время в секундах."""
+    output_dir = tempfile.mkdtemp(dir=work_dir)
+    try:
+        commands = _build_fast_hls_commands(
+            clip_path, output_dir, _get_all_renditions(), SEGMENT_DURATION, True, profile=profile
+        )
+        started = time.monotonic()
+        if not _run_ffmpeg_commands_fast(commands, deadline=time.monotonic() + 3600, log_dir=output_dir):
+            raise RuntimeError(f"Transcoding failed for {clip_path}")
+        return time.monotonic() - started
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def run_config(clips: List[str], work_dir: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    profile = {"preset": config["preset"], "crf": config["crf"], "threads": config["threads"]}
+    started = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=config["jobs"]) as pool:
+        durations = list(pool.map(lambda clip: transcode_clip(clip, work_dir, profile), clips))
+    wall = time.monotonic() - started
+    return dict(
+        config,
+        videos=len(clips),
+        wall_seconds=round(wall, 2),
+        avg_job_seconds=round(sum(durations) / len(durations), 2),
+        videos_per_hour=round(len(clips) * 3600 / wall, 1),
+    )
+
+
+def main():
+    plan = build_plan()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clips", type=int, default=8, help="Количество роликов в прогоне")
+    parser.add_argument("--duration", type=int, default=60, help="Длительность ролика, секунды")
+    parser.add_argument("--height", type=int, default=720, help="Высота исходного ролика")
+    parser.add_argument(
+        "--configs",
+        default=f"1x1:ultrafast:28,{plan.max_jobs}x{plan.threads_per_job}:ultrafast:28",
+        help="Список конфигураций <jobs>x<threads>:<preset>:<crf> через запятую",
+    )
+    parser.add_argument("--output", help="Путь для JSON с результатами")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="transcode_bench_")
+    try:
+        source = os.path.join(work_dir, "source.mp4")
+        generate_clip(source, args.duration, args.height)
+        clips = [source] * args.clips
+
+        results = {
+            "host": plan.model_dump(),
+            "clip": {"duration": args.duration, "height": args.height},
+            "runs": [],
+        }
+        for raw_config in args.configs.split(","):
+            config = parse_config(raw_config.strip())
+            result = run_config(clips, work_dir, config)
+            results["runs"].append(result)
+            print(
+                f"{raw_config:>24}: {result['videos_per_hour']:>8} videos/hour "
+                f"(wall {result['wall_seconds']}s, avg job {result['avg_job_seconds']}s)"
+            )
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
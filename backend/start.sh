@@ -1,8 +1,36 @@
 #!/bin/sh
+# Роль контейнера (первый аргумент или START_ROLE):
+#   all    — API и воркеры Celery всех очередей (по умолчанию)
+#   api    — только API (воркеры запущены отдельно)
+#   worker — только воркеры Celery; очереди можно перечислить: ./start.sh worker thumbnails transcode_new
+ROLE="${1:-${START_ROLE:-all}}"
+[ $# -gt 0 ] && shift
 
-# Выполняем миграции базы данных
-echo "Running database migrations..."
-alembic upgrade head
+if [ "$ROLE" != "worker" ]; then
+    # Выполняем миграции базы данных
+    echo "Running database migrations..."
+    alembic upgrade head
+fi
+
+case "$ROLE" in
+    worker)
+        # Отдельный воркер на каждую очередь со своей конкуренцией (см. app/workers.py)
+        echo "Starting Celery workers..."
+        exec python -m app.workers "$@"
+        ;;
+    all)
+        # Транскодирование, миниатюры видео, бэкапы и перекодирование библиотеки идут через Celery:
+        # без воркеров задачи остаются в очереди
+        echo "Starting Celery workers..."
+        python -m app.workers &
+        ;;
+    api)
+        ;;
+    *)
+        echo "Unknown role: $ROLE (expected all, api or worker)"
+        exit 1
+        ;;
+esac
 
 # Запускаем приложение
 echo "Starting application..."
@@ -81,7 +81,10 @@ export const FileViewerModal: React.FC<FileViewerModalProps> = ({
   // --- ИЗМЕНЕНИЕ: функция для получения URL ---
   const getFileUrl = () => {
     // Проверяем, доступен ли HLS и завершена ли транскодировка
-    if (isVideo && file.transcoding_status === 'completed' && file.hls_manifest_path) {
+    // При прогрессивном транскодировании HLS доступен до завершения (плейлист типа EVENT)
+    const hlsPlayable = file.transcoding_status === 'completed'
+      || (file.transcoding_status === 'processing' && !!file.transcoding_progress?.playable);
+    if (isVideo && hlsPlayable && file.hls_manifest_path) {
         // Возвращаем URL к эндпоинту манифеста
         // Предполагаем, что бэкенд предоставляет эндпоинт /files/{id}/manifest/hls/{path}
         // и file.hls_manifest_path содержит путь относительно этого эндпоинта
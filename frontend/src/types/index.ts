@@ -34,11 +34,20 @@ export interface FileItem {
   owner_id: string;
   transcoding_status?: 'pending' | 'processing' | 'completed' | 'failed';
   hls_manifest_path?: string;
+  transcoding_progress?: TranscodingProgress | null;
   views_count?: number;
   downloads_count?: number;
   duration?: number | null;
 }
 
+export interface TranscodingProgress {
+  mode?: 'progressive' | 'batch';
+  percent?: number | null;
+  segments_done?: number | null;
+  playable?: boolean;
+  updated_at?: string;
+}
+
 export interface Tag {
   id: string;
   name: string;